@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Hashable
+
+from telegram import InputMediaDocument, InputMediaPhoto, Message
+
+logger = logging.getLogger(__name__)
+
+# В одном альбоме Telegram — от 2 до 10 элементов
+MEDIA_GROUP_MAX = 10
+
+
+# ================== Вложения =======================
+def attachment_from_message(message: Message) -> dict | None:
+    """
+    Фото (берётся самый крупный размер) или файл из сообщения -> запись вложения.
+    file_unique_id одинаков у одного и того же файла в любых сообщениях — по нему дедупликация.
+    """
+    if message.photo:
+        photo = message.photo[-1]
+        return {
+            "kind": "photo",
+            "file_id": photo.file_id,
+            "file_unique_id": photo.file_unique_id,
+            "file_name": None,
+            "mime_type": "image/jpeg",
+            "file_size": photo.file_size,
+        }
+    if message.document:
+        doc = message.document
+        return {
+            "kind": "document",
+            "file_id": doc.file_id,
+            "file_unique_id": doc.file_unique_id,
+            "file_name": doc.file_name,
+            "mime_type": doc.mime_type,
+            "file_size": doc.file_size,
+        }
+    return None
+
+
+def media_batches(attachments: list[dict], caption: str | None = None) -> list[list]:
+    """
+    Разбивает вложения на альбомы для send_media_group: фото и документы в одном альбоме
+    смешивать нельзя, в альбоме не больше MEDIA_GROUP_MAX элементов. Пачку из одного
+    элемента отправляют обычным send_photo/send_document. caption — у первого элемента.
+    """
+    batches = []
+    for kind, cls in (("photo", InputMediaPhoto), ("document", InputMediaDocument)):
+        items = [a for a in attachments if a["kind"] == kind]
+        for i in range(0, len(items), MEDIA_GROUP_MAX):
+            batches.append([
+                cls(a["file_id"], caption=caption if not batches and j == 0 else None)
+                for j, a in enumerate(items[i:i + MEDIA_GROUP_MAX])
+            ])
+    return batches
+
+
+# ================== Сбор альбомов ==================
+class MediaGroupCollector:
+    """
+    Альбом приходит отдельными апдейтами с общим media_group_id, и Telegram не сообщает,
+    какая часть последняя. touch() на каждую часть (пере)заводит ожидание: finish()
+    вызывается один раз, когда window секунд не было новых частей с этим ключом.
+    """
+
+    def __init__(self, *, window: float = 1.5):
+        self.window = window
+        self._deadlines: dict = {}  # ключ -> время loop.time(), после которого альбом собран
+        self._finish: dict = {}  # ключ -> корутина-функция завершения
+        self._tasks: dict = {}  # ключ -> asyncio.Task
+        self._closing = asyncio.Event()  # flush(): больше не ждём, завершаем сразу
+
+    def touch(self, key: Hashable, finish: Callable[[], Awaitable]):
+        loop = asyncio.get_running_loop()
+        self._deadlines[key] = loop.time() + self.window
+        self._finish[key] = finish
+        if key not in self._tasks:
+            self._tasks[key] = loop.create_task(self._wait(key))
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    @property
+    def closing(self) -> bool:
+        return self._closing.is_set()
+
+    async def sleep(self, delay: float):
+        """
+        asyncio.sleep(delay), который прерывается flush(): finish(), досчитывающий своё
+        ожидание, после него проверяет closing и завершает альбом не дожидаясь.
+        """
+        try:
+            await asyncio.wait_for(self._closing.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def flush(self):
+        """
+        Завершает все собираемые альбомы, не дожидаясь новых частей (при остановке бота).
+        """
+        self._closing.set()
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks.values()), return_exceptions=True)
+
+    async def _wait(self, key):
+        loop = asyncio.get_running_loop()
+        try:
+            while (delay := self._deadlines[key] - loop.time()) > 0 and not self.closing:
+                await self.sleep(delay)
+            del self._deadlines[key]
+            finish = self._finish.pop(key)
+            try:
+                await finish()
+            except Exception as e:
+                logger.error(f"Ошибка при завершении альбома {key}: {e}")
+        finally:
+            self._tasks.pop(key, None)
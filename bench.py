@@ -0,0 +1,455 @@
+"""
+Нагрузочный стенд: настоящий bot.py против локального поддельного Bot API.
+
+Поддельный API (tornado) записывает вызовы sendMessage/editMessageText/sendPhoto и т.д.,
+умеет добавлять задержку и отвечать 429 с retry_after. Стенд поднимает приложение из
+bot.build_application() с временной БД, шлёт синтетические апдейты в его вебхук
+(WebhookIngest) и по фазам
+(регистрация, создание тикетов, гонка админов за тикет + закрытие, отзывы) печатает
+апдейты/с, p50/p99 хендлеров, запросы к БД на апдейт и вызовы API.
+
+    python bench.py --users 200 --latency 0.05 --flood 0.02
+    python bench.py --users 500 --direct --json before.json   # без HTTP, сразу в очередь приёма
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import httpx
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+
+from ingest import SECRET_HEADER
+
+BENCH_TOKEN = "123456:bench"
+BENCH_CHANNEL_ID = -1001000000000
+ADMIN_IDS = (900001, 900002)
+
+
+# ================== Поддельный Bot API =============
+class FakeBotAPI:
+    """
+    Отвечает на методы Bot API правдоподобными объектами. latency — задержка ответа, с;
+    flood — доля запросов, на которые вернётся 429 с retry_after.
+    """
+
+    def __init__(self, *, latency: float = 0.0, flood: float = 0.0, retry_after: int = 1):
+        self.latency = latency
+        self.flood = flood
+        self.retry_after = retry_after
+        self.calls: list[tuple[str, dict]] = []
+        self.flooded = 0
+        self._message_ids = defaultdict(lambda: itertools.count(1))
+        self._server: tornado.httpserver.HTTPServer | None = None
+        self.port = 0
+
+    def start(self):
+        api = self
+
+        class Handler(tornado.web.RequestHandler):
+            async def post(self, method):
+                await api.handle(self, method)
+
+            get = post
+
+        sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+        self.port = sockets[0].getsockname()[1]
+        self._server = tornado.httpserver.HTTPServer(tornado.web.Application([(r"/bot[^/]+/(\w+)", Handler)]))
+        self._server.add_sockets(sockets)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.stop()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def by_method(self) -> Counter:
+        return Counter(method for method, _ in self.calls)
+
+    def _message(self, chat_id: int, params: dict, message_id: int | None = None) -> dict:
+        message = {
+            "message_id": message_id or next(self._message_ids[chat_id]),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "channel" if chat_id < 0 else "private"},
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        if "photo" in params:
+            message["photo"] = [{"file_id": params["photo"], "file_unique_id": "u" + params["photo"][:8], "width": 1, "height": 1}]
+        if params.get("reply_markup"):
+            markup = json.loads(params["reply_markup"])
+            if "inline_keyboard" in markup:
+                message["reply_markup"] = markup
+        return message
+
+    def _result(self, method: str, params: dict):
+        chat_id = int(params.get("chat_id", 0) or 0)
+        if method == "getMe":
+            return {"id": int(BENCH_TOKEN.split(":")[0]), "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method in ("sendMessage", "sendPhoto", "sendDocument"):
+            return self._message(chat_id, params)
+        if method in ("editMessageText", "editMessageCaption"):
+            return self._message(chat_id, params, int(params["message_id"]))
+        if method == "sendMediaGroup":
+            media = json.loads(params.get("media", "[]"))
+            return [self._message(chat_id, {}) | {"document": {"file_id": f"doc{i}", "file_unique_id": f"doc{i}"}} for i, _ in enumerate(media)]
+        return True
+
+    async def handle(self, request: tornado.web.RequestHandler, method: str):
+        params = {k: v[-1].decode() for k, v in request.request.body_arguments.items()}
+        if request.request.headers.get("Content-Type", "").startswith("application/json") and request.request.body:
+            params = {k: v if isinstance(v, str) else json.dumps(v) for k, v in json.loads(request.request.body).items()}
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        if self.flood and method not in ("getMe", "setWebhook", "deleteWebhook") and random.random() < self.flood:
+            self.flooded += 1
+            request.set_status(429)
+            request.finish({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+            return
+        self.calls.append((method, params))
+        request.finish({"ok": True, "result": self._result(method, params)})
+
+
+# ================== Синтетические апдейты ==========
+class UpdateFactory:
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def user(uid: int) -> dict:
+        return {"id": uid, "is_bot": False, "first_name": f"User{uid}", "username": f"user{uid}"}
+
+    def message(self, uid: int, text: str) -> dict:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": self.user(uid),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def callback(self, uid: int, data: str, *, chat_id: int | None = None, message_id: int = 1) -> dict:
+        chat_id = uid if chat_id is None else chat_id
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self.user(uid),
+                "chat_instance": str(chat_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "channel" if chat_id < 0 else "private"},
+                    "text": "…",
+                },
+            },
+        }
+
+
+# ================== Прогон =========================
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def record_samples(histogram) -> dict:
+    """
+    Дублирует наблюдения гистограммы в сырые списки (метки -> значения) для точных перцентилей.
+    """
+    samples = defaultdict(list)
+    observe = histogram.observe
+
+    def wrapper(value, *labels):
+        samples[labels].append(value)
+        observe(value, *labels)
+
+    histogram.observe = wrapper
+    return samples
+
+
+def histogram_counts(histogram) -> Counter:
+    return Counter({labels[0]: sum(series[:-1]) for labels, series in histogram.values.items()})
+
+
+class Bench:
+    def __init__(self, args, bot, metrics):
+        self.args = args
+        self.bot = bot
+        self.metrics = metrics
+        self.api = FakeBotAPI(latency=args.latency, flood=args.flood, retry_after=args.retry_after)
+        self.updates = UpdateFactory()
+        self.handler_samples = record_samples(metrics.HANDLER_SECONDS)
+        self.sent = 0
+        self.results: list[dict] = []
+        self.app = None
+        self.client: httpx.AsyncClient | None = None
+        self.webhook_url = ""
+
+    # ---------- запуск/остановка ----------
+    async def setup(self):
+        self.api.start()
+        if not self.args.telegram_limits:
+            # локальный API не ограничивает частоту; лимиты Telegram проверяются флагом --telegram-limits
+            outbound = self.bot.outbound
+            outbound._global.rate = outbound._global.capacity = outbound._global.tokens = 1e9
+            outbound.group_rate = outbound.group_burst = outbound.private_rate = outbound.private_burst = 1e9
+        self.bot.card_edits.delay = self.args.edit_delay
+        self.bot.db.open()
+        self.app = self.bot.build_application(base_url=self.api.base_url)
+        await self.app.initialize()
+        await self.app.start()
+        sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+        port = sockets[0].getsockname()[1]
+        for sock in sockets:
+            sock.close()
+        await self.bot.ingest.start("127.0.0.1", port)
+        if not self.args.direct:
+            self.webhook_url = f"http://127.0.0.1:{port}{self.bot.ingest.path}"
+            self.client = httpx.AsyncClient(
+                headers={SECRET_HEADER: self.bot.WEBHOOK_SECRET},
+                limits=httpx.Limits(max_connections=self.args.concurrency),
+            )
+
+    async def teardown(self):
+        if self.client is not None:
+            await self.client.aclose()
+        await self.bot.ingest.stop()
+        await self.app.stop()
+        await self.app.post_stop(self.app)
+        await self.app.shutdown()
+        self.bot.db.close()
+        self.api.stop()
+
+    # ---------- отправка апдейтов ----------
+    async def post(self, update: dict):
+        self.sent += 1
+        if self.args.direct:
+            if not await self.bot.ingest.submit(update["update_id"], update):
+                raise RuntimeError("очередь приёма переполнена")
+            return
+        resp = await self.client.post(self.webhook_url, json=update)
+        resp.raise_for_status()
+
+    async def run_users(self, uids, script):
+        """
+        script(uid) — список апдейтов одного пользователя; пользователи идут параллельно,
+        апдейты одного пользователя — строго по очереди.
+        """
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def one(uid):
+            async with semaphore:
+                for update in script(uid):
+                    await self.post(update)
+
+        await asyncio.gather(*(one(uid) for uid in uids))
+
+    def processed(self) -> int:
+        return sum(len(v) for v in self.handler_samples.values())
+
+    async def wait_processed(self, timeout: float = 600.0):
+        deadline = time.monotonic() + timeout
+        while self.processed() < self.sent:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"обработано {self.processed()} из {self.sent} апдейтов")
+            await asyncio.sleep(0.01)
+
+    async def phase(self, name: str, body):
+        sent, processed = self.sent, self.processed()
+        samples_before = {k: len(v) for k, v in self.handler_samples.items()}
+        db_before = histogram_counts(self.metrics.DB_SECONDS)
+        api_before = self.api.by_method()
+        flooded_before = self.api.flooded
+        started = time.perf_counter()
+        await body()
+        await self.wait_processed()
+        elapsed = time.perf_counter() - started
+        count = self.sent - sent
+        latencies = {
+            labels[0]: values[samples_before.get(labels, 0):]
+            for labels, values in self.handler_samples.items()
+            if len(values) > samples_before.get(labels, 0)
+        }
+        every = [v for values in latencies.values() for v in values]
+        db_ops = histogram_counts(self.metrics.DB_SECONDS) - db_before
+        result = {
+            "phase": name,
+            "updates": count,
+            "processed": self.processed() - processed,
+            "seconds": round(elapsed, 3),
+            "updates_per_sec": round(count / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(every, 0.5) * 1000, 2),
+            "p99_ms": round(percentile(every, 0.99) * 1000, 2),
+            "handlers": {
+                h: {"count": len(v), "p50_ms": round(percentile(v, 0.5) * 1000, 2), "p99_ms": round(percentile(v, 0.99) * 1000, 2)}
+                for h, v in sorted(latencies.items())
+            },
+            "db_ops_per_update": round(sum(db_ops.values()) / count, 2) if count else 0.0,
+            "db_ops": dict(db_ops.most_common()),
+            "api_calls": dict((self.api.by_method() - api_before).most_common()),
+            "api_429": self.api.flooded - flooded_before,
+        }
+        self.results.append(result)
+        print_phase(result)
+
+    # ---------- сценарий ----------
+    async def run(self):
+        f = self.updates
+        uids = [100000 + i for i in range(self.args.users)]
+        menu_create = self.bot.MENU_CREATE
+
+        await self.phase("registration", lambda: self.run_users(uids, lambda uid: [
+            f.message(uid, "/start"),
+            f.message(uid, f"Иван Тестов {uid}"),
+            f.message(uid, f"Этаж {uid % 9 + 1}, кабинет {uid % 300}"),
+        ]))
+
+        await self.phase("tickets", lambda: self.run_users(uids, lambda uid: [
+            f.message(uid, menu_create),
+            f.message(uid, f"Не работает принтер у {uid}.\nСрочно!"),
+            f.callback(uid, "skip_photo"),
+        ]))
+
+        cards = self.channel_cards()
+
+        async def admins():
+            # два админа одновременно жмут "Взять" на каждой карточке, затем первый закрывает
+            async def race(message_id, buttons):
+                await asyncio.gather(*(
+                    self.post(f.callback(admin, buttons["assign"], chat_id=BENCH_CHANNEL_ID, message_id=message_id))
+                    for admin in ADMIN_IDS
+                ))
+                await self.post(f.callback(ADMIN_IDS[0], buttons["close"], chat_id=BENCH_CHANNEL_ID, message_id=message_id))
+
+            semaphore = asyncio.Semaphore(self.args.concurrency)
+
+            async def one(item):
+                async with semaphore:
+                    await race(*item)
+
+            await asyncio.gather(*(one(item) for item in cards.items()))
+
+        await self.phase("admin_assign_close", admins)
+
+        ratings = self.rating_requests()
+        await self.phase("feedback", lambda: self.run_users(list(ratings), lambda uid: [
+            f.callback(uid, ratings[uid]),
+            f.message(uid, "Спасибо, всё починили"),
+        ]))
+
+        # остаток отложенных правок карточек — в последнюю фазу не входит
+        await self.bot.card_edits.flush()
+
+    def channel_cards(self) -> dict[int, dict]:
+        """
+        message_id карточки в канале -> {"assign": data, "close": data} из записанных sendMessage.
+        """
+        cards = {}
+        for method, params in self.api.calls:
+            if method != "sendMessage" or int(params.get("chat_id", 0)) != BENCH_CHANNEL_ID or not params.get("reply_markup"):
+                continue
+            buttons = [b for row in json.loads(params["reply_markup"])["inline_keyboard"] for b in row]
+            data = {}
+            for button in buttons:
+                action = self.bot.codec.decode(button["callback_data"]).action
+                data[action] = button["callback_data"]
+            cards[len(cards) + 1] = data
+        return cards
+
+    def rating_requests(self) -> dict[int, str]:
+        """
+        user_id -> callback_data кнопки "5⭐️" из присланных пользователю клавиатур оценки.
+        """
+        ratings = {}
+        for method, params in self.api.calls:
+            if method == "sendMessage" and params.get("reply_markup") and int(params["chat_id"]) > 0:
+                markup = json.loads(params["reply_markup"]).get("inline_keyboard")
+                data = markup[0][-1].get("callback_data", "") if markup else ""
+                if self.bot.codec.is_encoded(data) and self.bot.codec.decode(data).action == "rate":
+                    ratings[int(params["chat_id"])] = data
+        return ratings
+
+
+# ================== Отчёт ==========================
+def print_phase(r: dict):
+    print(f"\n== {r['phase']}: {r['updates']} апдейтов за {r['seconds']} с — {r['updates_per_sec']} апд/с")
+    print(f"   хендлеры: p50 {r['p50_ms']} мс, p99 {r['p99_ms']} мс")
+    for name, h in r["handlers"].items():
+        print(f"     {name:<16} n={h['count']:<6} p50 {h['p50_ms']:>8} мс  p99 {h['p99_ms']:>8} мс")
+    top_db = ", ".join(f"{k}={v}" for k, v in list(r["db_ops"].items())[:6])
+    print(f"   БД: {r['db_ops_per_update']} запросов/апдейт ({top_db})")
+    api = ", ".join(f"{k}={v}" for k, v in r["api_calls"].items())
+    print(f"   Bot API: {api}; 429: {r['api_429']}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный стенд бота против поддельного Bot API")
+    parser.add_argument("--users", type=int, default=100, help="число синтетических пользователей")
+    parser.add_argument("--concurrency", type=int, default=50, help="сколько пользователей шлют апдейты одновременно")
+    parser.add_argument("--latency", type=float, default=0.0, help="средняя задержка ответа Bot API, с")
+    parser.add_argument("--flood", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument("--edit-delay", type=float, default=0.2, help="задержка склейки правок карточек, с")
+    parser.add_argument("--telegram-limits", action="store_true", help="оставить лимиты Telegram в планировщике исходящих")
+    parser.add_argument("--direct", action="store_true", help="класть апдейты прямо в очередь приёма, минуя HTTP вебхука")
+    parser.add_argument("--json", metavar="PATH", help="сохранить результаты фаз в JSON для сравнения прогонов")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args()
+
+
+async def amain(args) -> int:
+    workdir = tempfile.mkdtemp(prefix="tgbot-bench-")
+    os.environ["BOT_TOKEN"] = BENCH_TOKEN
+    os.environ["CHANNEL_ID"] = str(BENCH_CHANNEL_ID)
+    os.environ["DB_PATH"] = os.path.join(workdir, "bench.db")
+
+    import logging
+
+    import bot
+    import metrics
+
+    logging.getLogger().setLevel(args.log_level)
+    bench = Bench(args, bot, metrics)
+    await bench.setup()
+    try:
+        await bench.run()
+    finally:
+        await bench.teardown()
+
+    errors = dict(metrics.HANDLER_ERRORS.values)
+    total = sum(r["updates"] for r in bench.results)
+    seconds = sum(r["seconds"] for r in bench.results)
+    print(f"\nИтого: {total} апдейтов за {seconds:.2f} с — {total / seconds:.1f} апд/с; ошибки хендлеров: {errors or 'нет'}")
+    print(f"Планировщик исходящих: {bot.outbound.stats}; правки карточек: {bot.card_edits.stats}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "phases": bench.results, "handler_errors": {k[0]: v for k, v in errors.items()}}, f, ensure_ascii=False, indent=2)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(amain(parse_args())))
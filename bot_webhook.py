@@ -1,63 +1,173 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import asyncio
+import importlib.util
 import json
+import logging
 import os
-import requests
+
+import httpx
+import tornado.httpserver
+import tornado.web
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-WEBHOOK_URL = f"https://api.telegram.org/bot{BOT_TOKEN}/"
+API_URL = f"https://api.telegram.org/bot{BOT_TOKEN}/"
+PORT = int(os.getenv("PORT", "8080"))
+
+# Настройки HTTP-клиента к api.telegram.org
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+
+# HTTP/2 — если установлен пакет h2 (python-telegram-bot[http2])
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+# Методы, которые можно безопасно повторить, даже если запрос мог дойти до Telegram
+IDEMPOTENT_METHODS = frozenset({"getMe", "getWebhookInfo", "setWebhook", "deleteWebhook"})
+# Ошибки, при которых запрос точно не был отправлен: повторять можно любой метод
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramHTTPError(Exception):
+    """
+    Ответ Bot API, который не удалось разобрать как JSON (например, HTML-страница
+    прокси с 502), или 5xx/429 после исчерпания повторов.
+    """
+
+    def __init__(self, method: str, status_code: int, body: str):
+        super().__init__(f"{method}: HTTP {status_code}: {body[:200]!r}")
+        self.method = method
+        self.status_code = status_code
+
+
+class TelegramClient:
+    """
+    Один httpx.AsyncClient на весь процесс: соединения с api.telegram.org живут в пуле
+    (keep-alive), поэтому TCP+TLS рукопожатие делается один раз, а не на каждый ответ.
+    При наличии пакета h2 запросы идут по HTTP/2 и мультиплексируются в одном соединении.
+    Повторы (до retries раз, с экспоненциальной паузой):
+    - 429 и ошибки, при которых запрос не ушёл (нет соединения, таймаут пула), — для любого метода;
+    - 5xx и ошибки чтения ответа — только для идемпотентных методов: sendMessage, который
+      мог дойти до Telegram, при повторе отправил бы пользователю дубль.
+    """
+
+    def __init__(self, api_url: str, *, timeout: float, connect_timeout: float, retries: int, max_connections: int):
+        self.retries = retries
+        self._client = httpx.AsyncClient(
+            base_url=api_url,
+            http2=HTTP2,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections, keepalive_expiry=120),
+        )
+
+    async def call(self, method: str, **params) -> dict:
+        idempotent = method in IDEMPOTENT_METHODS
+        for attempt in range(self.retries + 1):
+            delay = 0.5 * 2 ** attempt
+            last = attempt == self.retries
+            try:
+                resp = await self._client.post(method, json=params)
+            except httpx.TransportError as e:
+                if last or not (idempotent or isinstance(e, NOT_SENT_ERRORS)):
+                    raise
+                logger.warning(f"{method}: {e!r}, повтор через {delay:.1f} с")
+            else:
+                retryable = resp.status_code == 429 or (resp.status_code >= 500 and idempotent)
+                if not retryable:
+                    return self._json(method, resp)
+                if last:
+                    raise TelegramHTTPError(method, resp.status_code, resp.text)
+                if resp.status_code == 429:
+                    try:
+                        retry_after = resp.json().get("parameters", {}).get("retry_after", delay)
+                    except ValueError:
+                        retry_after = delay
+                    delay = max(delay, retry_after)
+                logger.warning(f"{method}: HTTP {resp.status_code}, повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _json(method: str, resp: httpx.Response) -> dict:
+        """Тело ответа Bot API; не-JSON (страница ошибки прокси) — понятная ошибка вместо JSONDecodeError."""
+        try:
+            return resp.json()
+        except ValueError:
+            raise TelegramHTTPError(method, resp.status_code, resp.text) from None
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+telegram = TelegramClient(
+    API_URL,
+    timeout=HTTP_TIMEOUT,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    retries=HTTP_RETRIES,
+    max_connections=HTTP_MAX_CONNECTIONS,
+)
+# ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+background: set[asyncio.Task] = set()
 
 
-def send_message(chat_id, text):
+async def send_message(chat_id, text):
     """Отправка сообщения пользователю"""
     try:
-        requests.post(WEBHOOK_URL + "sendMessage", json={"chat_id": chat_id, "text": text})
+        await telegram.call("sendMessage", chat_id=chat_id, text=text)
     except Exception as e:
         print("❌ Ошибка при отправке сообщения:", e)
 
 
-class WebhookHandler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        if self.path != "/webhook":
-            self.send_response(404)
-            self.end_headers()
-            return
+async def handle_update(update: dict):
+    print("🔥 Получено обновление:", update.get("update_id"))
+
+    # если пришло текстовое сообщение
+    if "message" in update and "text" in update["message"]:
+        chat_id = update["message"]["chat"]["id"]
+        text = update["message"]["text"]
+        await send_message(chat_id, f"Ты написал: {text}")
+
 
-        # читаем тело запроса
-        length = int(self.headers.get("Content-Length", 0))
-        body = self.rfile.read(length)
+class WebhookHandler(tornado.web.RequestHandler):
+    def post(self):
         try:
-            update = json.loads(body)
+            update = json.loads(self.request.body)
         except Exception as e:
             print("❌ Ошибка при разборе JSON:", e)
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(b"Invalid JSON")
+            self.set_status(400)
+            self.finish("Invalid JSON")
             return
 
-        print("🔥 Получено обновление:", json.dumps(update, indent=2, ensure_ascii=False))
+        # Telegram ждёт быстрый ответ: подтверждаем сразу, отвечаем пользователю в фоне
+        task = asyncio.create_task(handle_update(update))
+        background.add(task)
+        task.add_done_callback(background.discard)
+        self.finish("OK")
 
-        # если пришло текстовое сообщение
-        if "message" in update and "text" in update["message"]:
-            chat_id = update["message"]["chat"]["id"]
-            text = update["message"]["text"]
-            send_message(chat_id, f"Ты написал: {text}")
 
-        # Telegram ждёт быстрый ответ
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(b"OK")
+async def main(public_url: str):
+    server = tornado.httpserver.HTTPServer(tornado.web.Application([("/webhook", WebhookHandler)]))
+    server.listen(PORT, "0.0.0.0")
+    print(f"Слушаю Telegram webhook на порту {PORT} (HTTP/2 к API: {'да' if HTTP2 else 'нет'})")
 
+    # --- УДАЛЯЕМ СТАРЫЙ ВЕБХУК + СТАВИМ НОВЫЙ ---
+    try:
+        delete_hook = await telegram.call("deleteWebhook", drop_pending_updates=True)
+        print("Очистка старого вебхука:", delete_hook)
+        set_hook = await telegram.call("setWebhook", url=public_url)
+        print("Регистрация нового вебхука:", set_hook)
 
-if __name__ == "__main__":
-    port = 8080
-    server = HTTPServer(("0.0.0.0", port), WebhookHandler)
-    print(f"Слушаю Telegram webhook на порту {port}")
+        await asyncio.Event().wait()
+    finally:
+        server.stop()
+        await asyncio.gather(*background, return_exceptions=True)
+        await telegram.aclose()
 
-    # --- УДАЛЯЕМ СТАРЫЙ ВЕБХУК + СТАВИМ НОВЫЙ ---
-    public_url = input("Введи публичный URL (например https://yourdomain/webhook): ").strip()
-    delete_hook = requests.get(WEBHOOK_URL + "deleteWebhook", params={"drop_pending_updates": "true"})
-    print("Очистка старого вебхука:", delete_hook.json())
-    set_hook = requests.get(WEBHOOK_URL + "setWebhook", params={"url": public_url})
-    print("Регистрация нового вебхука:", set_hook.json())
 
-    server.serve_forever()
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    public_url = os.getenv("WEBHOOK_URL") or input("Введи публичный URL (например https://yourdomain/webhook): ").strip()
+    try:
+        asyncio.run(main(public_url))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,85 @@
+import base64
+import hashlib
+import hmac
+import os
+import struct
+from typing import NamedTuple
+
+# Формат: "~" + base64url(версия, код действия, id тикета, аргумент + усечённая HMAC-подпись).
+# 19 символов при лимите Telegram в 64 байта; старые "assign_123" не начинаются с "~".
+PREFIX = "~"
+VERSION = 1
+ACTIONS = {"assign": 1, "unassign": 2, "close": 3, "rate": 4, "history": 5, "search": 6}
+# Аргумент кнопок листания ("history", "search"): вместо id тикета — курсор (id крайнего тикета страницы)
+PAGE_OLDER = 0
+PAGE_NEWER = 1
+# У "search" аргумент — номер запроса (1..255) в user_data админа: сам запрос в callback_data не влезает
+SEARCH_QUERY_IDS = 255
+ACTION_NAMES = {code: name for name, code in ACTIONS.items()}
+
+_BODY = struct.Struct(">BBIB")  # версия, действие, id тикета, аргумент
+_SIGNATURE_SIZE = 6
+_ENCODED_SIZE = len(PREFIX) + len(base64.urlsafe_b64encode(bytes(_BODY.size + _SIGNATURE_SIZE)).rstrip(b"="))
+
+
+class CallbackPayload(NamedTuple):
+    action: str
+    ticket_id: int
+    arg: int = 0
+
+
+class InvalidCallbackData(ValueError):
+    """
+    Данные кнопки не прошли проверку: reason — "malformed", "forged" или "stale".
+    """
+
+    def __init__(self, reason: str, data: str):
+        super().__init__(f"{reason}: {data!r}")
+        self.reason = reason
+
+
+class CallbackCodec:
+    """
+    Компактная подписанная упаковка callback_data. Подпись (HMAC от секрета бота)
+    отсекает подделанные данные, номер версии — кнопки, выпущенные старым форматом/ключом.
+    """
+
+    def __init__(self, secret: str, *, version: int = VERSION):
+        self.version = version
+        self._key = hashlib.sha256(b"callback-data:" + secret.encode()).digest()
+
+    def _sign(self, body: bytes) -> bytes:
+        return hmac.new(self._key, body, hashlib.sha256).digest()[:_SIGNATURE_SIZE]
+
+    @staticmethod
+    def is_encoded(data: str) -> bool:
+        return data.startswith(PREFIX)
+
+    def encode(self, action: str, ticket_id: int, arg: int = 0) -> str:
+        body = _BODY.pack(self.version, ACTIONS[action], ticket_id, arg)
+        return PREFIX + base64.urlsafe_b64encode(body + self._sign(body)).rstrip(b"=").decode()
+
+    def decode(self, data: str) -> CallbackPayload:
+        if len(data) != _ENCODED_SIZE or not data.startswith(PREFIX):
+            raise InvalidCallbackData("malformed", data)
+        try:
+            raw = base64.urlsafe_b64decode(data[len(PREFIX):] + "==")
+        except ValueError:
+            raise InvalidCallbackData("malformed", data) from None
+        body, signature = raw[:_BODY.size], raw[_BODY.size:]
+        if not hmac.compare_digest(signature, self._sign(body)):
+            raise InvalidCallbackData("forged", data)
+        version, code, ticket_id, arg = _BODY.unpack(body)
+        if version != self.version:
+            raise InvalidCallbackData("stale", data)
+        action = ACTION_NAMES.get(code)
+        if action is None:
+            raise InvalidCallbackData("malformed", data)
+        return CallbackPayload(action, ticket_id, arg)
+
+
+# Общий экземпляр: кнопки из render.py подписываются им же. В проде CALLBACK_SECRET обязателен:
+# без него ключ выводится из BOT_TOKEN, и после смены токена все уже опубликованные кнопки
+# карточек молча перестают проходить проверку подписи.
+CALLBACK_SECRET = os.getenv("CALLBACK_SECRET", "")
+codec = CallbackCodec(CALLBACK_SECRET or os.getenv("BOT_TOKEN") or "")
@@ -0,0 +1,170 @@
+import asyncio
+import itertools
+import logging
+import os
+import secrets
+import socket
+import time
+from contextlib import asynccontextmanager
+from typing import Hashable
+
+from telegram import Update
+
+from db import AsyncDatabase
+from ordering import KeyedLocks, ordering_key
+
+logger = logging.getLogger(__name__)
+
+
+# ================== Координация реплик =============
+class Cluster:
+    """
+    Несколько реплик бота за одним балансировщиком вебхука, общая БД (PostgreSQL или файл
+    SQLite на общем томе одного хоста). Всё согласование идёт через эту БД:
+
+    - lock(key): распределённая блокировка — аренда строки в leases на ttl секунд,
+      продлевается, пока держится; если реплика упала, аренда просто истекает;
+    - process_update(): апдейт обрабатывается под блокировкой своего ключа упорядочения
+      (пользователь или тикет, см. ordering.py) — шаги диалога и переходы тикета не
+      перемешиваются, на какую бы реплику ни пришёл апдейт;
+    - состояние диалога (user_data) читается из БД перед апдейтом и пишется сразу после,
+      ещё под блокировкой — следующий апдейт пользователя на другой реплике увидит его;
+    - claim_update(): повтор update_id от Telegram, принятый другой репликой, отсекается;
+    - run_once(): периодическую задачу в каждый период выполняет только одна реплика.
+
+    С enabled=False (одна реплика) БД не участвует: lock(key) — обычная блокировка в
+    процессе, user_data живёт в памяти и сохраняется persistence PTB.
+    """
+
+    def __init__(
+        self,
+        db: AsyncDatabase,
+        *,
+        enabled: bool,
+        node_id: str | None = None,
+        lock_ttl: float = 30.0,
+        poll_interval: float = 0.02,
+        key=ordering_key,
+    ):
+        self.db = db
+        self.enabled = enabled
+        self.node_id = node_id or f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.key = key
+        self.stats = {"locks": 0, "lock_waits": 0, "duplicates": 0}
+        self._tokens = itertools.count(1)
+        self._local = KeyedLocks()  # блокировки при enabled=False
+
+    # ---------- блокировки ----------
+    @asynccontextmanager
+    async def lock(self, key: Hashable | None):
+        if key is None:
+            yield
+            return
+        if not self.enabled:
+            async with self._local.lock(key):
+                yield
+            return
+        name = "lock:" + ":".join(map(str, key)) if isinstance(key, tuple) else f"lock:{key}"
+        # у каждого захвата свой владелец: два захвата в одном процессе тоже исключают друг друга
+        owner = f"{self.node_id}:{next(self._tokens)}"
+        delay = self.poll_interval
+        while not await self.db.try_lease(name, owner, self.lock_ttl):
+            if delay == self.poll_interval:
+                self.stats["lock_waits"] += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        self.stats["locks"] += 1
+        renew = asyncio.get_running_loop().create_task(self._renew(name, owner))
+        try:
+            yield
+        finally:
+            renew.cancel()
+            await asyncio.gather(renew, return_exceptions=True)
+            try:
+                await self.db.release_lease(name, owner)
+            except Exception as e:
+                # не страшно: аренда истечёт сама через lock_ttl
+                logger.warning(f"Не удалось снять блокировку {name}: {e}")
+
+    async def _renew(self, name: str, owner: str):
+        while True:
+            await asyncio.sleep(self.lock_ttl / 3)
+            try:
+                if not await self.db.try_lease(name, owner, self.lock_ttl):
+                    logger.error(f"Блокировка {name} потеряна (истекла до продления)")
+                    return
+            except Exception as e:
+                logger.warning(f"Не удалось продлить блокировку {name}: {e}")
+
+    async def run_once(self, job: str, period: float) -> bool:
+        """
+        True — эта реплика выполняет задачу job в текущем периоде (аренда не снимается,
+        а истекает через period, поэтому остальные реплики в этот период её пропустят).
+        """
+        if not self.enabled:
+            return True
+        return await self.db.try_lease(f"job:{job}", self.node_id, period)
+
+    # ---------- апдейты ----------
+    async def claim_update(self, update_id: int) -> bool:
+        if not self.enabled:
+            return True
+        claimed = await self.db.claim_update(update_id)
+        if not claimed:
+            self.stats["duplicates"] += 1
+        return claimed
+
+    async def process_update(self, app, update: Update):
+        """
+        Замена app.process_update для WebhookIngest: апдейт обрабатывается под блокировкой
+        своего ключа — с ним не пересечётся работа по таймеру в user_session().
+        """
+        key = self.key(update)
+        if not self.enabled:
+            async with self.lock(key):
+                await app.process_update(update)
+            return
+        async with self.lock(key):
+            # кнопки тикетов в канале (ключ "ticket") не трогают user_data админа
+            if key is not None and key[0] == "user":
+                async with self._user_state(app, key[1]):
+                    await app.process_update(update)
+            else:
+                await app.process_update(update)
+
+    @asynccontextmanager
+    async def user_session(self, app, user_id: int):
+        """
+        Работа с user_data пользователя вне апдейта (например, по таймеру): под блокировкой
+        пользователя, со свежим состоянием из БД и записью изменений по выходу.
+        С enabled=False — под блокировкой в процессе; изменения сохранит persistence PTB.
+        """
+        if not self.enabled:
+            async with self.lock(("user", user_id)):
+                # состояние читается лениво: таймер мог сработать раньше первого апдейта
+                if app.persistence is not None:
+                    await app.persistence.refresh_user_data(user_id, app.user_data[user_id])
+                yield
+            # апдейта не было — сам PTB не узнает, что user_data изменился
+            app.mark_data_for_update_persistence(user_ids=user_id)
+            return
+        async with self.lock(("user", user_id)), self._user_state(app, user_id):
+            yield
+
+    @asynccontextmanager
+    async def _user_state(self, app, user_id: int):
+        user_data = app.user_data[user_id]
+        await app.persistence.load_user_data(user_id, user_data)
+        yield
+        await app.persistence.store_user_data(user_id, user_data)
+
+    # ---------- обслуживание ----------
+    async def purge(self, keep_updates: float = 24 * 3600):
+        """
+        Чистит истёкшие аренды и update_id старше keep_updates секунд (Telegram столько не повторяет).
+        """
+        leases, updates = await self.db.purge_expired(time.time() - keep_updates)
+        if leases or updates:
+            logger.info(f"Очистка координации: аренд {leases}, update_id {updates}")
@@ -0,0 +1,1283 @@
+import asyncio
+import functools
+import json
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from metrics import DB_SECONDS
+
+STATUS_ACTIVE = "Активный"
+STATUS_IN_PROGRESS = "В работе"
+STATUS_CLOSED = "Закрыт"
+
+# Исполнитель, которого фоновая проверка записывает в никем не взятый автозакрытый тикет
+AUTO_CLOSE_ACTOR = "🤖 автозакрытие"
+
+logger = logging.getLogger(__name__)
+
+TICKET_COLUMNS = "id, user_id, description, photo_id, status, channel_msg_id, created_at, assigned_to"
+
+
+def ticket_from_row(row) -> dict | None:
+    if not row:
+        return None
+    return {
+        "id": row[0],
+        "user_id": row[1],
+        "description": row[2],
+        "photo": row[3],
+        "status": row[4],
+        "channel_msg_id": row[5],
+        "created_at": row[6],
+        "assigned_to": row[7],
+    }
+
+
+def user_from_row(row) -> dict | None:
+    if not row:
+        return None
+    return {"user_id": row[0], "username": row[1], "full_name": row[2], "place": row[3]}
+
+
+def fts_query(text: str) -> str | None:
+    """
+    Строка поиска -> запрос FTS5: все слова обязательны, каждое ищется как префикс
+    ("принтер" найдёт "принтера"). Кавычки и операторы FTS5 из ввода не пропускаем.
+    """
+    words = re.findall(r"\w+", text.lower())
+    return " ".join(f'"{w}"*' for w in words[:10]) or None
+
+
+def writes(fn):
+    """
+    Помечает метод Database как пишущий: AsyncDatabase отправит его в поток-писатель.
+    """
+    fn._db_write = True
+    return fn
+
+
+# ================== Схема и миграции ===============
+# Пересчёт sla_daily из ticket_events по тем же правилам, что у триггера свёртки;
+# {day} — выражение дня (UTC) из e.at на диалекте БД
+SLA_REBUILD_SQL = """
+INSERT INTO sla_daily (day, admin, created, assigned, assign_seconds, closed, close_seconds, ratings, stars, auto_closed)
+SELECT {day}, coalesce(e.actor, ''),
+       sum(CASE WHEN e.event = 'created' THEN 1 ELSE 0 END),
+       sum(CASE WHEN e.event = 'assigned' THEN 1 ELSE 0 END), sum(CASE WHEN e.event = 'assigned' THEN e.value ELSE 0 END),
+       sum(CASE WHEN e.event = 'closed' THEN 1 ELSE 0 END), sum(CASE WHEN e.event = 'closed' THEN e.value ELSE 0 END),
+       sum(CASE WHEN e.event = 'rated' THEN 1 ELSE 0 END), sum(CASE WHEN e.event = 'rated' THEN e.value ELSE 0 END),
+       sum(CASE WHEN e.event = 'auto_closed' THEN 1 ELSE 0 END)
+FROM ticket_events e
+WHERE e.event IN ('created', 'closed', 'rated', 'auto_closed')
+   OR (e.event = 'assigned' AND NOT EXISTS (
+       SELECT 1 FROM ticket_events p WHERE p.ticket_id = e.ticket_id AND p.event = 'assigned' AND p.id < e.id))
+GROUP BY 1, 2
+"""
+
+# Каждая миграция — набор выражений, применяемых в одной транзакции.
+# Номер версии = позиция в списке + 1, текущая версия хранится в PRAGMA user_version.
+# Уже выпущенные миграции не редактируем — только добавляем новые в конец.
+MIGRATIONS: list[tuple[str, ...]] = [
+    # 1: исходная схема
+    (
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE,
+            username TEXT,
+            full_name TEXT,
+            place TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            description TEXT,
+            photo_id TEXT,
+            status TEXT,
+            channel_msg_id INTEGER,
+            created_at TEXT,
+            assigned_to TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS feedback (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id INTEGER,
+            user_id INTEGER,
+            stars INTEGER,
+            comment TEXT,
+            created_at TEXT
+        )
+        """,
+    ),
+    # 2: индексы под "Мои тикеты", закрытие активных тикетов пользователя и отзывы
+    (
+        "CREATE INDEX IF NOT EXISTS idx_tickets_user_id ON tickets(user_id, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_user_status ON tickets(user_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_channel_msg_id ON tickets(channel_msg_id)",
+        "CREATE INDEX IF NOT EXISTS idx_feedback_ticket_id ON feedback(ticket_id)",
+        "ANALYZE",
+    ),
+    # 3: кеш file_id загруженных FAQ-документов
+    (
+        """
+        CREATE TABLE IF NOT EXISTS faq_files (
+            path TEXT PRIMARY KEY,
+            sha256 TEXT,
+            mtime_ns INTEGER,
+            size INTEGER,
+            file_id TEXT,
+            updated_at TEXT
+        )
+        """,
+    ),
+    # 4: состояние диалогов (context.user_data) для SQLitePersistence
+    (
+        """
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_user_state_updated_at ON user_state(updated_at)",
+    ),
+    # 5: строка для проверки здоровья — доказывает, что запись в файл БД проходит
+    (
+        """
+        CREATE TABLE IF NOT EXISTS healthcheck (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            checked_at TEXT
+        )
+        """,
+    ),
+    # 6: полнотекстовый поиск по описаниям тикетов и отзывам к ним (rowid = id тикета)
+    (
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS ticket_fts USING fts5(
+            description, comments,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        """,
+        """
+        INSERT INTO ticket_fts (rowid, description, comments)
+        SELECT t.id, t.description, (SELECT group_concat(f.comment, ' ') FROM feedback f WHERE f.ticket_id = t.id)
+        FROM tickets t
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_fts_insert AFTER INSERT ON tickets BEGIN
+            INSERT INTO ticket_fts (rowid, description, comments) VALUES (new.id, new.description, NULL);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_fts_update AFTER UPDATE OF description ON tickets BEGIN
+            UPDATE ticket_fts SET description = new.description WHERE rowid = new.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_fts_delete AFTER DELETE ON tickets BEGIN
+            DELETE FROM ticket_fts WHERE rowid = old.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_feedback_fts_insert AFTER INSERT ON feedback BEGIN
+            UPDATE ticket_fts
+            SET comments = (SELECT group_concat(comment, ' ') FROM feedback WHERE ticket_id = new.ticket_id)
+            WHERE rowid = new.ticket_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_feedback_fts_update AFTER UPDATE OF comment ON feedback BEGIN
+            UPDATE ticket_fts
+            SET comments = (SELECT group_concat(comment, ' ') FROM feedback WHERE ticket_id = new.ticket_id)
+            WHERE rowid = new.ticket_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_feedback_fts_delete AFTER DELETE ON feedback BEGIN
+            UPDATE ticket_fts
+            SET comments = (SELECT group_concat(comment, ' ') FROM feedback WHERE ticket_id = old.ticket_id)
+            WHERE rowid = old.ticket_id;
+        END
+        """,
+    ),
+    # 7: журнал событий тикета и суточные SLA-агрегаты (ведутся триггерами)
+    (
+        """
+        CREATE TABLE IF NOT EXISTS ticket_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id INTEGER NOT NULL,
+            event TEXT NOT NULL,
+            actor TEXT,
+            value REAL,
+            at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_ticket_events_ticket ON ticket_events(ticket_id, event)",
+        """
+        CREATE TABLE IF NOT EXISTS sla_daily (
+            day TEXT NOT NULL,
+            admin TEXT NOT NULL,
+            created INTEGER NOT NULL DEFAULT 0,
+            assigned INTEGER NOT NULL DEFAULT 0,
+            assign_seconds REAL NOT NULL DEFAULT 0,
+            closed INTEGER NOT NULL DEFAULT 0,
+            close_seconds REAL NOT NULL DEFAULT 0,
+            ratings INTEGER NOT NULL DEFAULT 0,
+            stars INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, admin)
+        ) WITHOUT ROWID
+        """,
+        # событие -> +1 в строке (день, админ); время до взятия считается только по первому взятию
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_ticket_events_rollup AFTER INSERT ON ticket_events BEGIN
+            INSERT INTO sla_daily (day, admin, created, assigned, assign_seconds, closed, close_seconds, ratings, stars)
+            SELECT date(new.at, 'unixepoch'), coalesce(new.actor, ''),
+                   new.event = 'created',
+                   new.event = 'assigned', CASE WHEN new.event = 'assigned' THEN new.value ELSE 0 END,
+                   new.event = 'closed', CASE WHEN new.event = 'closed' THEN new.value ELSE 0 END,
+                   new.event = 'rated', CASE WHEN new.event = 'rated' THEN new.value ELSE 0 END
+            WHERE new.event IN ('created', 'closed', 'rated')
+               OR (new.event = 'assigned' AND NOT EXISTS (
+                   SELECT 1 FROM ticket_events
+                   WHERE ticket_id = new.ticket_id AND event = 'assigned' AND id < new.id))
+            ON CONFLICT (day, admin) DO UPDATE SET
+                created = created + excluded.created,
+                assigned = assigned + excluded.assigned,
+                assign_seconds = assign_seconds + excluded.assign_seconds,
+                closed = closed + excluded.closed,
+                close_seconds = close_seconds + excluded.close_seconds,
+                ratings = ratings + excluded.ratings,
+                stars = stars + excluded.stars;
+        END
+        """,
+        # история до журнала: создание тикетов и оценки (когда брали/закрывали — неизвестно)
+        """
+        INSERT INTO ticket_events (ticket_id, event, actor, value, at)
+        SELECT id, 'created', NULL, 0, (julianday(created_at) - 2440587.5) * 86400.0
+        FROM tickets WHERE created_at IS NOT NULL ORDER BY id
+        """,
+        """
+        INSERT INTO ticket_events (ticket_id, event, actor, value, at)
+        SELECT f.ticket_id, 'rated', t.assigned_to, f.stars, (julianday(f.created_at) - 2440587.5) * 86400.0
+        FROM feedback f JOIN tickets t ON t.id = f.ticket_id
+        WHERE f.created_at IS NOT NULL ORDER BY f.id
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_events_insert AFTER INSERT ON tickets BEGIN
+            INSERT INTO ticket_events (ticket_id, event, actor, value, at)
+            VALUES (new.id, 'created', NULL, 0, (julianday('now') - 2440587.5) * 86400.0);
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_events_status AFTER UPDATE OF status ON tickets
+        WHEN new.status IS NOT old.status BEGIN
+            INSERT INTO ticket_events (ticket_id, event, actor, value, at)
+            SELECT new.id, e.event, e.actor,
+                   (julianday('now') - julianday(coalesce(new.created_at, 'now'))) * 86400.0,
+                   (julianday('now') - 2440587.5) * 86400.0
+            FROM (
+                SELECT CASE new.status
+                           WHEN '{STATUS_IN_PROGRESS}' THEN 'assigned'
+                           WHEN '{STATUS_CLOSED}' THEN 'closed'
+                           ELSE 'unassigned'
+                       END AS event,
+                       CASE WHEN new.status = '{STATUS_ACTIVE}' THEN old.assigned_to ELSE new.assigned_to END AS actor
+            ) AS e;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_feedback_events_insert AFTER INSERT ON feedback BEGIN
+            INSERT INTO ticket_events (ticket_id, event, actor, value, at)
+            VALUES (new.ticket_id, 'rated', (SELECT assigned_to FROM tickets WHERE id = new.ticket_id), new.stars,
+                    (julianday('now') - 2440587.5) * 86400.0);
+        END
+        """,
+    ),
+    # 8: докуда выгружены тикеты для инкрементального экспорта (export.py)
+    (
+        """
+        CREATE TABLE IF NOT EXISTS export_state (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            exported_at TEXT
+        )
+        """,
+    ),
+    # 9: фоновые напоминания — когда тикет вошёл в текущий статус, было ли по нему напоминание
+    # в этом статусе и кто из админов его взял (для личных напоминаний)
+    (
+        "ALTER TABLE tickets ADD COLUMN status_at REAL",
+        "ALTER TABLE tickets ADD COLUMN reminded_at REAL",
+        "ALTER TABLE tickets ADD COLUMN assigned_user_id INTEGER",
+        """
+        UPDATE tickets SET status_at = coalesce(
+            (SELECT max(e.at) FROM ticket_events e WHERE e.ticket_id = tickets.id),
+            (julianday(created_at) - 2440587.5) * 86400.0,
+            (julianday('now') - 2440587.5) * 86400.0
+        )
+        """,
+        # по уже закрытым тикетам напоминать об оценке поздно
+        f"UPDATE tickets SET reminded_at = status_at WHERE status = '{STATUS_CLOSED}'",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_status_at_insert AFTER INSERT ON tickets BEGIN
+            UPDATE tickets SET status_at = (julianday('now') - 2440587.5) * 86400.0 WHERE id = new.id;
+        END
+        """,
+        # новый статус — новый отсчёт; reminded_at сбрасывается, если тот же UPDATE не задал его сам
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_status_at_update AFTER UPDATE OF status ON tickets
+        WHEN new.status IS NOT old.status BEGIN
+            UPDATE tickets
+            SET status_at = (julianday('now') - 2440587.5) * 86400.0,
+                reminded_at = CASE WHEN new.reminded_at IS old.reminded_at THEN NULL ELSE new.reminded_at END
+            WHERE id = new.id;
+        END
+        """,
+        # в индексе только то, что может потребовать действия: открытые и ещё не напомненные закрытые
+        f"""
+        CREATE INDEX IF NOT EXISTS idx_tickets_sweep ON tickets(status_at)
+        WHERE status <> '{STATUS_CLOSED}' OR reminded_at IS NULL
+        """,
+    ),
+    # 10: вложения тикетов (альбомы, файлы). Файл Telegram хранится один раз по file_unique_id,
+    # тикет ссылается на него; tickets.photo_id остаётся обложкой карточки из одного вложения
+    (
+        """
+        CREATE TABLE IF NOT EXISTS media (
+            file_unique_id TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            file_name TEXT,
+            mime_type TEXT,
+            file_size INTEGER,
+            created_at TEXT
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ticket_attachments (
+            ticket_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            file_unique_id TEXT NOT NULL,
+            PRIMARY KEY (ticket_id, position),
+            UNIQUE (ticket_id, file_unique_id)
+        ) WITHOUT ROWID
+        """,
+    ),
+    # 11: несколько реплик на одной БД (cluster.py) — аренды блокировок и принятые update_id
+    (
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id INTEGER PRIMARY KEY,
+            at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_processed_updates_at ON processed_updates(at)",
+    ),
+    # 12: автоматические закрытия (новым тикетом пользователя, фоновой проверкой) — отдельное
+    # событие auto_closed и отдельный счётчик в sla_daily: в "закрыто" и время до закрытия
+    # админов они не входят (иначе админу засчитывалось бы закрытие через ~AUTO_CLOSE_HOURS)
+    (
+        "ALTER TABLE tickets ADD COLUMN auto_closed INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE sla_daily ADD COLUMN auto_closed INTEGER NOT NULL DEFAULT 0",
+        # в истории узнаваемы закрытия без админа и автозакрытия невзятых тикетов; автозакрытия
+        # взятых записаны на админа и от его закрытий не отличаются
+        f"""
+        UPDATE ticket_events SET event = 'auto_closed'
+        WHERE event = 'closed' AND coalesce(actor, '') IN ('', '{AUTO_CLOSE_ACTOR}')
+        """,
+        "UPDATE tickets SET auto_closed = 1 WHERE id IN (SELECT ticket_id FROM ticket_events WHERE event = 'auto_closed')",
+        "DROP TRIGGER IF EXISTS trg_tickets_events_status",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_events_status AFTER UPDATE OF status ON tickets
+        WHEN new.status IS NOT old.status BEGIN
+            INSERT INTO ticket_events (ticket_id, event, actor, value, at)
+            SELECT new.id, e.event, e.actor,
+                   (julianday('now') - julianday(coalesce(new.created_at, 'now'))) * 86400.0,
+                   (julianday('now') - 2440587.5) * 86400.0
+            FROM (
+                SELECT CASE
+                           WHEN new.status = '{STATUS_IN_PROGRESS}' THEN 'assigned'
+                           WHEN new.status = '{STATUS_CLOSED}' AND new.auto_closed THEN 'auto_closed'
+                           WHEN new.status = '{STATUS_CLOSED}' THEN 'closed'
+                           ELSE 'unassigned'
+                       END AS event,
+                       CASE WHEN new.status = '{STATUS_ACTIVE}' THEN old.assigned_to ELSE new.assigned_to END AS actor
+            ) AS e;
+        END
+        """,
+        "DROP TRIGGER IF EXISTS trg_ticket_events_rollup",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_ticket_events_rollup AFTER INSERT ON ticket_events BEGIN
+            INSERT INTO sla_daily (day, admin, created, assigned, assign_seconds, closed, close_seconds, ratings, stars, auto_closed)
+            SELECT date(new.at, 'unixepoch'), coalesce(new.actor, ''),
+                   new.event = 'created',
+                   new.event = 'assigned', CASE WHEN new.event = 'assigned' THEN new.value ELSE 0 END,
+                   new.event = 'closed', CASE WHEN new.event = 'closed' THEN new.value ELSE 0 END,
+                   new.event = 'rated', CASE WHEN new.event = 'rated' THEN new.value ELSE 0 END,
+                   new.event = 'auto_closed'
+            WHERE new.event IN ('created', 'closed', 'rated', 'auto_closed')
+               OR (new.event = 'assigned' AND NOT EXISTS (
+                   SELECT 1 FROM ticket_events
+                   WHERE ticket_id = new.ticket_id AND event = 'assigned' AND id < new.id))
+            ON CONFLICT (day, admin) DO UPDATE SET
+                created = created + excluded.created,
+                assigned = assigned + excluded.assigned,
+                assign_seconds = assign_seconds + excluded.assign_seconds,
+                closed = closed + excluded.closed,
+                close_seconds = close_seconds + excluded.close_seconds,
+                ratings = ratings + excluded.ratings,
+                stars = stars + excluded.stars,
+                auto_closed = auto_closed + excluded.auto_closed;
+        END
+        """,
+        # агрегаты пересчитываются из журнала по тем же правилам, что у триггера
+        "DELETE FROM sla_daily",
+        SLA_REBUILD_SQL.format(day="date(e.at, 'unixepoch')"),
+    ),
+    # 13: инкрементальный экспорт по журналу событий: курсор — id последнего выгруженного события,
+    # так что повторно выгружаются и старые тикеты, у которых сменились статус, исполнитель, оценка.
+    # Курсор существующих потоков — последнее событие на момент их прошлой выгрузки
+    (
+        "ALTER TABLE export_state ADD COLUMN last_event_id INTEGER NOT NULL DEFAULT 0",
+        """
+        UPDATE export_state SET last_event_id = coalesce(
+            (SELECT max(e.id) FROM ticket_events e WHERE e.at <= (julianday(export_state.exported_at) - 2440587.5) * 86400.0),
+            0
+        )
+        """,
+    ),
+]
+
+# Строка выгрузки: тикет + автор + последний отзыв + время взятия/закрытия из журнала
+EXPORT_COLUMNS = (
+    "ticket_id", "created_at", "status", "description", "photo_id", "assigned_to", "assigned_at", "closed_at",
+    "user_id", "username", "full_name", "place", "stars", "feedback_comment", "feedback_at",
+)
+
+
+def export_changed_filter(changed_after: int | None) -> tuple[str, tuple]:
+    """
+    Условие iter_ticket_export для инкрементальной выгрузки и его параметры.
+    """
+    if changed_after is None:
+        return "", ()
+    return "AND t.id IN (SELECT e.ticket_id FROM ticket_events e WHERE e.id > ?)", (changed_after,)
+
+
+# ================== Кеш ============================
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кеш с ограничением по размеру и TTL записей.
+    Хранит и отрицательные результаты (None), поэтому отсутствие ключа отличается от _MISSING.
+
+    У каждого ключа есть версия: put и invalidate её меняют. Читатель из БД запоминает
+    version(key) до запроса и кладёт результат через put(..., version=v) — если за время
+    запроса ключ записали, устаревшая строка в кеш не попадёт. Версии хранятся отдельно
+    от значений (переживают вытеснение и invalidate) и тоже ограничены max_size: версия
+    забытого ключа не меньше самой новой из забытых, поэтому совпасть с прежней не может.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float | None = 600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._versions: OrderedDict = OrderedDict()  # ключ -> номер последней записи
+        self._generation = 0  # сквозной счётчик записей
+        self._forgotten = 0  # версия ключей, которых нет в _versions
+        self._lock = threading.Lock()
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def version(self, key) -> int:
+        with self._lock:
+            return self._versions.get(key, self._forgotten)
+
+    def put(self, key, value, *, version: int | None = None) -> bool:
+        """
+        Без version — запись (новое значение ключа, версия меняется). С version — результат
+        чтения: кладётся, только если версия ключа всё ещё та же. Возвращает, положено ли значение.
+        """
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if version is None:
+                self._bump(key)
+            elif self._versions.get(key, self._forgotten) != version:
+                return False
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            return True
+
+    def invalidate(self, key=_MISSING):
+        with self._lock:
+            if key is _MISSING:
+                self._data.clear()
+                self._versions.clear()
+                self._generation += 1
+                self._forgotten = self._generation
+            else:
+                self._data.pop(key, None)
+                self._bump(key)
+
+    def _bump(self, key):
+        self._generation += 1
+        self._versions[key] = self._generation
+        self._versions.move_to_end(key)
+        while len(self._versions) > self.max_size:
+            _, self._forgotten = self._versions.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+# ================== Слой доступа к БД ==============
+class Database:
+    """
+    Долгоживущий доступ к SQLite: одно соединение на запись (под блокировкой)
+    и пул соединений на чтение. Режим WAL позволяет читателям не ждать писателя,
+    а кеш подготовленных выражений живёт столько же, сколько соединение.
+    Профили пользователей кешируются в памяти (self.users), save_user обновляет кеш сразу.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        read_pool_size: int = 4,
+        cache_size_kib: int = 16384,
+        busy_timeout_ms: int = 5000,
+        user_cache_size: int = 10000,
+        user_cache_ttl: float | None = 600.0,
+    ):
+        self.path = path
+        self.read_pool_size = read_pool_size
+        self.cache_size_kib = cache_size_kib
+        self.busy_timeout_ms = busy_timeout_ms
+        self._writer: sqlite3.Connection | None = None
+        self._write_lock = threading.Lock()
+        self._readers: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._all_readers: list[sqlite3.Connection] = []
+        self.users = LRUCache(user_cache_size, user_cache_ttl)
+
+    # ---------- соединения ----------
+    def _connect(self, *, readonly: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,  # транзакциями управляем сами (BEGIN IMMEDIATE в write())
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def open(self):
+        """
+        Открывает соединения и доводит схему до последней версии. Вызывается один раз при старте.
+        """
+        if self._writer is not None:
+            return
+        writer = self._connect()
+        writer.execute("PRAGMA journal_mode=WAL")
+        self._writer = writer
+        self.migrate()
+        for _ in range(self.read_pool_size):
+            conn = self._connect(readonly=True)
+            self._all_readers.append(conn)
+            self._readers.put(conn)
+        logger.info(f"БД {self.path} открыта (WAL, читателей: {self.read_pool_size})")
+
+    def migrate(self):
+        """
+        Применяет недостающие миграции. Существующие данные не пересоздаются:
+        база без версии (user_version=0) считается исходной схемой.
+        Версия перечитывается внутри пишущей транзакции: если процессы на одном файле
+        стартуют одновременно, каждую миграцию применит только один из них.
+        """
+        while True:
+            with self.write() as cur:
+                version = cur.execute("PRAGMA user_version").fetchone()[0]
+                if version >= len(MIGRATIONS):
+                    return
+                for stmt in MIGRATIONS[version]:
+                    cur.execute(stmt)
+                cur.execute(f"PRAGMA user_version={version + 1}")
+            logger.info(f"БД {self.path}: применена миграция {version + 1}")
+
+    def close(self):
+        if self._writer is not None:
+            with self._write_lock:
+                self._writer.execute("PRAGMA optimize")
+        for conn in self._all_readers:
+            conn.close()
+        self._all_readers.clear()
+        self._readers = queue.LifoQueue()
+        if self._writer is not None:
+            with self._write_lock:
+                self._writer.close()
+                self._writer = None
+
+    @contextmanager
+    def write(self):
+        """
+        Транзакция на запись: одно соединение, сериализованное блокировкой.
+        """
+        if self._writer is None:
+            raise RuntimeError("База данных не открыта: вызовите Database.open()")
+        with self._write_lock:
+            cur = self._writer.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                yield cur
+            except BaseException:
+                self._writer.rollback()
+                raise
+            else:
+                self._writer.commit()
+            finally:
+                cur.close()
+
+    @contextmanager
+    def read(self):
+        """
+        Соединение на чтение из пула. Если пул пуст — ждём освобождения.
+        """
+        if not self._all_readers:
+            raise RuntimeError("База данных не открыта: вызовите Database.open()")
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    # ---------- пользователи ----------
+    def get_user(self, user_id: int):
+        user = self.users.get(user_id)
+        if user is not _MISSING:
+            return user
+        return self.fetch_user(user_id)
+
+    def fetch_user(self, user_id: int):
+        """
+        Читает профиль из БД в обход кеша и кладёт результат в кеш, если за время
+        чтения save_user не записал этого пользователя (иначе в кеше останется новый профиль).
+        """
+        version = self.users.version(user_id)
+        with self.read() as conn:
+            row = conn.execute(
+                "SELECT user_id, username, full_name, place FROM users WHERE user_id=?",
+                (user_id,),
+            ).fetchone()
+        user = user_from_row(row)
+        self.users.put(user_id, user, version=version)
+        return user
+
+    @writes
+    def save_user(self, user_id, username, full_name, place):
+        with self.write() as cur:
+            cur.execute(
+                """
+                INSERT INTO users (user_id, username, full_name, place)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                  username=excluded.username,
+                  full_name=excluded.full_name,
+                  place=excluded.place
+                """,
+                (user_id, username, full_name, place),
+            )
+        self.users.put(user_id, {"user_id": user_id, "username": username, "full_name": full_name, "place": place})
+
+    # ---------- тикеты ----------
+    @writes
+    def save_ticket(self, user_id, description, photo_id, attachments: list[dict] = ()):
+        """
+        attachments — записи attachments.attachment_from_message(); повторы одного файла
+        (file_unique_id) в тикете отбрасываются, в media файл хранится один раз
+        (file_id обновляется на последний — старый мог перестать работать).
+        """
+        created_at = datetime.now(timezone.utc).isoformat()
+        with self.write() as cur:
+            cur.execute(
+                """
+                INSERT INTO tickets
+                  (user_id, description, photo_id, status, channel_msg_id, created_at, assigned_to)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (user_id, description, photo_id, STATUS_ACTIVE, None, created_at, None),
+            )
+            ticket_id = cur.lastrowid
+            if attachments:
+                cur.executemany(
+                    """
+                    INSERT INTO media (file_unique_id, file_id, kind, file_name, mime_type, file_size, created_at)
+                    VALUES (:file_unique_id, :file_id, :kind, :file_name, :mime_type, :file_size, :created_at)
+                    ON CONFLICT(file_unique_id) DO UPDATE SET file_id=excluded.file_id
+                    """,
+                    [a | {"created_at": created_at} for a in attachments],
+                )
+                cur.executemany(
+                    "INSERT OR IGNORE INTO ticket_attachments (ticket_id, position, file_unique_id) VALUES (?, ?, ?)",
+                    [(ticket_id, i, a["file_unique_id"]) for i, a in enumerate(attachments)],
+                )
+            return ticket_id
+
+    @writes
+    def update_ticket_channel_msg_id(self, ticket_id, channel_msg_id):
+        with self.write() as cur:
+            cur.execute("UPDATE tickets SET channel_msg_id=? WHERE id=?", (channel_msg_id, ticket_id))
+
+    def get_ticket(self, ticket_id: int):
+        with self.read() as conn:
+            row = conn.execute(f"SELECT {TICKET_COLUMNS} FROM tickets WHERE id=?", (ticket_id,)).fetchone()
+        return ticket_from_row(row)
+
+    def get_user_tickets(self, user_id, limit=5, *, before_id: int | None = None, after_id: int | None = None):
+        """
+        Страница истории (id, description, status, created_at), новые сверху. Keyset-пагинация:
+        before_id — тикеты старее данного (следующая страница), after_id — новее (предыдущая).
+        Возвращает (строки, есть_старее, есть_новее); limit+1-я строка только сообщает, что дальше есть ещё.
+        """
+        if after_id is not None:
+            sql, params = "WHERE user_id=? AND id > ? ORDER BY id ASC", (user_id, after_id)
+        elif before_id is not None:
+            sql, params = "WHERE user_id=? AND id < ? ORDER BY id DESC", (user_id, before_id)
+        else:
+            sql, params = "WHERE user_id=? ORDER BY id DESC", (user_id,)
+        with self.read() as conn:
+            rows = conn.execute(
+                f"SELECT id, description, status, created_at FROM tickets {sql} LIMIT ?",
+                params + (limit + 1,),
+            ).fetchall()
+        more, rows = len(rows) > limit, rows[:limit]
+        if after_id is not None:
+            return rows[::-1], True, more
+        return rows, more, before_id is not None
+
+    def search_tickets(self, query: str, limit: int = 5, *, before_id: int | None = None):
+        """
+        Поиск по описаниям и отзывам (FTS5), новые сверху, keyset по id тикета.
+        Строки: (id, status, created_at, full_name, фрагмент с совпадением); второй элемент — есть ли ещё.
+        """
+        match = fts_query(query)
+        if match is None:
+            return [], False
+        with self.read() as conn:
+            rows = conn.execute(
+                """
+                SELECT t.id, t.status, t.created_at, u.full_name,
+                       snippet(ticket_fts, -1, '«', '»', '…', 12)
+                FROM ticket_fts
+                JOIN tickets t ON t.id = ticket_fts.rowid
+                LEFT JOIN users u ON u.user_id = t.user_id
+                WHERE ticket_fts MATCH ? AND ticket_fts.rowid < ?
+                ORDER BY ticket_fts.rowid DESC
+                LIMIT ?
+                """,
+                (match, before_id if before_id is not None else 2**63 - 1, limit + 1),
+            ).fetchall()
+        return rows[:limit], len(rows) > limit
+
+    @writes
+    def close_previous_active_tickets(self, user_id: int) -> list[dict]:
+        """
+        Закрывает все активные тикеты пользователя одним UPDATE и возвращает их свежие строки.
+        Закрытие автоматическое: в SLA админов не входит (см. миграцию 12).
+        """
+        with self.write() as cur:
+            rows = cur.execute(
+                f"UPDATE tickets SET status=?, auto_closed=1 WHERE user_id=? AND status=? RETURNING {TICKET_COLUMNS}",
+                (STATUS_CLOSED, user_id, STATUS_ACTIVE),
+            ).fetchall()
+        return [ticket_from_row(r) for r in rows]
+
+    # ---------- переходы состояния тикета ----------
+    def _transition(self, sql: str, params: tuple):
+        """
+        Атомарный compare-and-set: один UPDATE ... WHERE <ожидаемое состояние> RETURNING.
+        Возвращает свежую строку тикета или None, если условие не выполнилось.
+        """
+        with self.write() as cur:
+            row = cur.execute(f"{sql} RETURNING {TICKET_COLUMNS}", params).fetchone()
+        return ticket_from_row(row)
+
+    @writes
+    def assign_ticket(self, ticket_id: int, admin_name: str, admin_id: int | None = None):
+        """
+        Активный -> В работе. Срабатывает, только если тикет ещё никем не взят.
+        """
+        return self._transition(
+            "UPDATE tickets SET status=?, assigned_to=?, assigned_user_id=? WHERE id=? AND status=? AND assigned_to IS NULL",
+            (STATUS_IN_PROGRESS, admin_name, admin_id, ticket_id, STATUS_ACTIVE),
+        )
+
+    @writes
+    def unassign_ticket(self, ticket_id: int, admin_name: str):
+        """
+        В работе -> Активный. Срабатывает, только если тикет взял именно admin_name.
+        """
+        return self._transition(
+            "UPDATE tickets SET status=?, assigned_to=NULL, assigned_user_id=NULL WHERE id=? AND status=? AND assigned_to=?",
+            (STATUS_ACTIVE, ticket_id, STATUS_IN_PROGRESS, admin_name),
+        )
+
+    @writes
+    def close_ticket(self, ticket_id: int, admin_name: str):
+        """
+        Любой незакрытый -> Закрыт. Если тикет никто не брал, исполнителем записывается admin_name.
+        """
+        return self._transition(
+            "UPDATE tickets SET status=?, assigned_to=COALESCE(assigned_to, ?) WHERE id=? AND status<>?",
+            (STATUS_CLOSED, admin_name, ticket_id, STATUS_CLOSED),
+        )
+
+    # ---------- фоновые напоминания ----------
+    def find_stale_tickets(
+        self,
+        *,
+        active_before: float | None = None,
+        in_progress_before: float | None = None,
+        auto_close_before: float | None = None,
+        closed_before: float | None = None,
+        limit: int = 5000,
+    ) -> list[dict]:
+        """
+        Один запрос по частичному индексу idx_tickets_sweep, старые первыми. Границы — unix-время
+        входа в текущий статус, None — категория выключена:
+        - активные и взятые без напоминания — старше active_before / in_progress_before;
+        - любые незакрытые (и с напоминанием) — старше auto_close_before;
+        - закрытые без напоминания — старше closed_before.
+        Уже напомненные открытые тикеты моложе auto_close_before не возвращаются: иначе, накопившись,
+        они занимали бы весь limit и новые тикеты не получали бы напоминаний.
+        """
+        branches = [
+            (f"status = '{STATUS_ACTIVE}' AND reminded_at IS NULL AND status_at < ?", active_before),
+            (f"status = '{STATUS_IN_PROGRESS}' AND reminded_at IS NULL AND status_at < ?", in_progress_before),
+            (f"status <> '{STATUS_CLOSED}' AND status_at < ?", auto_close_before),
+            (f"status = '{STATUS_CLOSED}' AND reminded_at IS NULL AND status_at < ?", closed_before),
+        ]
+        branches = [(sql, bound) for sql, bound in branches if bound is not None]
+        if not branches:
+            return []
+        with self.read() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT id, user_id, status, status_at, reminded_at, assigned_to, assigned_user_id, channel_msg_id,
+                       auto_closed, EXISTS (SELECT 1 FROM feedback f WHERE f.ticket_id = tickets.id)
+                FROM tickets
+                WHERE (status <> '{STATUS_CLOSED}' OR reminded_at IS NULL) AND status_at < ?
+                  AND ({" OR ".join(f"({sql})" for sql, _ in branches)})
+                ORDER BY status_at
+                LIMIT ?
+                """,
+                (max(bound for _, bound in branches), *(bound for _, bound in branches), limit),
+            ).fetchall()
+        keys = (
+            "id", "user_id", "status", "status_at", "reminded_at", "assigned_to", "assigned_user_id", "channel_msg_id",
+            "auto_closed", "has_feedback",
+        )
+        return [dict(zip(keys, row)) for row in rows]
+
+    @writes
+    def mark_reminded(self, ticket_ids: list[int]):
+        with self.write() as cur:
+            cur.execute(
+                "UPDATE tickets SET reminded_at=? WHERE id IN (SELECT value FROM json_each(?))",
+                (time.time(), json.dumps(ticket_ids)),
+            )
+
+    @writes
+    def auto_close_tickets(self, ticket_ids: list[int], older_than: float, admin_name: str) -> list[dict]:
+        """
+        Закрывает незакрытые тикеты из списка, если они всё ещё не менялись с older_than
+        (проверка в том же UPDATE — админ мог успеть взять тикет между запросами).
+        Закрытие автоматическое: в SLA админов не входит, даже если тикет был взят.
+        """
+        with self.write() as cur:
+            rows = cur.execute(
+                f"""
+                UPDATE tickets SET status=?, assigned_to=COALESCE(assigned_to, ?), reminded_at=?, auto_closed=1
+                WHERE id IN (SELECT value FROM json_each(?)) AND status<>? AND status_at < ?
+                RETURNING {TICKET_COLUMNS}
+                """,
+                (STATUS_CLOSED, admin_name, time.time(), json.dumps(ticket_ids), STATUS_CLOSED, older_than),
+            ).fetchall()
+        return [ticket_from_row(r) for r in rows]
+
+    # ---------- FAQ ----------
+    def get_faq_files(self) -> dict[str, dict]:
+        with self.read() as conn:
+            rows = conn.execute("SELECT path, sha256, mtime_ns, size, file_id FROM faq_files").fetchall()
+        return {r[0]: {"sha256": r[1], "mtime_ns": r[2], "size": r[3], "file_id": r[4]} for r in rows}
+
+    @writes
+    def save_faq_file(self, path: str, sha256: str, mtime_ns: int, size: int, file_id: str | None):
+        with self.write() as cur:
+            cur.execute(
+                """
+                INSERT INTO faq_files (path, sha256, mtime_ns, size, file_id, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                  sha256=excluded.sha256,
+                  mtime_ns=excluded.mtime_ns,
+                  size=excluded.size,
+                  file_id=excluded.file_id,
+                  updated_at=excluded.updated_at
+                """,
+                (path, sha256, mtime_ns, size, file_id, datetime.now(timezone.utc).isoformat()),
+            )
+
+    # ---------- состояние диалогов ----------
+    def load_user_states(self, max_age_seconds: float | None = None) -> dict[int, str]:
+        """
+        user_id -> JSON состояния. Состояния старше max_age_seconds не загружаются.
+        """
+        sql, params = "SELECT user_id, data FROM user_state", ()
+        if max_age_seconds is not None:
+            since = datetime.fromtimestamp(time.time() - max_age_seconds, timezone.utc).isoformat()
+            sql, params = sql + " WHERE updated_at >= ?", (since,)
+        with self.read() as conn:
+            return dict(conn.execute(sql, params).fetchall())
+
+    def load_user_state(self, user_id: int, max_age_seconds: float | None = None) -> str | None:
+        """
+        JSON состояния одного пользователя (для реплик, читающих состояние на каждый апдейт).
+        """
+        since = datetime.fromtimestamp(time.time() - max_age_seconds, timezone.utc).isoformat() if max_age_seconds is not None else ""
+        with self.read() as conn:
+            row = conn.execute("SELECT data FROM user_state WHERE user_id=? AND updated_at >= ?", (user_id, since)).fetchone()
+        return row[0] if row else None
+
+    @writes
+    def save_user_states(self, states: dict[int, str | None]):
+        """
+        Пакетная запись состояний одной транзакцией; None — удалить состояние пользователя.
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        with self.write() as cur:
+            cur.executemany(
+                """
+                INSERT INTO user_state (user_id, data, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at
+                """,
+                [(uid, data, now) for uid, data in states.items() if data is not None],
+            )
+            cur.executemany(
+                "DELETE FROM user_state WHERE user_id=?",
+                [(uid,) for uid, data in states.items() if data is None],
+            )
+
+    @writes
+    def purge_user_states(self, max_age_seconds: float) -> int:
+        """
+        Удаляет состояния, не менявшиеся дольше max_age_seconds (брошенные диалоги):
+        load_user_states их уже не загружает. Возвращает число удалённых.
+        """
+        since = datetime.fromtimestamp(time.time() - max_age_seconds, timezone.utc).isoformat()
+        with self.write() as cur:
+            return cur.execute("DELETE FROM user_state WHERE updated_at < ?", (since,)).rowcount
+
+    # ---------- статистика ----------
+    def sla_report(self, since_day: str, until_day: str | None = None) -> list[dict]:
+        """
+        Сводка по админам за дни [since_day, until_day] (YYYY-MM-DD, UTC) из суточных агрегатов:
+        O(дней × админов) без сканирования тикетов. admin "" — без админа (новые тикеты,
+        автозакрытие при создании нового). Средние — в секундах и звёздах. closed и время
+        до закрытия — только закрытия админами; автоматические — отдельно в auto_closed.
+        """
+        with self.read() as conn:
+            rows = conn.execute(
+                """
+                SELECT admin, sum(created), sum(assigned), sum(assign_seconds), sum(closed), sum(close_seconds),
+                       sum(ratings), sum(stars), sum(auto_closed)
+                FROM sla_daily
+                WHERE day >= ? AND day <= ?
+                GROUP BY admin
+                ORDER BY sum(closed) DESC, admin
+                """,
+                (since_day, until_day or "9999-12-31"),
+            ).fetchall()
+        return [
+            {
+                "admin": admin,
+                "created": created,
+                "assigned": assigned,
+                "avg_assign_seconds": assign_seconds / assigned if assigned else None,
+                "closed": closed,
+                "avg_close_seconds": close_seconds / closed if closed else None,
+                "ratings": ratings,
+                "avg_stars": stars / ratings if ratings else None,
+                "auto_closed": auto_closed,
+            }
+            for admin, created, assigned, assign_seconds, closed, close_seconds, ratings, stars, auto_closed in rows
+        ]
+
+    def get_sla_daily(self, since_day: str, until_day: str | None = None):
+        """
+        Суточные агрегаты как есть (day, admin, created, assigned, assign_seconds, closed, close_seconds, ratings, stars,
+        auto_closed).
+        """
+        with self.read() as conn:
+            return conn.execute(
+                """
+                SELECT day, admin, created, assigned, assign_seconds, closed, close_seconds, ratings, stars, auto_closed
+                FROM sla_daily WHERE day >= ? AND day <= ? ORDER BY day, admin
+                """,
+                (since_day, until_day or "9999-12-31"),
+            ).fetchall()
+
+    # ---------- экспорт ----------
+    def iter_ticket_export(self, since_id: int = 0, chunk_size: int = 1000, *, changed_after: int | None = None):
+        """
+        Генератор строк выгрузки (порядок — EXPORT_COLUMNS) с id тикета > since_id.
+        changed_after — только тикеты с событиями журнала после этого id (созданные или
+        изменённые), каждый один раз и в текущем состоянии.
+        Читает порциями по chunk_size через keyset (id > последнего), соединение из пула
+        берётся на время одной порции: память постоянна, а долгой читающей транзакции,
+        мешающей checkpoint'у WAL, нет.
+        """
+        changed, extra = export_changed_filter(changed_after)
+        last_id = since_id
+        while True:
+            with self.read() as conn:
+                rows = conn.execute(
+                    f"""
+                    SELECT t.id, t.created_at, t.status, t.description, t.photo_id, t.assigned_to,
+                           (SELECT strftime('%Y-%m-%dT%H:%M:%SZ', min(e.at), 'unixepoch') FROM ticket_events e
+                            WHERE e.ticket_id = t.id AND e.event = 'assigned'),
+                           (SELECT strftime('%Y-%m-%dT%H:%M:%SZ', max(e.at), 'unixepoch') FROM ticket_events e
+                            WHERE e.ticket_id = t.id AND e.event IN ('closed', 'auto_closed')),
+                           t.user_id, u.username, u.full_name, u.place,
+                           f.stars, f.comment, f.created_at
+                    FROM tickets t
+                    LEFT JOIN users u ON u.user_id = t.user_id
+                    LEFT JOIN feedback f ON f.id = (SELECT max(id) FROM feedback WHERE ticket_id = t.id)
+                    WHERE t.id > ? {changed}
+                    ORDER BY t.id
+                    LIMIT ?
+                    """,
+                    (last_id, *extra, chunk_size),
+                ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1][0]
+
+    def get_last_event_id(self) -> int:
+        """
+        Курсор журнала событий: всё, что случится после, получит id больше.
+        """
+        with self.read() as conn:
+            return conn.execute("SELECT coalesce(max(id), 0) FROM ticket_events").fetchone()[0]
+
+    def get_export_state(self, name: str) -> int:
+        """
+        Курсор потока инкрементальной выгрузки name: id последнего выгруженного события.
+        """
+        with self.read() as conn:
+            row = conn.execute("SELECT last_event_id FROM export_state WHERE name=?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    @writes
+    def save_export_state(self, name: str, last_event_id: int, last_id: int = 0):
+        """
+        last_id — последний тикет выгрузки, для справки.
+        """
+        with self.write() as cur:
+            cur.execute(
+                """
+                INSERT INTO export_state (name, last_id, last_event_id, exported_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                  last_id=excluded.last_id,
+                  last_event_id=excluded.last_event_id,
+                  exported_at=excluded.exported_at
+                """,
+                (name, last_id, last_event_id, datetime.now(timezone.utc).isoformat()),
+            )
+
+    # ---------- координация реплик ----------
+    @writes
+    def try_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        Берёт или продлевает аренду name на ttl секунд. Удаётся, если аренды нет,
+        она истекла или уже принадлежит owner (продление).
+        """
+        now = time.time()
+        with self.write() as cur:
+            row = cur.execute(
+                """
+                INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at
+                WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+                RETURNING owner
+                """,
+                (name, owner, now + ttl, now),
+            ).fetchone()
+        return row is not None
+
+    @writes
+    def release_lease(self, name: str, owner: str):
+        with self.write() as cur:
+            cur.execute("DELETE FROM leases WHERE name=? AND owner=?", (name, owner))
+
+    @writes
+    def claim_update(self, update_id: int) -> bool:
+        """
+        Отмечает update_id принятым. False — его уже приняла другая реплика (повтор от Telegram).
+        """
+        with self.write() as cur:
+            row = cur.execute(
+                "INSERT INTO processed_updates (update_id, at) VALUES (?, ?) ON CONFLICT(update_id) DO NOTHING RETURNING update_id",
+                (update_id, time.time()),
+            ).fetchone()
+        return row is not None
+
+    @writes
+    def purge_expired(self, updates_older_than: float) -> tuple[int, int]:
+        """
+        Удаляет истёкшие аренды и старые update_id. Возвращает (аренд, update_id).
+        """
+        with self.write() as cur:
+            leases = cur.execute("DELETE FROM leases WHERE expires_at < ?", (time.time(),)).rowcount
+            updates = cur.execute("DELETE FROM processed_updates WHERE at < ?", (updates_older_than,)).rowcount
+        return leases, updates
+
+    # ---------- здоровье ----------
+    @writes
+    def probe_write(self):
+        """
+        Короткая пишущая транзакция для healthcheck: проверяет блокировку записи и диск.
+        """
+        with self.write() as cur:
+            cur.execute(
+                "INSERT INTO healthcheck (id, checked_at) VALUES (1, ?) ON CONFLICT(id) DO UPDATE SET checked_at=excluded.checked_at",
+                (datetime.now(timezone.utc).isoformat(),),
+            )
+
+    # ---------- отзывы ----------
+    @writes
+    def save_feedback(self, ticket_id, user_id, stars, comment):
+        with self.write() as cur:
+            cur.execute(
+                """
+                INSERT INTO feedback (ticket_id, user_id, stars, comment, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (ticket_id, user_id, stars, comment, datetime.now(timezone.utc).isoformat()),
+            )
+            return cur.lastrowid
+
+
+def database_from_url(url: str, **kwargs) -> Database:
+    """
+    postgresql://... — PostgresDatabase (общая БД для нескольких реплик), иначе путь к файлу SQLite
+    (можно с префиксом sqlite:///).
+    """
+    if url.startswith(("postgres://", "postgresql://")):
+        from db_postgres import PostgresDatabase  # psycopg нужен только для PostgreSQL (requirements-postgres.txt)
+
+        return PostgresDatabase(url, **kwargs)
+    return Database(url.removeprefix("sqlite:///"), **kwargs)
+
+
+# ================== Асинхронный доступ =============
+class AsyncDatabase:
+    """
+    Асинхронная обёртка над Database для хендлеров: пишущие методы выполняются
+    в выделенном потоке-писателе, читающие — в пуле потоков по размеру пула
+    соединений. Любой метод Database доступен как корутина: `await db.get_user(uid)`.
+    """
+
+    def __init__(self, sync: Database):
+        self.sync = sync
+        self._write_executor: ThreadPoolExecutor | None = None
+        self._read_executor: ThreadPoolExecutor | None = None
+
+    def open(self):
+        self.sync.open()
+        if self._write_executor is None:
+            self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+            self._read_executor = ThreadPoolExecutor(max_workers=self.sync.read_pool_size, thread_name_prefix="db-reader")
+
+    def close(self):
+        for executor in (self._write_executor, self._read_executor):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self._write_executor = self._read_executor = None
+        self.sync.close()
+
+    async def get_user(self, user_id: int):
+        # попадание в кеш отдаём сразу, без перехода в поток БД
+        user = self.sync.users.get(user_id)
+        if user is not _MISSING:
+            return user
+        return await self.run(self.sync.fetch_user, user_id)
+
+    async def run(self, fn, *args, write: bool = False, **kwargs):
+        """
+        Выполняет произвольную синхронную функцию в потоке БД и ждёт результат.
+        """
+        executor = self._write_executor if write else self._read_executor
+        if executor is None:
+            raise RuntimeError("База данных не открыта: вызовите AsyncDatabase.open()")
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - started, getattr(fn, "__name__", "run"))
+
+    def __getattr__(self, name):
+        attr = getattr(self.sync, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        write = getattr(attr, "_db_write", False)
+
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            return await self.run(attr, *args, write=write, **kwargs)
+
+        self.__dict__[name] = call
+        return call
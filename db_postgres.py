@@ -0,0 +1,666 @@
+import functools
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import psycopg
+
+from db import (
+    AUTO_CLOSE_ACTOR, SLA_REBUILD_SQL, STATUS_ACTIVE, STATUS_CLOSED, STATUS_IN_PROGRESS, TICKET_COLUMNS,
+    Database, export_changed_filter, ticket_from_row, writes,
+)
+
+logger = logging.getLogger(__name__)
+
+# ключ pg_advisory_xact_lock, под которым реплики по очереди применяют миграции
+MIGRATION_LOCK_ID = 7_303_310_001
+
+# минимальная версия сервера (server_version_num): CREATE OR REPLACE TRIGGER появился в PostgreSQL 14
+PG_MIN_VERSION = 140000
+
+EPOCH_NOW = "extract(epoch FROM now())"
+
+
+def pg_tsquery(text: str) -> str | None:
+    """
+    Как db.fts_query, но для to_tsquery: все слова обязательны, каждое — префикс.
+    """
+    words = re.findall(r"\w+", text.lower())
+    return " & ".join(f"{w}:*" for w in words[:10]) or None
+
+
+@functools.lru_cache(maxsize=512)
+def pg_sql(sql: str) -> str:
+    """
+    SQL базового Database (плейсхолдеры ?) -> формат psycopg (%s, литеральный % удваивается).
+    """
+    return sql.replace("%", "%%").replace("?", "%s")
+
+
+# ================== Схема и миграции ===============
+# Схема повторяет SQLite-версию (те же таблицы, колонки и типы значений в Python),
+# поэтому рендер, экспорт и статистика работают с обеими БД без изменений.
+# Номер версии = позиция в списке + 1, текущая версия — в таблице schema_version.
+PG_MIGRATIONS: list[tuple[str, ...]] = [
+    # 1: вся схема SQLite-версии 11
+    (
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT UNIQUE,
+            username TEXT,
+            full_name TEXT,
+            place TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tickets (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT,
+            description TEXT,
+            photo_id TEXT,
+            status TEXT,
+            channel_msg_id BIGINT,
+            created_at TEXT,
+            assigned_to TEXT,
+            status_at DOUBLE PRECISION,
+            reminded_at DOUBLE PRECISION,
+            assigned_user_id BIGINT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS feedback (
+            id BIGSERIAL PRIMARY KEY,
+            ticket_id BIGINT,
+            user_id BIGINT,
+            stars INTEGER,
+            comment TEXT,
+            created_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_tickets_user_id ON tickets(user_id, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_user_status ON tickets(user_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_channel_msg_id ON tickets(channel_msg_id)",
+        "CREATE INDEX IF NOT EXISTS idx_feedback_ticket_id ON feedback(ticket_id)",
+        f"""
+        CREATE INDEX IF NOT EXISTS idx_tickets_sweep ON tickets(status_at)
+        WHERE status <> '{STATUS_CLOSED}' OR reminded_at IS NULL
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS faq_files (
+            path TEXT PRIMARY KEY,
+            sha256 TEXT,
+            mtime_ns BIGINT,
+            size BIGINT,
+            file_id TEXT,
+            updated_at TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id BIGINT PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_user_state_updated_at ON user_state(updated_at)",
+        """
+        CREATE TABLE IF NOT EXISTS healthcheck (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            checked_at TEXT
+        )
+        """,
+        # поиск: 'simple' — без стемминга, как unicode61 в FTS5; префиксы — через :* в запросе
+        """
+        CREATE TABLE IF NOT EXISTS ticket_fts (
+            ticket_id BIGINT PRIMARY KEY REFERENCES tickets(id) ON DELETE CASCADE,
+            description TEXT,
+            comments TEXT,
+            document tsvector GENERATED ALWAYS AS (
+                to_tsvector('simple', coalesce(description, '') || ' ' || coalesce(comments, ''))
+            ) STORED
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_ticket_fts_document ON ticket_fts USING gin(document)",
+        """
+        CREATE TABLE IF NOT EXISTS ticket_events (
+            id BIGSERIAL PRIMARY KEY,
+            ticket_id BIGINT NOT NULL,
+            event TEXT NOT NULL,
+            actor TEXT,
+            value DOUBLE PRECISION,
+            at DOUBLE PRECISION NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_ticket_events_ticket ON ticket_events(ticket_id, event)",
+        """
+        CREATE TABLE IF NOT EXISTS sla_daily (
+            day TEXT NOT NULL,
+            admin TEXT NOT NULL,
+            created INTEGER NOT NULL DEFAULT 0,
+            assigned INTEGER NOT NULL DEFAULT 0,
+            assign_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            closed INTEGER NOT NULL DEFAULT 0,
+            close_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            ratings INTEGER NOT NULL DEFAULT 0,
+            stars INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, admin)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS export_state (
+            name TEXT PRIMARY KEY,
+            last_id BIGINT NOT NULL,
+            exported_at TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS media (
+            file_unique_id TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            file_name TEXT,
+            mime_type TEXT,
+            file_size BIGINT,
+            created_at TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ticket_attachments (
+            ticket_id BIGINT NOT NULL,
+            position INTEGER NOT NULL,
+            file_unique_id TEXT NOT NULL,
+            PRIMARY KEY (ticket_id, position),
+            UNIQUE (ticket_id, file_unique_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at DOUBLE PRECISION NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id BIGINT PRIMARY KEY,
+            at DOUBLE PRECISION NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_processed_updates_at ON processed_updates(at)",
+        # триггеры — те же правила, что в SQLite-миграциях 6, 7 и 9
+        f"""
+        CREATE OR REPLACE FUNCTION tickets_status_at() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' OR NEW.status IS DISTINCT FROM OLD.status THEN
+                NEW.status_at := {EPOCH_NOW};
+                -- новый статус — новый отсчёт; reminded_at сбрасывается, если UPDATE не задал его сам
+                IF TG_OP = 'UPDATE' AND NEW.reminded_at IS NOT DISTINCT FROM OLD.reminded_at THEN
+                    NEW.reminded_at := NULL;
+                END IF;
+            END IF;
+            RETURN NEW;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE TRIGGER trg_tickets_status_at BEFORE INSERT OR UPDATE OF status ON tickets
+        FOR EACH ROW EXECUTE FUNCTION tickets_status_at()
+        """,
+        """
+        CREATE OR REPLACE FUNCTION tickets_after_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO ticket_events (ticket_id, event, actor, value, at) VALUES (NEW.id, 'created', NULL, 0, NEW.status_at);
+            INSERT INTO ticket_fts (ticket_id, description) VALUES (NEW.id, NEW.description);
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE TRIGGER trg_tickets_after_insert AFTER INSERT ON tickets
+        FOR EACH ROW EXECUTE FUNCTION tickets_after_insert()
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION tickets_after_status() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO ticket_events (ticket_id, event, actor, value, at)
+            VALUES (
+                NEW.id,
+                CASE NEW.status
+                    WHEN '{STATUS_IN_PROGRESS}' THEN 'assigned'
+                    WHEN '{STATUS_CLOSED}' THEN 'closed'
+                    ELSE 'unassigned'
+                END,
+                CASE WHEN NEW.status = '{STATUS_ACTIVE}' THEN OLD.assigned_to ELSE NEW.assigned_to END,
+                {EPOCH_NOW} - coalesce(extract(epoch FROM NEW.created_at::timestamptz), {EPOCH_NOW}),
+                {EPOCH_NOW}
+            );
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE TRIGGER trg_tickets_events_status AFTER UPDATE OF status ON tickets
+        FOR EACH ROW WHEN (NEW.status IS DISTINCT FROM OLD.status) EXECUTE FUNCTION tickets_after_status()
+        """,
+        """
+        CREATE OR REPLACE FUNCTION tickets_fts_update() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE ticket_fts SET description = NEW.description WHERE ticket_id = NEW.id;
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE TRIGGER trg_tickets_fts_update AFTER UPDATE OF description ON tickets
+        FOR EACH ROW EXECUTE FUNCTION tickets_fts_update()
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION feedback_after_write() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            tid BIGINT := CASE WHEN TG_OP = 'DELETE' THEN OLD.ticket_id ELSE NEW.ticket_id END;
+        BEGIN
+            UPDATE ticket_fts
+            SET comments = (SELECT string_agg(f.comment, ' ' ORDER BY f.id) FROM feedback f WHERE f.ticket_id = tid)
+            WHERE ticket_id = tid;
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO ticket_events (ticket_id, event, actor, value, at)
+                VALUES (NEW.ticket_id, 'rated', (SELECT assigned_to FROM tickets WHERE id = NEW.ticket_id), NEW.stars, {EPOCH_NOW});
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE TRIGGER trg_feedback_after_write AFTER INSERT OR UPDATE OF comment OR DELETE ON feedback
+        FOR EACH ROW EXECUTE FUNCTION feedback_after_write()
+        """,
+        # событие -> +1 в строке (день, админ); время до взятия считается только по первому взятию
+        """
+        CREATE OR REPLACE FUNCTION ticket_events_rollup() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF NEW.event NOT IN ('created', 'assigned', 'closed', 'rated') THEN
+                RETURN NULL;
+            END IF;
+            IF NEW.event = 'assigned' AND EXISTS (
+                SELECT 1 FROM ticket_events
+                WHERE ticket_id = NEW.ticket_id AND event = 'assigned' AND id < NEW.id
+            ) THEN
+                RETURN NULL;
+            END IF;
+            INSERT INTO sla_daily AS s (day, admin, created, assigned, assign_seconds, closed, close_seconds, ratings, stars)
+            VALUES (
+                to_char(to_timestamp(NEW.at) AT TIME ZONE 'UTC', 'YYYY-MM-DD'), coalesce(NEW.actor, ''),
+                (NEW.event = 'created')::int,
+                (NEW.event = 'assigned')::int, CASE WHEN NEW.event = 'assigned' THEN NEW.value ELSE 0 END,
+                (NEW.event = 'closed')::int, CASE WHEN NEW.event = 'closed' THEN NEW.value ELSE 0 END,
+                (NEW.event = 'rated')::int, CASE WHEN NEW.event = 'rated' THEN NEW.value ELSE 0 END::int
+            )
+            ON CONFLICT (day, admin) DO UPDATE SET
+                created = s.created + excluded.created,
+                assigned = s.assigned + excluded.assigned,
+                assign_seconds = s.assign_seconds + excluded.assign_seconds,
+                closed = s.closed + excluded.closed,
+                close_seconds = s.close_seconds + excluded.close_seconds,
+                ratings = s.ratings + excluded.ratings,
+                stars = s.stars + excluded.stars;
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE TRIGGER trg_ticket_events_rollup AFTER INSERT ON ticket_events
+        FOR EACH ROW EXECUTE FUNCTION ticket_events_rollup()
+        """,
+    ),
+    # 2: как SQLite-миграция 12 — автоматические закрытия отдельно от закрытий админами
+    (
+        "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS auto_closed INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE sla_daily ADD COLUMN IF NOT EXISTS auto_closed INTEGER NOT NULL DEFAULT 0",
+        f"""
+        UPDATE ticket_events SET event = 'auto_closed'
+        WHERE event = 'closed' AND coalesce(actor, '') IN ('', '{AUTO_CLOSE_ACTOR}')
+        """,
+        "UPDATE tickets SET auto_closed = 1 WHERE id IN (SELECT ticket_id FROM ticket_events WHERE event = 'auto_closed')",
+        f"""
+        CREATE OR REPLACE FUNCTION tickets_after_status() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO ticket_events (ticket_id, event, actor, value, at)
+            VALUES (
+                NEW.id,
+                CASE
+                    WHEN NEW.status = '{STATUS_IN_PROGRESS}' THEN 'assigned'
+                    WHEN NEW.status = '{STATUS_CLOSED}' AND NEW.auto_closed <> 0 THEN 'auto_closed'
+                    WHEN NEW.status = '{STATUS_CLOSED}' THEN 'closed'
+                    ELSE 'unassigned'
+                END,
+                CASE WHEN NEW.status = '{STATUS_ACTIVE}' THEN OLD.assigned_to ELSE NEW.assigned_to END,
+                {EPOCH_NOW} - coalesce(extract(epoch FROM NEW.created_at::timestamptz), {EPOCH_NOW}),
+                {EPOCH_NOW}
+            );
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION ticket_events_rollup() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF NEW.event NOT IN ('created', 'assigned', 'closed', 'rated', 'auto_closed') THEN
+                RETURN NULL;
+            END IF;
+            IF NEW.event = 'assigned' AND EXISTS (
+                SELECT 1 FROM ticket_events
+                WHERE ticket_id = NEW.ticket_id AND event = 'assigned' AND id < NEW.id
+            ) THEN
+                RETURN NULL;
+            END IF;
+            INSERT INTO sla_daily AS s (day, admin, created, assigned, assign_seconds, closed, close_seconds, ratings, stars, auto_closed)
+            VALUES (
+                to_char(to_timestamp(NEW.at) AT TIME ZONE 'UTC', 'YYYY-MM-DD'), coalesce(NEW.actor, ''),
+                (NEW.event = 'created')::int,
+                (NEW.event = 'assigned')::int, CASE WHEN NEW.event = 'assigned' THEN NEW.value ELSE 0 END,
+                (NEW.event = 'closed')::int, CASE WHEN NEW.event = 'closed' THEN NEW.value ELSE 0 END,
+                (NEW.event = 'rated')::int, CASE WHEN NEW.event = 'rated' THEN NEW.value ELSE 0 END::int,
+                (NEW.event = 'auto_closed')::int
+            )
+            ON CONFLICT (day, admin) DO UPDATE SET
+                created = s.created + excluded.created,
+                assigned = s.assigned + excluded.assigned,
+                assign_seconds = s.assign_seconds + excluded.assign_seconds,
+                closed = s.closed + excluded.closed,
+                close_seconds = s.close_seconds + excluded.close_seconds,
+                ratings = s.ratings + excluded.ratings,
+                stars = s.stars + excluded.stars,
+                auto_closed = s.auto_closed + excluded.auto_closed;
+            RETURN NULL;
+        END
+        $$
+        """,
+        "DELETE FROM sla_daily",
+        SLA_REBUILD_SQL.format(day="to_char(to_timestamp(e.at) AT TIME ZONE 'UTC', 'YYYY-MM-DD')"),
+    ),
+    # 3: как SQLite-миграция 13 — курсор инкрементального экспорта по журналу событий
+    (
+        "ALTER TABLE export_state ADD COLUMN IF NOT EXISTS last_event_id BIGINT NOT NULL DEFAULT 0",
+        """
+        UPDATE export_state SET last_event_id = coalesce(
+            (SELECT max(e.id) FROM ticket_events e WHERE e.at <= extract(epoch FROM export_state.exported_at::timestamptz)),
+            0
+        )
+        """,
+    ),
+]
+
+
+# ================== Соединение =====================
+class _Cursor:
+    """
+    Курсор psycopg с интерфейсом sqlite3 для SQL базового класса: execute() возвращает сам курсор.
+    """
+
+    def __init__(self, cur: psycopg.Cursor):
+        self._cur = cur
+
+    def execute(self, sql: str, params=()):
+        self._cur.execute(pg_sql(sql), params)
+        return self
+
+    def executemany(self, sql: str, params_seq):
+        self._cur.executemany(pg_sql(sql), params_seq)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class _Connection:
+    def __init__(self, conn: psycopg.Connection):
+        self.raw = conn
+
+    def execute(self, sql: str, params=()):
+        return _Cursor(self.raw.cursor()).execute(sql, params)
+
+    def close(self):
+        self.raw.close()
+
+
+# ================== Слой доступа к БД ==============
+class PostgresDatabase(Database):
+    """
+    Database поверх PostgreSQL — общая БД для нескольких реплик бота (см. cluster.py).
+    Модель та же: одно соединение на запись под блокировкой и пул соединений на чтение
+    (только чтение, autocommit). SQL базового класса переиспользуется, переопределено
+    только то, в чём диалекты расходятся: FTS5 -> tsvector, json_each -> ANY(массив),
+    lastrowid -> RETURNING id, PRAGMA user_version -> таблица schema_version.
+    Оборванное соединение (рестарт/переключение PostgreSQL) переоткрывается при следующем запросе.
+
+    Нужен PostgreSQL 14+ и psycopg 3 (requirements-postgres.txt). Проверка на PostgreSQL:
+    TEST_DATABASE_URL=postgresql://... python -m pytest tests/test_postgres.py
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        *,
+        read_pool_size: int = 4,
+        connect_timeout: int = 10,
+        user_cache_size: int = 10000,
+        user_cache_ttl: float | None = 600.0,
+    ):
+        # в логи — без пароля
+        super().__init__(
+            re.sub(r"://([^:/@]+):[^@]*@", r"://\1:***@", dsn),
+            read_pool_size=read_pool_size,
+            user_cache_size=user_cache_size,
+            user_cache_ttl=user_cache_ttl,
+        )
+        self.dsn = dsn
+        self.connect_timeout = connect_timeout
+        self._readers_lock = threading.Lock()
+
+    # ---------- соединения ----------
+    def _connect(self, *, readonly: bool = False) -> _Connection:
+        conn = psycopg.connect(self.dsn, autocommit=True, connect_timeout=self.connect_timeout)
+        if readonly:
+            conn.execute("SET default_transaction_read_only = on")
+        return _Connection(conn)
+
+    def open(self):
+        if self._writer is not None:
+            return
+        writer = self._connect()
+        if writer.raw.info.server_version < PG_MIN_VERSION:
+            writer.close()
+            raise RuntimeError(f"БД {self.path}: нужен PostgreSQL 14 или новее, у сервера {writer.raw.info.server_version}")
+        self._writer = writer
+        self.migrate()
+        for _ in range(self.read_pool_size):
+            conn = self._connect(readonly=True)
+            self._all_readers.append(conn)
+            self._readers.put(conn)
+        logger.info(f"БД {self.path} открыта (PostgreSQL, читателей: {self.read_pool_size})")
+
+    def migrate(self):
+        """
+        Реплики, стартующие одновременно, применяют миграции по очереди под advisory-блокировкой.
+        """
+        while True:
+            with self.write() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(?)", (MIGRATION_LOCK_ID,))
+                cur.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+                row = cur.execute("SELECT version FROM schema_version").fetchone()
+                version = row[0] if row else 0
+                if version >= len(PG_MIGRATIONS):
+                    return
+                for stmt in PG_MIGRATIONS[version]:
+                    cur.execute(stmt)
+                cur.execute("DELETE FROM schema_version")
+                cur.execute("INSERT INTO schema_version (version) VALUES (?)", (version + 1,))
+            logger.info(f"БД {self.path}: применена миграция {version + 1}")
+
+    def close(self):
+        with self._readers_lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers.clear()
+        self._readers.queue.clear()
+        if self._writer is not None:
+            with self._write_lock:
+                self._writer.close()
+                self._writer = None
+
+    @contextmanager
+    def write(self):
+        """
+        Транзакция на запись: COMMIT при выходе, ROLLBACK при исключении.
+        """
+        if self._writer is None:
+            raise RuntimeError("База данных не открыта: вызовите Database.open()")
+        with self._write_lock:
+            if self._writer.raw.broken:
+                logger.warning(f"БД {self.path}: соединение на запись оборвано, переподключаемся")
+                self._writer = self._connect()
+            with self._writer.raw.transaction(), self._writer.raw.cursor() as cur:
+                yield _Cursor(cur)
+
+    @contextmanager
+    def read(self):
+        if not self._all_readers:
+            raise RuntimeError("База данных не открыта: вызовите Database.open()")
+        conn = self._readers.get()
+        try:
+            if conn.raw.broken:
+                conn = self._replace_reader(conn)
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def _replace_reader(self, old: _Connection) -> _Connection:
+        logger.warning(f"БД {self.path}: соединение на чтение оборвано, переподключаемся")
+        conn = self._connect(readonly=True)
+        with self._readers_lock:
+            self._all_readers[self._all_readers.index(old)] = conn
+        return conn
+
+    # ---------- тикеты ----------
+    @writes
+    def save_ticket(self, user_id, description, photo_id, attachments: list[dict] = ()):
+        created_at = datetime.now(timezone.utc).isoformat()
+        with self.write() as cur:
+            ticket_id = cur.execute(
+                """
+                INSERT INTO tickets
+                  (user_id, description, photo_id, status, channel_msg_id, created_at, assigned_to)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                RETURNING id
+                """,
+                (user_id, description, photo_id, STATUS_ACTIVE, None, created_at, None),
+            ).fetchone()[0]
+            if attachments:
+                cur.executemany(
+                    """
+                    INSERT INTO media (file_unique_id, file_id, kind, file_name, mime_type, file_size, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(file_unique_id) DO UPDATE SET file_id=excluded.file_id
+                    """,
+                    [
+                        (a["file_unique_id"], a["file_id"], a["kind"], a["file_name"], a["mime_type"], a["file_size"], created_at)
+                        for a in attachments
+                    ],
+                )
+                cur.executemany(
+                    "INSERT INTO ticket_attachments (ticket_id, position, file_unique_id) VALUES (?, ?, ?) ON CONFLICT DO NOTHING",
+                    [(ticket_id, i, a["file_unique_id"]) for i, a in enumerate(attachments)],
+                )
+            return ticket_id
+
+    def search_tickets(self, query: str, limit: int = 5, *, before_id: int | None = None):
+        match = pg_tsquery(query)
+        if match is None:
+            return [], False
+        with self.read() as conn:
+            rows = conn.execute(
+                """
+                SELECT t.id, t.status, t.created_at, u.full_name,
+                       ts_headline(
+                           'simple',
+                           -- фрагмент из той колонки, где совпадение, как snippet() в FTS5
+                           CASE WHEN to_tsvector('simple', coalesce(s.description, '')) @@ q THEN s.description ELSE s.comments END,
+                           q,
+                           'StartSel=«, StopSel=», MaxWords=12, MinWords=4, MaxFragments=1, FragmentDelimiter=…'
+                       )
+                FROM ticket_fts s
+                CROSS JOIN to_tsquery('simple', ?) AS q
+                JOIN tickets t ON t.id = s.ticket_id
+                LEFT JOIN users u ON u.user_id = t.user_id
+                WHERE s.document @@ q AND s.ticket_id < ?
+                ORDER BY s.ticket_id DESC
+                LIMIT ?
+                """,
+                (match, before_id if before_id is not None else 2**63 - 1, limit + 1),
+            ).fetchall()
+        return rows[:limit], len(rows) > limit
+
+    # ---------- фоновые напоминания ----------
+    @writes
+    def mark_reminded(self, ticket_ids: list[int]):
+        with self.write() as cur:
+            cur.execute("UPDATE tickets SET reminded_at=? WHERE id = ANY(?)", (time.time(), list(ticket_ids)))
+
+    @writes
+    def auto_close_tickets(self, ticket_ids: list[int], older_than: float, admin_name: str) -> list[dict]:
+        with self.write() as cur:
+            rows = cur.execute(
+                f"""
+                UPDATE tickets SET status=?, assigned_to=COALESCE(assigned_to, ?), reminded_at=?, auto_closed=1
+                WHERE id = ANY(?) AND status<>? AND status_at < ?
+                RETURNING {TICKET_COLUMNS}
+                """,
+                (STATUS_CLOSED, admin_name, time.time(), list(ticket_ids), STATUS_CLOSED, older_than),
+            ).fetchall()
+        return [ticket_from_row(r) for r in rows]
+
+    # ---------- экспорт ----------
+    def iter_ticket_export(self, since_id: int = 0, chunk_size: int = 1000, *, changed_after: int | None = None):
+        changed, extra = export_changed_filter(changed_after)
+        last_id = since_id
+        while True:
+            with self.read() as conn:
+                rows = conn.execute(
+                    f"""
+                    SELECT t.id, t.created_at, t.status, t.description, t.photo_id, t.assigned_to,
+                           (SELECT to_char(to_timestamp(min(e.at)) AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"')
+                            FROM ticket_events e WHERE e.ticket_id = t.id AND e.event = 'assigned'),
+                           (SELECT to_char(to_timestamp(max(e.at)) AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"')
+                            FROM ticket_events e WHERE e.ticket_id = t.id AND e.event IN ('closed', 'auto_closed')),
+                           t.user_id, u.username, u.full_name, u.place,
+                           f.stars, f.comment, f.created_at
+                    FROM tickets t
+                    LEFT JOIN users u ON u.user_id = t.user_id
+                    LEFT JOIN feedback f ON f.id = (SELECT max(id) FROM feedback WHERE ticket_id = t.id)
+                    WHERE t.id > ? {changed}
+                    ORDER BY t.id
+                    LIMIT ?
+                    """,
+                    (last_id, *extra, chunk_size),
+                ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1][0]
+
+    # ---------- отзывы ----------
+    @writes
+    def save_feedback(self, ticket_id, user_id, stars, comment):
+        with self.write() as cur:
+            return cur.execute(
+                """
+                INSERT INTO feedback (ticket_id, user_id, stars, comment, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                RETURNING id
+                """,
+                (ticket_id, user_id, stars, comment, datetime.now(timezone.utc).isoformat()),
+            ).fetchone()[0]
@@ -0,0 +1,133 @@
+"""
+Выгрузка тикетов (с автором и последним отзывом) в сжатый gzip CSV или JSONL для ITSM.
+
+    python export.py --format csv --out tickets.csv.gz               # всё
+    python export.py --format jsonl --out new.jsonl.gz --incremental itsm  # новое и изменённое с прошлого раза
+
+Строки читаются из БД порциями и сразу пишутся в gzip-поток: память не зависит от объёма истории.
+Инкрементальная выгрузка идёт по журналу событий (ticket_events): в неё попадают новые тикеты
+и старые, у которых с прошлого раза сменились статус, исполнитель или появилась оценка, — каждый
+одной строкой в текущем состоянии, поэтому получатель обновляет записи по ticket_id (upsert).
+Правки профиля автора (имя, место) событий не создают и сами по себе тикет не выгружают.
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+from dataclasses import dataclass
+
+from db import EXPORT_COLUMNS, Database, database_from_url
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "jsonl")
+
+
+@dataclass
+class ExportResult:
+    path: str
+    rows: int
+    first_id: int | None
+    last_id: int | None
+    bytes: int
+    cursor: int  # id последнего события журнала на начало выгрузки — курсор следующей инкрементальной
+
+
+def write_export(rows, fileobj, fmt: str) -> tuple[int, int | None, int | None]:
+    """
+    Пишет строки EXPORT_COLUMNS в бинарный fileobj как gzip-CSV/JSONL по мере чтения.
+    Возвращает (строк, первый id, последний id).
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат {fmt!r}, ожидается один из {FORMATS}")
+    count, first_id, last_id = 0, None, None
+    with gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=6) as gz:
+        text = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+        writer = csv.writer(text) if fmt == "csv" else None
+        if writer is not None:
+            writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            if writer is not None:
+                writer.writerow(row)
+            else:
+                text.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n")
+            count += 1
+            last_id = row[0]
+            if first_id is None:
+                first_id = last_id
+        text.flush()
+        text.detach()  # закрывать gzip будет with, а не TextIOWrapper
+    return count, first_id, last_id
+
+
+def export_tickets(
+    db: Database,
+    path: str,
+    fmt: str = "csv",
+    *,
+    since_id: int | None = None,
+    changed_after: int | None = None,
+    incremental: str | None = None,
+    chunk_size: int = 1000,
+) -> ExportResult:
+    """
+    Синхронная выгрузка в файл path. since_id — только тикеты с id больше; changed_after —
+    только тикеты с событиями журнала после этого id. incremental — имя потока выгрузки:
+    changed_after берётся из export_state, а после успешной записи файла курсор сдвигается
+    на result.cursor. Файл сначала пишется во временный path + ".part".
+    """
+    if incremental:
+        changed_after = db.get_export_state(incremental)
+    # события после этой отметки попадут в следующую выгрузку (возможно, повторно — это безопасно)
+    cursor = db.get_last_event_id()
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as f:
+        rows = db.iter_ticket_export(since_id or 0, chunk_size, changed_after=changed_after)
+        count, first_id, last_id = write_export(rows, f, fmt)
+    os.replace(tmp_path, path)
+    if incremental:
+        db.save_export_state(incremental, cursor, last_id or 0)
+    result = ExportResult(path, count, first_id, last_id, os.path.getsize(path), cursor)
+    logger.info(f"Экспорт {fmt}: {count} строк (id {first_id}..{last_id}) -> {path}, {result.bytes} байт")
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Выгрузка тикетов в gzip CSV/JSONL")
+    parser.add_argument(
+        "--db",
+        default=os.getenv("DATABASE_URL") or os.getenv("DB_PATH", "bot_final.db"),
+        help="файл SQLite или postgresql://... (как DATABASE_URL бота)",
+    )
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--out", help="файл результата (по умолчанию tickets.<format>.gz)")
+    start = parser.add_mutually_exclusive_group()
+    start.add_argument("--since-id", type=int, help="выгрузить тикеты с id больше указанного")
+    start.add_argument("--incremental", metavar="NAME", help="новое и изменённое с прошлой выгрузки NAME; курсор запоминается")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="строк за одно чтение из БД")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    db = database_from_url(args.db, read_pool_size=1)
+    db.open()
+    try:
+        result = export_tickets(
+            db,
+            args.out or f"tickets.{args.format}.gz",
+            args.format,
+            since_id=args.since_id,
+            incremental=args.incremental,
+            chunk_size=args.chunk_size,
+        )
+    finally:
+        db.close()
+    print(f"{result.rows} строк -> {result.path} ({result.bytes} байт)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+# ================== Пороги =========================
+@dataclass(frozen=True)
+class HealthLimits:
+    max_loop_lag: float = 1.0  # с, задержка цикла событий
+    max_db_seconds: float = 0.5  # с, пишущая транзакция вместе с ожиданием потока-писателя
+    max_update_queue: int = 500  # апдейтов в очереди PTB
+    max_api_age: float = 300.0  # с с последнего успешного ответа Bot API
+
+
+# ================== Монитор ========================
+class HealthMonitor:
+    """
+    Проверки для оркестратора.
+    liveness (/healthz): цикл событий не залип, БД принимает запись за разумное время,
+    Bot API недавно отвечал. Провал — процесс завис, его нужно перезапустить.
+    readiness (/readyz): то же плюс очередь апдейтов не переполнена — провал значит
+    "перегружен", трафик лучше придержать, но перезапуск не нужен.
+    draining=True (остановка идёт) — readiness проваливается сразу, чтобы балансировщик
+    увёл трафик на другие реплики, пока эта дорабатывает принятое.
+
+    Задержка цикла меряется фоновой задачей: sleep(interval) и сколько проспали сверх.
+    Если бот долго молчит (вебхук, нет апдейтов), монитор сам дёргает api_probe
+    (getMe), чтобы "последний успешный вызов API" означал связь, а не трафик.
+    """
+
+    def __init__(
+        self,
+        *,
+        db_probe: Callable[[], Awaitable[None]],
+        api_probe: Callable[[], Awaitable[object]],
+        api_last_success: Callable[[], float | None],
+        update_queue_size: Callable[[], int],
+        limits: HealthLimits = HealthLimits(),
+        interval: float = 0.5,
+    ):
+        self.db_probe = db_probe
+        self.api_probe = api_probe
+        self.api_last_success = api_last_success
+        self.update_queue_size = update_queue_size
+        self.limits = limits
+        self.interval = interval
+        self.loop_lag = 0.0
+        self.draining = False
+        self.last_tick = time.monotonic()
+        self._task: asyncio.Task | None = None
+        self._api_probe_task: asyncio.Task | None = None
+        self._api_probe_started = 0.0
+
+    def start(self):
+        if self._task is None:
+            self.last_tick = time.monotonic()
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="health-monitor")
+
+    async def stop(self):
+        for task in (self._task, self._api_probe_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._task = self._api_probe_task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_tick = time.monotonic()
+            self.loop_lag = max(0.0, self.last_tick - started - self.interval)
+            self._maybe_probe_api(self.last_tick)
+
+    def _maybe_probe_api(self, now: float):
+        last = self.api_last_success()
+        if last is not None and now - last < self.limits.max_api_age / 2:
+            return
+        if self._api_probe_task is not None or now - self._api_probe_started < self.limits.max_api_age / 4:
+            return
+        self._api_probe_started = now
+        self._api_probe_task = asyncio.get_running_loop().create_task(self._probe_api())
+
+    async def _probe_api(self):
+        try:
+            await self.api_probe()
+        except Exception as e:
+            logger.warning(f"Проверка Bot API не прошла: {e}")
+        finally:
+            self._api_probe_task = None
+
+    # ---------- проверки ----------
+    def _check_loop(self, now: float) -> dict:
+        # если монитор давно не просыпался, цикл залип прямо сейчас
+        lag = max(self.loop_lag, now - self.last_tick - self.interval)
+        return {"ok": self._task is not None and lag <= self.limits.max_loop_lag, "value": round(lag, 4), "limit": self.limits.max_loop_lag}
+
+    async def _check_db(self) -> dict:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.db_probe(), timeout=self.limits.max_db_seconds * 4)
+        except Exception as e:
+            return {"ok": False, "error": str(e) or type(e).__name__, "limit": self.limits.max_db_seconds}
+        elapsed = time.perf_counter() - started
+        return {"ok": elapsed <= self.limits.max_db_seconds, "value": round(elapsed, 4), "limit": self.limits.max_db_seconds}
+
+    def _check_api(self, now: float) -> dict:
+        last = self.api_last_success()
+        if last is None:
+            return {"ok": False, "error": "ни одного успешного вызова", "limit": self.limits.max_api_age}
+        age = now - last
+        return {"ok": age <= self.limits.max_api_age, "value": round(age, 1), "limit": self.limits.max_api_age}
+
+    def _check_update_queue(self) -> dict:
+        size = self.update_queue_size()
+        return {"ok": size <= self.limits.max_update_queue, "value": size, "limit": self.limits.max_update_queue}
+
+    async def check(self, *, ready: bool = False) -> dict:
+        now = time.monotonic()
+        checks = {"event_loop": self._check_loop(now), "db": await self._check_db(), "bot_api": self._check_api(now)}
+        if ready:
+            checks["update_queue"] = self._check_update_queue()
+            checks["draining"] = {"ok": not self.draining, "value": self.draining}
+        return {"status": "ok" if all(c["ok"] for c in checks.values()) else "fail", "checks": checks}
+
+    # ---------- маршруты MetricsServer ----------
+    async def _respond(self, ready: bool):
+        report = await self.check(ready=ready)
+        if report["status"] != "ok":
+            logger.warning(f"{'readiness' if ready else 'liveness'}: {report['checks']}")
+        return 200 if report["status"] == "ok" else 503, "application/json", json.dumps(report, ensure_ascii=False) + "\n"
+
+    async def liveness(self):
+        return await self._respond(False)
+
+    async def readiness(self):
+        return await self._respond(True)
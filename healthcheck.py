@@ -1,3 +1,35 @@
-# import os, sys
-# # Простейший healthcheck: токен на месте? (допиши реальные проверки при желании)
-# sys.exit(0 if os.environ.get("BOT_TOKEN") else 1)
+"""
+Healthcheck для Docker/оркестратора: спрашивает у работающего бота /healthz
+(или /readyz с --ready) на порту метрик. Код выхода 0 — здоров, 1 — нет.
+
+    python healthcheck.py            # liveness: цикл событий, запись в БД, Bot API
+    python healthcheck.py --ready    # + очередь апдейтов не переполнена
+"""
+import argparse
+import os
+import sys
+import urllib.error
+import urllib.request
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Проверка здоровья бота")
+    parser.add_argument("--ready", action="store_true", help="проверять готовность (/readyz) вместо liveness (/healthz)")
+    parser.add_argument("--url", help="полный URL проверки (по умолчанию http://127.0.0.1:$METRICS_PORT/healthz)")
+    parser.add_argument("--timeout", type=float, default=3.0, help="таймаут ответа, с: молчание = завис")
+    args = parser.parse_args()
+
+    url = args.url or f"http://127.0.0.1:{os.getenv('METRICS_PORT', '9100')}/{'readyz' if args.ready else 'healthz'}"
+    try:
+        with urllib.request.urlopen(url, timeout=args.timeout) as resp:
+            print(resp.read().decode(errors="replace").strip())
+            return 0
+    except urllib.error.HTTPError as e:
+        print(e.read().decode(errors="replace").strip(), file=sys.stderr)
+    except Exception as e:
+        print(f"{url}: {e}", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
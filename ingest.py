@@ -0,0 +1,215 @@
+import asyncio
+import hmac
+import json
+import logging
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Hashable
+
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+from telegram import Update
+
+from ordering import user_key
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+# ================== Приём вебхука ==================
+class WebhookIngest:
+    """
+    Приём апдейтов Telegram вместо app.run_webhook():
+    1) проверка секрета (X-Telegram-Bot-Api-Secret-Token) и разбор JSON;
+    2) повторы по update_id (Telegram переотправляет, если не дождался ответа) отсекаются;
+       повтор апдейта, который сам ещё ждёт места в очереди, получает тот же ответ, что и он;
+    3) апдейт кладётся в очередь и сразу подтверждается 200 — обработка идёт после ответа;
+    4) очередь ограничена: когда в работе max_backlog апдейтов, новый ждёт место не дольше
+       put_timeout, затем получает 503 — Telegram повторит позже (обратное давление);
+    5) workers воркеров обрабатывают апдейты параллельно, но апдейты с одинаковым ключом
+       (key(update), по умолчанию — пользователь; см. ordering.py) — строго по порядку поступления.
+
+    Для нескольких реплик (cluster.py): claim(update_id) отсекает повторы, принятые другой
+    репликой, а process(update) заменяет app.process_update (блокировки и общее состояние).
+    """
+
+    def __init__(
+        self,
+        app,
+        *,
+        secret_token: str | None = None,
+        path: str = "/webhook",
+        workers: int = 32,
+        max_backlog: int = 1000,
+        put_timeout: float = 2.0,
+        dedup_size: int = 10000,
+        key: Callable[[Update], Hashable | None] = user_key,
+        claim: Callable[[int], Awaitable[bool]] | None = None,
+        process: Callable[[Update], Awaitable] | None = None,
+    ):
+        self.app = app
+        self.secret_token = secret_token
+        self.path = path
+        self.workers = workers
+        self.max_backlog = max_backlog
+        self.put_timeout = put_timeout
+        self.dedup_size = dedup_size
+        self.key = key
+        self.claim = claim
+        self.process = process or app.process_update
+        self.stats = {"accepted": 0, "duplicate": 0, "rejected": 0, "forbidden": 0, "invalid": 0, "failed": 0}
+        self.backlog = 0  # принято, но ещё не обработано
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._slots: asyncio.Semaphore | None = None
+        self._seen: OrderedDict = OrderedDict()  # недавние принятые update_id
+        self._waiting: dict[int, asyncio.Future] = {}  # update_id -> итог апдейта, ждущего места в очереди
+        self._active: dict = {}  # ключ -> deque апдейтов, ждущих воркера, который уже занят этим ключом
+        self._tasks: list[asyncio.Task] = []
+        self._server: tornado.httpserver.HTTPServer | None = None
+
+    # ---------- API ----------
+    async def start(self, listen: str = "0.0.0.0", port: int = 8080):
+        self._slots = asyncio.Semaphore(self.max_backlog)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"ingest-worker-{i}") for i in range(self.workers)]
+        ingest = self
+
+        class Handler(tornado.web.RequestHandler):
+            async def post(self):
+                code = await ingest.receive(self.request.headers.get(SECRET_HEADER), self.request.body)
+                if code == 503:
+                    self.set_header("Retry-After", "1")
+                self.set_status(code)
+                self.finish()
+
+        sockets = tornado.netutil.bind_sockets(port, listen)
+        self._server = tornado.httpserver.HTTPServer(tornado.web.Application([(self.path, Handler)]))
+        self._server.add_sockets(sockets)
+        logger.info(f"Вебхук слушает {listen}:{port}{self.path} (воркеров: {self.workers}, очередь: {self.max_backlog})")
+
+    async def stop(self, timeout: float = 10.0):
+        """
+        Перестаёт принимать запросы, даёт обработать принятое (не дольше timeout), останавливает воркеры.
+        """
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.backlog and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        if self.backlog:
+            logger.warning(f"Остановка вебхука: не обработано апдейтов: {self.backlog}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def receive(self, secret: str | None, body: bytes) -> int:
+        """
+        Разбирает тело запроса вебхука и возвращает HTTP-код ответа.
+        """
+        if self.secret_token and not hmac.compare_digest((secret or "").encode(), self.secret_token.encode()):
+            self.stats["forbidden"] += 1
+            return 403
+        try:
+            data = json.loads(body)
+            update_id = int(data["update_id"])
+        except (ValueError, TypeError, KeyError):
+            self.stats["invalid"] += 1
+            return 400
+        return 200 if await self.submit(update_id, data) else 503
+
+    async def submit(self, update_id: int, data: dict) -> bool:
+        """
+        Ставит апдейт в очередь; False — очередь переполнена и место не освободилось за put_timeout.
+        """
+        if update_id in self._seen:
+            self.stats["duplicate"] += 1
+            return True
+        waiting = self._waiting.get(update_id)
+        if waiting is not None:
+            # оригинал ещё ждёт места: если ему откажут, повтор тоже должен получить 503,
+            # иначе Telegram сочтёт апдейт доставленным и больше его не пришлёт
+            accepted = await asyncio.shield(waiting)
+            self.stats["duplicate" if accepted else "rejected"] += 1
+            return accepted
+        future = self._waiting[update_id] = asyncio.get_running_loop().create_future()
+        accepted = False
+        try:
+            accepted = await self._admit(update_id, data)
+            return accepted
+        finally:
+            del self._waiting[update_id]
+            future.set_result(accepted)
+
+    # ---------- внутреннее ----------
+    async def _admit(self, update_id: int, data: dict) -> bool:
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected"] += 1
+            return False
+        if self.claim is not None:
+            # после места в очереди: отказ 503 не должен помечать апдейт принятым
+            try:
+                claimed = await self.claim(update_id)
+            except Exception as e:
+                logger.error(f"Не удалось отметить апдейт {update_id} принятым: {e}")
+                self._slots.release()
+                self.stats["rejected"] += 1
+                return False
+            if not claimed:
+                self._slots.release()
+                self._remember(update_id)
+                self.stats["duplicate"] += 1
+                return True
+        # принятым апдейт считается только с местом в очереди: до этого повтор должен пройти
+        self._remember(update_id)
+        self.backlog += 1
+        self.stats["accepted"] += 1
+        self._queue.put_nowait(data)
+        return True
+
+    def _remember(self, update_id: int):
+        self._seen[update_id] = None
+        while len(self._seen) > self.dedup_size:
+            self._seen.popitem(last=False)
+
+    def _done(self):
+        self.backlog -= 1
+        self._slots.release()
+
+    async def _worker(self):
+        while True:
+            data = await self._queue.get()
+            try:
+                update = Update.de_json(data, self.app.bot)
+                key = self.key(update)
+            except Exception as e:
+                logger.error(f"Не удалось разобрать апдейт {data.get('update_id')}: {e}")
+                self.stats["invalid"] += 1
+                self._done()
+                continue
+            if key is not None and key in self._active:
+                # этим ключом уже занят другой воркер: он обработает апдейт следом за текущим
+                self._active[key].append(update)
+                continue
+            if key is not None:
+                self._active[key] = deque()
+            try:
+                await self._process(update)
+                while key is not None and self._active[key]:
+                    await self._process(self._active[key].popleft())
+            finally:
+                if key is not None:
+                    del self._active[key]
+
+    async def _process(self, update: Update):
+        try:
+            await self.process(update)
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+        finally:
+            self._done()
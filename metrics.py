@@ -0,0 +1,189 @@
+import asyncio
+import bisect
+import inspect
+import logging
+import time
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# ================== Метрики ========================
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = ()):
+        self.name, self.doc, self.labels = name, doc, labels
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0):
+        self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for values, v in list(self.values.items()):
+            lines.append(f"{self.name}{_labels_text(self.labels, values)} {v}")
+        return lines
+
+
+class Gauge:
+    """
+    Значение снимается в момент запроса /metrics: fn() -> число или {метки: число}.
+    """
+
+    def __init__(self, name: str, doc: str, fn, labels: tuple[str, ...] = ()):
+        self.name, self.doc, self.fn, self.labels = name, doc, fn, labels
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.warning(f"Не удалось снять метрику {self.name}: {e}")
+            return lines
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for values, v in items:
+            values = values if isinstance(values, tuple) else (values,)
+            lines.append(f"{self.name}{_labels_text(self.labels, values)} {v}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name, self.doc, self.labels, self.buckets = name, doc, labels, buckets
+        self.values: dict[tuple, list] = {}  # метки -> [счётчики по корзинам..., +Inf, сумма]
+
+    def observe(self, value: float, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for values, series in list(self.values.items()):
+            labels = self.labels + ("le",)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels_text(labels, values + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labels, values)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels_text(self.labels, values)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, doc, labels=()):
+        return self.register(Counter(name, doc, labels))
+
+    def histogram(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, doc, labels, buckets))
+
+    def gauge(self, name, doc, fn, labels=()):
+        return self.register(Gauge(name, doc, fn, labels))
+
+    def expose(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram("tgbot_handler_duration_seconds", "Время обработки апдейта хендлером", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter("tgbot_handler_errors_total", "Исключения в хендлерах", ("handler",))
+DB_SECONDS = REGISTRY.histogram("tgbot_db_duration_seconds", "Время вызова БД (включая ожидание потока)", ("method",))
+API_SECONDS = REGISTRY.histogram("tgbot_api_duration_seconds", "Время запроса к Bot API", ("method",))
+API_RESPONSES = REGISTRY.counter("tgbot_api_responses_total", "Ответы Bot API по HTTP-коду (429 — flood limit)", ("method", "code"))
+API_ERRORS = REGISTRY.counter("tgbot_api_errors_total", "Сетевые ошибки запросов к Bot API", ("method",))
+
+
+def timed_handler(name: str):
+    """
+    Оборачивает хендлер PTB: гистограмма времени и счётчик исключений.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+        return wrapper
+    return decorator
+
+
+# ================== HTTP-сервер ====================
+class MetricsServer:
+    """
+    Минимальный HTTP-сервер на том же цикле событий, что и бот: GET-маршруты
+    path -> fn() -> (код, content-type, тело), fn может быть корутиной. Если цикл событий завис, сервер
+    тоже перестаёт отвечать — это и нужно внешним проверкам.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 9100, registry: Registry = REGISTRY):
+        self.host, self.port = host, port
+        self.routes = {"/metrics": lambda: (200, "text/plain; version=0.0.4; charset=utf-8", registry.expose())}
+        self._server: asyncio.AbstractServer | None = None
+
+    def route(self, path: str, fn):
+        self.routes[path] = fn
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass  # заголовки не нужны
+            parts = request_line.decode("latin-1").split()
+            path = parts[1].split("?", 1)[0] if len(parts) >= 2 else ""
+            fn = self.routes.get(path)
+            if not parts or parts[0] != "GET" or fn is None:
+                code, content_type, body = 404, "text/plain; charset=utf-8", "not found\n"
+            else:
+                result = fn()
+                code, content_type, body = await result if inspect.isawaitable(result) else result
+            data = body.encode()
+            writer.write(
+                f"HTTP/1.1 {code} {'OK' if code < 400 else 'ERROR'}\r\n"
+                f"Content-Type: {content_type}\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode()
+                + data
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"Ошибка запроса к серверу метрик: {e}")
+        finally:
+            writer.close()
@@ -0,0 +1,66 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Hashable
+
+from telegram import Update
+
+from callback_data import InvalidCallbackData, codec
+
+# Действия админов в канале: меняют только тикет, user_data админа не трогают
+TICKET_ACTIONS = frozenset({"assign", "unassign", "close"})
+
+
+# ================== Ключи упорядочения =============
+def user_key(update: Update) -> Hashable | None:
+    """
+    Апдейты одного пользователя (или чата) — строго по очереди: на этом держатся шаги
+    диалога в context.user_data["step"].
+    """
+    if update.effective_user is not None:
+        return ("user", update.effective_user.id)
+    if update.effective_chat is not None:
+        return ("chat", update.effective_chat.id)
+    return None
+
+
+def ordering_key(update: Update) -> Hashable | None:
+    """
+    Как user_key, но кнопки карточек в канале упорядочиваются по тикету: нажатия разных
+    админов на один тикет идут по очереди, а на разные тикеты — параллельно.
+    """
+    query = update.callback_query
+    if query is not None and query.data and codec.is_encoded(query.data):
+        try:
+            payload = codec.decode(query.data)
+        except InvalidCallbackData:
+            return user_key(update)
+        if payload.action in TICKET_ACTIONS:
+            return ("ticket", payload.ticket_id)
+    return user_key(update)
+
+
+# ================== Блокировки по ключу ============
+class KeyedLocks:
+    """
+    Lock на каждый ключ упорядочения, пока его кто-то держит или ждёт: держатели одного
+    ключа идут по одному и в порядке прихода (Lock в asyncio отдаёт блокировку ожидающим
+    по очереди), разных ключей — параллельно.
+    """
+
+    def __init__(self):
+        self._locks: dict = {}  # ключ -> [Lock, сколько держат или ждут]
+
+    @asynccontextmanager
+    async def lock(self, key: Hashable):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
@@ -0,0 +1,366 @@
+import asyncio
+import bisect
+import itertools
+import logging
+import time
+from collections import OrderedDict
+
+from telegram.error import BadRequest, RetryAfter
+from telegram.request import HTTPXRequest
+
+from metrics import API_ERRORS, API_RESPONSES, API_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: чем меньше число, тем раньше уходит запрос
+PRIORITY_USER = 0  # ответы пользователям и ЛС админам
+PRIORITY_CHANNEL = 1  # публикация и обновление карточек в канале
+PRIORITY_BACKGROUND = 2  # напоминания фоновых задач
+
+
+# ================== Замеры Bot API =================
+class InstrumentedRequest(HTTPXRequest):
+    """
+    HTTPXRequest, который замеряет каждый запрос к Bot API (включая прямые reply_text).
+    last_success — time.monotonic() последнего ответа Telegram без ошибки (для healthcheck).
+    """
+
+    last_success: float | None = None
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            API_ERRORS.inc(endpoint)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, endpoint)
+        API_RESPONSES.inc(endpoint, code)
+        if code < 400:
+            self.last_success = time.monotonic()
+        return code, payload
+
+
+# ================== Token bucket ===================
+class TokenBucket:
+    """
+    Классический token bucket: rate токенов в секунду, не больше capacity про запас.
+    pause() блокирует ведро целиком (для retry_after от Telegram).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """
+        Сколько секунд ждать до появления токена (0 — можно отправлять).
+        """
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        return now >= self.paused_until and self.delay(now) == 0 and self.tokens >= self.capacity
+
+
+def retry_after_seconds(exc: RetryAfter) -> float:
+    value = exc.retry_after
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+# ================== Планировщик ====================
+class _Job:
+    __slots__ = ("priority", "seq", "chat_id", "key", "call", "future", "attempts")
+
+    def __init__(self, priority, seq, chat_id, key, call, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.key = key
+        self.call = call
+        self.future = future
+        self.attempts = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundScheduler:
+    """
+    Очередь исходящих запросов к Bot API с учётом лимитов Telegram:
+    глобальный token bucket (~30 запросов/с), отдельные вёдра на чат
+    (группы/каналы ~20 в минуту, личные чаты ~1 в секунду), приоритеты
+    (ответы людям раньше обновлений карточек) и повтор после 429 с retry_after.
+
+    Запросы с одинаковым ключом упорядочения (по умолчанию — chat_id) летят
+    строго по одному, поэтому их порядок сохраняется. Карточки разных тикетов
+    в одном канале получают разные ключи и могут отправляться параллельно.
+    """
+
+    def __init__(
+        self,
+        *,
+        global_rate: float = 30.0,
+        group_rate: float = 20 / 60,
+        group_burst: float = 20,
+        private_rate: float = 1.0,
+        private_burst: float = 3,
+        max_retries: int = 5,
+    ):
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.max_retries = max_retries
+        self.stats = {"sent": 0, "failed": 0, "retry_after": 0}
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: dict[int, TokenBucket] = {}
+        self._busy: set = set()  # ключи упорядочения, по которым запрос уже в полёте
+        self._pending: list[_Job] = []  # отсортирован по (priority, seq)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._inflight: set[asyncio.Task] = set()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, self.private_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    # ---------- API ----------
+    def submit(self, chat_id: int, method, /, *args, priority: int = PRIORITY_USER, key=None, **kwargs) -> asyncio.Future:
+        """
+        Ставит вызов method(*args, **kwargs) в очередь и сразу возвращает future с результатом.
+        key — ключ упорядочения (по умолчанию chat_id).
+        """
+        if self._task is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(priority, next(self._seq), chat_id, chat_id if key is None else key, lambda: method(*args, **kwargs), future)
+        bisect.insort(self._pending, job)
+        self._wakeup.set()
+        return future
+
+    async def send(self, chat_id: int, method, /, *args, priority: int = PRIORITY_USER, key=None, **kwargs):
+        """
+        То же, что submit(), но дожидается результата (или исключения) запроса.
+        """
+        return await self.submit(chat_id, method, *args, priority=priority, key=key, **kwargs)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="outbound-scheduler")
+
+    async def stop(self, timeout: float = 5.0):
+        """
+        Даёт очереди дослаться (не дольше timeout), затем останавливает планировщик.
+        """
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._pending or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        dropped = len(self._pending) + len(self._inflight)
+        if dropped:
+            logger.warning(f"Остановка планировщика: не отправлено запросов: {dropped}")
+        self._task.cancel()
+        for task in list(self._inflight):
+            task.cancel()
+        await asyncio.gather(self._task, *self._inflight, return_exceptions=True)
+        for job in self._pending:
+            if not job.future.done():
+                job.future.cancel()
+        self._pending.clear()
+        self._task = None
+
+    # ---------- внутреннее ----------
+    def _pick(self, now: float) -> tuple[_Job | None, float | None]:
+        """
+        Выбирает первый по приоритету запрос, чей ключ свободен, а чат не упирается в лимит.
+        Если таких нет — возвращает, сколько подождать (None — ждать события).
+        """
+        global_delay = self._global.delay(now)
+        if global_delay > 0:
+            return None, global_delay
+        wait = None
+        self._pending = [job for job in self._pending if not job.future.done()]  # отменённые вызывающей стороной
+        for index, job in enumerate(self._pending):
+            if job.key in self._busy:
+                continue
+            bucket = self._bucket(job.chat_id)
+            delay = bucket.delay(now)
+            if delay == 0:
+                del self._pending[index]
+                bucket.consume(now)
+                self._global.consume(now)
+                return job, None
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _prune_buckets(self, now: float):
+        if len(self._chats) > 10000:
+            for chat_id in [c for c, b in self._chats.items() if b.idle(now)]:
+                del self._chats[chat_id]
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            job, wait = self._pick(now)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._busy.add(job.key)
+            task = asyncio.create_task(self._execute(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+            self._prune_buckets(now)
+
+    async def _execute(self, job: _Job):
+        try:
+            result = await job.call()
+        except asyncio.CancelledError:
+            # stop() после дедлайна: ждущий send() должен получить отмену, а не висеть
+            if not job.future.done():
+                job.future.cancel()
+            raise
+        except RetryAfter as e:
+            self.stats["retry_after"] += 1
+            delay = retry_after_seconds(e)
+            self._bucket(job.chat_id).pause(delay)
+            job.attempts += 1
+            if job.attempts > self.max_retries:
+                self.stats["failed"] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                logger.warning(f"429 от Telegram для чата {job.chat_id}: повтор через {delay:.1f} с")
+                bisect.insort(self._pending, job)
+        except Exception as e:
+            self.stats["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.stats["sent"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._busy.discard(job.key)
+            self._wakeup.set()
+
+
+# ================== Склейка правок карточек ========
+class EditCoalescer:
+    """
+    Склеивает частые правки одного сообщения (например, карточки тикета):
+    после schedule() ждёт delay секунд и отправляет только последнее состояние.
+    Правка, совпадающая с уже отправленной (текст + разметка), не отправляется вовсе —
+    это экономит запросы и избавляет от ошибки "message is not modified".
+
+    dedup=False выключает этот пропуск: с несколькими репликами сообщение правят и другие
+    процессы, и запомненное здесь состояние может быть уже не тем, что видно в Telegram.
+    """
+
+    def __init__(self, *, delay: float = 1.0, remember_limit: int = 5000, dedup: bool = True):
+        self.delay = delay
+        self.remember_limit = remember_limit
+        self.dedup = dedup
+        self.stats = {"scheduled": 0, "sent": 0, "skipped": 0}
+        self._latest: dict = {}  # key -> (signature, send)
+        self._tasks: dict = {}  # key -> asyncio.Task
+        self._last_sent: OrderedDict = OrderedDict()  # key -> signature
+        self._flushing = False
+
+    def schedule(self, key, signature, send):
+        """
+        send — функция без аргументов, возвращающая корутину отправки;
+        signature — всё, что определяет видимое состояние сообщения.
+        """
+        self.stats["scheduled"] += 1
+        self._latest[key] = (signature, send)
+        if key not in self._tasks:
+            task = asyncio.get_running_loop().create_task(self._drain(key))
+            self._tasks[key] = task
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def remember(self, key, signature):
+        """
+        Запоминает состояние, отправленное в обход schedule() (например, при публикации).
+        """
+        if not self.dedup:
+            return
+        self._last_sent[key] = signature
+        self._last_sent.move_to_end(key)
+        while len(self._last_sent) > self.remember_limit:
+            self._last_sent.popitem(last=False)
+
+    async def flush(self):
+        """
+        Немедленно досылает всё отложенное (при остановке бота).
+        """
+        self._flushing = True
+        try:
+            while self._tasks:
+                await asyncio.gather(*list(self._tasks.values()), return_exceptions=True)
+        finally:
+            self._flushing = False
+
+    async def _drain(self, key):
+        try:
+            while key in self._latest:
+                if not self._flushing:
+                    await asyncio.sleep(self.delay)
+                signature, send = self._latest.pop(key)
+                if self._last_sent.get(key) == signature:
+                    self.stats["skipped"] += 1
+                    continue
+                try:
+                    await send()
+                except BadRequest as e:
+                    if "not modified" not in str(e).lower():
+                        raise
+                self.stats["sent"] += 1
+                self.remember(key, signature)
+        except Exception as e:
+            logger.error(f"Не удалось отправить правку сообщения {key}: {e}")
+        finally:
+            del self._tasks[key]
+            if key in self._latest:  # пришла новая правка, пока мы падали
+                self._tasks[key] = asyncio.get_running_loop().create_task(self._drain(key))
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Хранит context.user_data (шаги регистрации, создания тикета, отзыва) в bot_final.db,
+    чтобы перезапуск бота не обрывал диалоги.
+
+    Запись отложенная и пакетная: PTB раз в update_interval секунд передаёт изменившиеся
+    user_data, мы копим их в памяти и пишем одной транзакцией. Пустые user_data удаляются.
+    Чтение ленивое: при старте ничего не загружается, состояние пользователя читается из БД
+    при первом его апдейте (refresh_user_data) — память и время старта не зависят от числа
+    сохранённых диалогов. Брошенные диалоги старше max_age удаляет purge_stale() — при старте
+    и в фоновой проверке.
+
+    shared=True — несколько реплик на одной БД (cluster.py): ничего не загружается при старте
+    и не пишется пакетами (отложенная запись затёрла бы состояние, записанное другой репликой);
+    Cluster читает состояние перед апдейтом (load_user_data) и пишет сразу после (store_user_data).
+    """
+
+    def __init__(
+        self,
+        db: AsyncDatabase,
+        *,
+        update_interval: float = 5,
+        max_age: float | None = 24 * 3600,
+        write_delay: float = 0.5,
+        shared: bool = False,
+    ):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+        self.max_age = max_age
+        self.write_delay = write_delay
+        self.shared = shared
+        self._dirty: dict[int, str | None] = {}
+        self._write_task: asyncio.Task | None = None
+        self._loaded: set[int] = set()  # пользователи, чьё состояние уже прочитано из БД
+
+    # ---------- user_data ----------
+    async def get_user_data(self) -> dict[int, dict]:
+        if not self.shared:
+            await self.purge_stale()
+        return {}
+
+    async def update_user_data(self, user_id: int, data: dict):
+        if self.shared:
+            return
+        self._dirty[user_id] = json.dumps(data, ensure_ascii=False) if data else None
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int):
+        if self.shared:
+            await self.db.save_user_states({user_id: None})
+            return
+        self._dirty[user_id] = None
+        self._loaded.add(user_id)
+        self._schedule_write()
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        """
+        PTB вызывает перед каждым хендлером; состояние из БД читаем только при первом обращении.
+        """
+        if self.shared or user_id in self._loaded:
+            return
+        try:
+            data = await self.db.load_user_state(user_id, self.max_age)
+        except Exception as e:
+            # без состояния диалог начнётся заново; прочитать попробуем на следующем апдейте
+            logger.error(f"Не удалось прочитать состояние пользователя {user_id}: {e}")
+            return
+        if user_id in self._loaded:
+            return
+        self._loaded.add(user_id)
+        # пока читали, в user_data уже могли записать — свежее не затираем
+        if data and not user_data and user_id not in self._dirty:
+            user_data.update(self._decode(user_id, data))
+
+    # ---------- общее состояние реплик ----------
+    async def load_user_data(self, user_id: int, user_data: dict):
+        """
+        Заменяет user_data (на месте — на этот словарь ссылаются контексты PTB) состоянием из БД.
+        """
+        data = await self.db.load_user_state(user_id, self.max_age)
+        user_data.clear()
+        user_data.update(self._decode(user_id, data) if data else {})
+
+    async def store_user_data(self, user_id: int, user_data: dict):
+        await self.db.save_user_states({user_id: json.dumps(user_data, ensure_ascii=False) if user_data else None})
+
+    @staticmethod
+    def _decode(user_id: int, data: str) -> dict:
+        try:
+            return json.loads(data)
+        except ValueError:
+            logger.warning(f"Повреждённое состояние пользователя {user_id}, пропускаем")
+            return {}
+
+    async def purge_stale(self) -> int:
+        """
+        Удаляет из БД состояния, не менявшиеся дольше max_age (их всё равно не загрузят).
+        """
+        if self.max_age is None:
+            return 0
+        try:
+            purged = await self.db.purge_user_states(self.max_age)
+        except Exception as e:
+            logger.error(f"Не удалось удалить устаревшие состояния диалогов: {e}")
+            return 0
+        if purged:
+            logger.info(f"Удалено брошенных диалогов: {purged}")
+        return purged
+
+    # ---------- запись ----------
+    def _schedule_write(self):
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.get_running_loop().create_task(self._write_later())
+
+    async def _write_later(self):
+        # ждём, пока PTB передаст остальные изменения этого прохода, и пишем всё разом
+        await asyncio.sleep(self.write_delay)
+        await self._write_dirty()
+
+    async def _write_dirty(self):
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        try:
+            await self.db.save_user_states(batch)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить состояния диалогов: {e}")
+            self._dirty = {**batch, **self._dirty}
+
+    async def flush(self):
+        await self._write_dirty()
+        if self._write_task is not None:
+            await asyncio.gather(self._write_task, return_exceptions=True)
+
+    # ---------- остальное не храним ----------
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
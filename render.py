@@ -0,0 +1,245 @@
+import html
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+
+from callback_data import PAGE_NEWER, PAGE_OLDER, codec
+from db import STATUS_ACTIVE, STATUS_CLOSED, STATUS_IN_PROGRESS
+
+# ================== Главное меню ===================
+MENU_CREATE = "🆕 Создать тикет"
+MENU_MY_TICKETS = "📂 Мои тикеты"
+MENU_FAQ = "📖 FAQ"
+MENU_EDIT = "⚙️ Изменить данные"
+MENU_BUTTONS = frozenset({MENU_CREATE, MENU_MY_TICKETS, MENU_FAQ, MENU_EDIT})
+
+# Объекты разметки в PTB неизменяемы, поэтому их можно собрать один раз и переиспользовать
+MAIN_MENU_KB = ReplyKeyboardMarkup(
+    [
+        [KeyboardButton(MENU_CREATE)],
+        [KeyboardButton(MENU_MY_TICKETS), KeyboardButton(MENU_FAQ)],
+        [KeyboardButton(MENU_EDIT)],
+    ],
+    resize_keyboard=True,
+)
+
+PHOTO_CHOICE_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📎 Прикрепить фото/файлы", callback_data="add_photo")],
+    [InlineKeyboardButton("⏭️ Без вложений", callback_data="skip_photo")],
+])
+
+
+def main_menu_kb():
+    return MAIN_MENU_KB
+
+
+# ================== Время ==========================
+@lru_cache(maxsize=8192)
+def human_time(ts: str) -> str:
+    """
+    Переводит ISO8601 в локальное время 'DD.MM.YYYY HH:MM'.
+    Если без tz — считаем, что это UTC. Результат кешируется: created_at тикета не меняется.
+    """
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.astimezone().strftime("%d.%m.%Y %H:%M")
+    except Exception:
+        return ts
+
+
+# ================== Карточка тикета ================
+TICKET_HEAD = "📂 <b>Тикет #{id}</b>\n👤 {user}\n🕒 {created}\n📝 {description}\n"
+STATUS_LINE_ACTIVE = f"📌 <b>Статус:</b> {STATUS_ACTIVE}"
+STATUS_LINE_IN_PROGRESS = f"📌 <b>Статус:</b> {STATUS_IN_PROGRESS}\n🤝 <b>Взял:</b> "
+STATUS_LINE_CLOSED = f"📌 <b>Статус:</b> {STATUS_CLOSED} ✅"
+CLOSED_ADMIN_LINE = "\n👨‍💻 <b>Админ:</b> "
+FEEDBACK_BLOCK = "\n\n📈 <b>Оценка:</b> {stars}\n💬 <b>Отзыв:</b> {comment}"
+
+
+def render_ticket_text(t: dict, u: dict | None, *, with_feedback: bool = False, stars: int | None = None, comment: str | None = None) -> str:
+    """
+    Собирает HTML-текст для карточки тикета.
+    """
+    assigned = t.get("assigned_to")
+    text = TICKET_HEAD.format(
+        id=t["id"],
+        user=u["full_name"] if u else f"User {t['user_id']}",
+        created=human_time(t["created_at"]) if t.get("created_at") else "—",
+        description=t["description"],
+    )
+
+    if t["status"] == STATUS_ACTIVE:
+        text += STATUS_LINE_ACTIVE
+    elif t["status"] == STATUS_IN_PROGRESS:
+        text += STATUS_LINE_IN_PROGRESS + str(assigned)
+    else:  # закрыт
+        text += STATUS_LINE_CLOSED + (CLOSED_ADMIN_LINE + assigned if assigned else "")
+
+    if with_feedback and stars:
+        text += FEEDBACK_BLOCK.format(stars="⭐️" * int(stars), comment=comment or "—")
+
+    return text
+
+
+TICKET_LIST_ITEM = "#{id} | {created}\n📌 {status}\n📝 {short}\n\n"
+
+
+def render_ticket_list(rows, *, title: str) -> str:
+    """
+    Страница "Мои тикеты": rows — (id, description, status, created_at).
+    """
+    parts = [title]
+    for tid, desc, status, created in rows:
+        desc = desc or ""
+        short = desc[:120] + ("..." if len(desc) > 120 else "")
+        parts.append(TICKET_LIST_ITEM.format(id=tid, created=human_time(created), status=status, short=short))
+    return "".join(parts)
+
+
+SEARCH_ITEM = "#{id} | {created} | {status}\n👤 {user}\n🔎 {snippet}\n\n"
+
+
+def render_search_results(rows, *, query: str, continued: bool = False) -> str:
+    """
+    Результаты /search: rows — (id, status, created_at, full_name, фрагмент).
+    """
+    if not rows:
+        return f"🔎 По запросу «{query}» {'больше ' if continued else ''}ничего не найдено."
+    parts = [f"🔎 Результаты по запросу «{query}»{' (продолжение)' if continued else ''}:\n\n"]
+    for tid, status, created, full_name, snippet in rows:
+        parts.append(SEARCH_ITEM.format(id=tid, created=human_time(created), status=status, user=full_name or "—", snippet=snippet))
+    return "".join(parts)
+
+
+# ================== Напоминания ====================
+def channel_post_link(channel_id: int, message_id: int | None) -> str | None:
+    """
+    Ссылка на пост закрытого канала: t.me/c/<id без -100>/<message_id>.
+    """
+    if not message_id or not str(channel_id).startswith("-100"):
+        return None
+    return f"https://t.me/c/{str(channel_id)[4:]}/{message_id}"
+
+
+def render_stale_digest(tickets: list[dict], *, title: str, now: float, channel_id: int) -> list[str]:
+    """
+    Сводка зависших тикетов одним или несколькими сообщениями (HTML, до ~4000 символов каждое).
+    tickets — строки Database.find_stale_tickets().
+    """
+    messages, current = [], title
+    for t in tickets:
+        link = channel_post_link(channel_id, t["channel_msg_id"])
+        label = f'<a href="{link}">#{t["id"]}</a>' if link else f"#{t['id']}"
+        who = f" — {html.escape(t['assigned_to'])}" if t.get("assigned_to") else ""
+        line = f"• {label}: {t['status']} уже {format_duration(now - t['status_at'])}{who}\n"
+        if len(current) + len(line) > 4000:
+            messages.append(current)
+            current = title
+        current += line
+    messages.append(current)
+    return messages
+
+
+# ================== Статистика =====================
+def format_duration(seconds: float | None) -> str:
+    if seconds is None:
+        return "—"
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes} мин" if minutes else f"{int(seconds)} с"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 48:
+        return f"{hours} ч {minutes} мин"
+    return f"{hours // 24} д {hours % 24} ч"
+
+
+SLA_ADMIN_ITEM = "👨‍💻 {admin}: взял {assigned} (до взятия ~{assign}), закрыл {closed} (до закрытия ~{close}), оценка {stars}\n"
+
+
+def render_sla_report(rows: list[dict], *, since: str, days: int) -> str:
+    """
+    Отчёт /stats: rows — из Database.sla_report(). Строка с admin "" — тикеты без админа.
+    """
+    created = sum(r["created"] for r in rows)
+    assigned = sum(r["assigned"] for r in rows)
+    closed = sum(r["closed"] for r in rows)
+    auto_closed = sum(r["auto_closed"] for r in rows)
+    ratings = sum(r["ratings"] for r in rows)
+
+    def total_avg(field, weight):
+        total = sum(r[field] * r[weight] for r in rows if r[field] is not None)
+        count = sum(r[weight] for r in rows if r[field] is not None)
+        return total / count if count else None
+
+    stars = total_avg("avg_stars", "ratings")
+    parts = [
+        f"📊 <b>Статистика за {days} дн.</b> (с {since}, UTC)\n\n",
+        f"🆕 Создано: {created}\n",
+        f"🤝 Взято: {assigned}, в среднем через {format_duration(total_avg('avg_assign_seconds', 'assigned'))}\n",
+        f"✅ Закрыто админами: {closed}, в среднем через {format_duration(total_avg('avg_close_seconds', 'closed'))}\n",
+        f"🤖 Закрыто автоматически: {auto_closed}\n",
+        f"⭐️ Оценок: {ratings}, средняя {f'{stars:.2f}' if stars else '—'}\n\n",
+    ]
+    for r in rows:
+        if not r["admin"] or not (r["assigned"] or r["closed"] or r["ratings"]):
+            continue
+        parts.append(SLA_ADMIN_ITEM.format(
+            admin=html.escape(r["admin"]),
+            assigned=r["assigned"],
+            assign=format_duration(r["avg_assign_seconds"]),
+            closed=r["closed"],
+            close=format_duration(r["avg_close_seconds"]),
+            stars=f"{r['avg_stars']:.2f}" if r["avg_stars"] else "—",
+        ))
+    return "".join(parts)
+
+
+# ================== Листание =======================
+def page_keyboard(action: str, rows, *, has_older: bool, has_newer: bool = False) -> InlineKeyboardMarkup | None:
+    """
+    Кнопки "Новее/Старее" для страницы, отсортированной от новых к старым (id в rows[...][0]).
+    Курсор — id крайнего тикета страницы, так что следующая страница выбирается по индексу (keyset).
+    """
+    buttons = []
+    if has_newer and rows:
+        buttons.append(InlineKeyboardButton("⬅️ Новее", callback_data=codec.encode(action, rows[0][0], PAGE_NEWER)))
+    if has_older and rows:
+        buttons.append(InlineKeyboardButton("Старее ➡️", callback_data=codec.encode(action, rows[-1][0], PAGE_OLDER)))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+def search_page_keyboard(rows, *, has_older: bool, query_id: int) -> InlineKeyboardMarkup | None:
+    """
+    Кнопка "Старее" для результатов /search: курсор и номер запроса, по которому листаем.
+    """
+    if not (has_older and rows):
+        return None
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Старее ➡️", callback_data=codec.encode("search", rows[-1][0], query_id))]])
+
+
+# ================== Клавиатуры тикета ==============
+@lru_cache(maxsize=4096)
+def ticket_keyboard(ticket_id: int, status: str) -> InlineKeyboardMarkup | None:
+    """
+    Кнопки карточки в канале для данного состояния; у закрытого тикета кнопок нет.
+    """
+    close = [InlineKeyboardButton("✅ Закрыть тикет", callback_data=codec.encode("close", ticket_id))]
+    if status == STATUS_ACTIVE:
+        return InlineKeyboardMarkup([[InlineKeyboardButton("🤝 Взять заявку", callback_data=codec.encode("assign", ticket_id))], close])
+    if status == STATUS_IN_PROGRESS:
+        return InlineKeyboardMarkup([[InlineKeyboardButton("❌ Отменить взятие", callback_data=codec.encode("unassign", ticket_id))], close])
+    return None
+
+
+@lru_cache(maxsize=4096)
+def rating_keyboard(ticket_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton(f"{n}⭐️", callback_data=codec.encode("rate", ticket_id, n)) for n in range(1, 6)
+    ]])
+
+
+def user_chat_keyboard(user_link: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton("💬 Открыть чат с пользователем", url=user_link)]])
@@ -0,0 +1,176 @@
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from callback_data import CallbackCodec, InvalidCallbackData
+
+logger = logging.getLogger(__name__)
+
+TextHandler = Callable[[Update, ContextTypes.DEFAULT_TYPE, str], Awaitable[None]]
+CallbackHandler = Callable[..., Awaitable[None]]
+LegacyCheck = Callable[[Update], bool]
+
+
+# ================== Текстовые сообщения ============
+@dataclass(frozen=True)
+class StepRoute:
+    handler: TextHandler
+    # Текст-отказ, если во время шага нажали кнопку меню; None — кнопка меню сработает как обычно
+    menu_blocked: str | None = None
+
+
+class TextRouter:
+    """
+    Маршрутизация текста по таблицам вместо цепочки if:
+    1) шаг диалога (context.user_data["step"]) -> обработчик шага;
+    2) надпись кнопки главного меню -> обработчик пункта меню;
+    3) иначе — fallback.
+    Шаг может либо блокировать меню (регистрация, отзыв), либо уступать ему (описание тикета).
+    """
+
+    def __init__(self):
+        self.steps: dict[str, StepRoute] = {}
+        self.menu: dict[str, TextHandler] = {}
+        self.fallback: TextHandler | None = None
+
+    def step(self, *names: str, menu_blocked: str | None = None):
+        def decorator(handler: TextHandler) -> TextHandler:
+            for name in names:
+                if name in self.steps:
+                    raise ValueError(f"Шаг {name!r} уже зарегистрирован")
+                self.steps[name] = StepRoute(handler, menu_blocked)
+            return handler
+        return decorator
+
+    def menu_item(self, label: str):
+        def decorator(handler: TextHandler) -> TextHandler:
+            if label in self.menu:
+                raise ValueError(f"Пункт меню {label!r} уже зарегистрирован")
+            self.menu[label] = handler
+            return handler
+        return decorator
+
+    def default(self, handler: TextHandler) -> TextHandler:
+        self.fallback = handler
+        return handler
+
+    def resolve(self, step: str | None, text: str) -> TextHandler | str | None:
+        """
+        Возвращает обработчик, текст-отказ (строку) или None, если подходящего маршрута нет.
+        """
+        route = self.steps.get(step) if step else None
+        menu = self.menu.get(text)
+        if route is not None:
+            if menu is None:
+                return route.handler
+            if route.menu_blocked:
+                return route.menu_blocked
+        return menu or self.fallback
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        text = (update.message.text or "").strip()
+        target = self.resolve(context.user_data.get("step"), text)
+        if isinstance(target, str):
+            await update.message.reply_text(target)
+        elif target is not None:
+            await target(update, context, text)
+
+
+# ================== Callback-кнопки ================
+@dataclass(frozen=True)
+class CallbackRoute:
+    handler: CallbackHandler
+    arg_types: tuple[type, ...] = ()
+    # Ответ пользователю на некорректные данные; None — молча игнорировать
+    invalid_text: str | None = None
+    # Где принимать неподписанный старый формат; None — нигде (такие кнопки не выпускались)
+    legacy: LegacyCheck | None = None
+
+
+class CallbackRouter:
+    """
+    Маршрутизация callback_data. Точные значения ("add_photo") ищутся в словаре целиком;
+    подписанные данные кодека (см. callback_data.py) декодируются за один шаг в
+    (действие, id тикета, аргумент); старый формат "<action>[_<arg>...]" с уже
+    опубликованных карточек разбирается и приводится к объявленным типам.
+    Старый формат не подписан и подделывается любым клиентом, поэтому принимается только
+    там, где такие кнопки публиковались: маршрут объявляет это проверкой legacy(update).
+    Обработчик вызывается как handler(update, context, *args).
+    """
+
+    def __init__(self, codec: CallbackCodec | None = None):
+        self.codec = codec
+        self.exact: dict[str, CallbackRoute] = {}
+        self.actions: dict[str, CallbackRoute] = {}
+
+    def on_exact(self, data: str):
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            self.exact[data] = CallbackRoute(handler)
+            return handler
+        return decorator
+
+    def on_action(self, action: str, *arg_types: type, invalid_text: str | None = None, legacy: LegacyCheck | None = None):
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            self.actions[action] = CallbackRoute(handler, arg_types, invalid_text, legacy)
+            return handler
+        return decorator
+
+    def is_legacy(self, data: str) -> bool:
+        """
+        Данные старого неподписанного формата (без кодека весь формат считается своим).
+        """
+        return self.codec is not None and data not in self.exact and not self.codec.is_encoded(data)
+
+    def parse(self, data: str) -> tuple[CallbackRoute | None, tuple | None]:
+        """
+        (маршрут, аргументы); аргументы None — данные не подходят под схему маршрута.
+        """
+        route = self.exact.get(data)
+        if route is not None:
+            return route, ()
+        if self.codec is not None and self.codec.is_encoded(data):
+            return self._parse_encoded(data)
+        action, _, rest = data.partition("_")
+        route = self.actions.get(action)
+        if route is None:
+            return None, None
+        parts = rest.split("_") if rest else []
+        if len(parts) != len(route.arg_types):
+            return route, None
+        try:
+            return route, tuple(t(p) for t, p in zip(route.arg_types, parts))
+        except ValueError:
+            return route, None
+
+    def _parse_encoded(self, data: str) -> tuple[CallbackRoute | None, tuple | None]:
+        try:
+            payload = self.codec.decode(data)
+        except InvalidCallbackData as e:
+            logger.warning(f"Отклонён callback ({e.reason}): {data!r}")
+            return None, None
+        route = self.actions.get(payload.action)
+        if route is None:
+            return None, None
+        args = (payload.ticket_id, payload.arg)[:len(route.arg_types)]
+        return route, args
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        data = query.data or ""
+        route, args = self.parse(data)
+        if route is None:
+            logger.warning(f"Неизвестный callback: {data!r}")
+            return
+        if self.is_legacy(data) and (route.legacy is None or not route.legacy(update)):
+            chat_id = query.message.chat.id if query.message else None
+            logger.warning(f"Отклонён callback старого формата: {data!r} (чат {chat_id}, от {query.from_user.id})")
+            return
+        if args is None:
+            logger.warning(f"Некорректный callback: {data!r}")
+            if route.invalid_text:
+                await query.edit_message_text(route.invalid_text)
+            return
+        await route.handler(update, context, *args)
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# bot.py читает обязательные настройки при импорте; БД и сеть при импорте не трогаются
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("CHANNEL_ID", "-1001000000000")
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from telegram import InputMediaDocument, InputMediaPhoto
+
+from attachments import MEDIA_GROUP_MAX, MediaGroupCollector, attachment_from_message, media_batches
+from db import Database
+
+
+def photo(uid: str) -> dict:
+    return {"kind": "photo", "file_id": f"f-{uid}", "file_unique_id": uid, "file_name": None, "mime_type": "image/jpeg", "file_size": 1}
+
+
+def document(uid: str) -> dict:
+    return {"kind": "document", "file_id": f"f-{uid}", "file_unique_id": uid, "file_name": f"{uid}.pdf", "mime_type": "application/pdf", "file_size": 2}
+
+
+# ================== Вложения =======================
+def test_attachment_from_message():
+    sizes = [SimpleNamespace(file_id=f"s{i}", file_unique_id=f"u{i}", file_size=i) for i in range(3)]
+    assert attachment_from_message(SimpleNamespace(photo=sizes, document=None))["file_id"] == "s2"  # самый крупный
+    doc = SimpleNamespace(file_id="d", file_unique_id="ud", file_name="a.pdf", mime_type="application/pdf", file_size=5)
+    assert attachment_from_message(SimpleNamespace(photo=(), document=doc))["kind"] == "document"
+    assert attachment_from_message(SimpleNamespace(photo=(), document=None)) is None
+
+
+def test_media_batches():
+    items = [photo(f"p{i}") for i in range(MEDIA_GROUP_MAX + 2)] + [document("d1"), photo("p-last")]
+    batches = media_batches(items, caption="Вложения")
+    assert [len(b) for b in batches] == [MEDIA_GROUP_MAX, 3, 1]
+    assert all(isinstance(m, InputMediaPhoto) for m in batches[0] + batches[1])
+    assert isinstance(batches[2][0], InputMediaDocument)
+    assert [m.caption for b in batches for m in b if m.caption] == ["Вложения"]
+
+
+def test_media_is_stored_once(tmp_path):
+    db = Database(str(tmp_path / "bot.db"), read_pool_size=1)
+    db.open()
+    try:
+        first = db.save_ticket(1, "альбом", None, [photo("p1"), photo("p2")])
+        second = db.save_ticket(1, "тот же файл", None, [photo("p1") | {"file_id": "f-new"}])
+        with db.read() as conn:
+            media = conn.execute("SELECT file_unique_id, file_id FROM media ORDER BY file_unique_id").fetchall()
+            links = conn.execute("SELECT ticket_id, position, file_unique_id FROM ticket_attachments ORDER BY 1, 2").fetchall()
+    finally:
+        db.close()
+    assert media == [("p1", "f-new"), ("p2", "f-p2")]  # file_id обновлён на последний
+    assert links == [(first, 0, "p1"), (first, 1, "p2"), (second, 0, "p1")]
+
+
+# ================== Сбор альбомов ==================
+def test_collector_finishes_once_after_quiet_window():
+    async def scenario():
+        albums = MediaGroupCollector(window=0.05)
+        finished = []
+        started = time.monotonic()
+
+        def finisher(part):
+            async def finish():
+                finished.append((part, time.monotonic() - started))
+            return finish
+
+        for part in range(4):
+            albums.touch("g", finisher(part))
+            await asyncio.sleep(0.02)
+        assert albums.pending == 1
+        while albums.pending:
+            await asyncio.sleep(0.01)
+        return finished
+
+    finished = asyncio.run(scenario())
+    assert len(finished) == 1
+    part, at = finished[0]
+    assert part == 3  # последняя заведённая функция
+    assert at >= 0.06 + 0.05  # окно отсчитывается от последней части
+
+
+def test_collector_flush_runs_pending_immediately():
+    async def scenario():
+        albums = MediaGroupCollector(window=30)
+        finished = []
+
+        async def finish(key):
+            # как finish() в bot.py: досчитывает своё ожидание, но flush() его прерывает
+            while not albums.closing:
+                await albums.sleep(30)
+            finished.append(key)
+
+        albums.touch("a", lambda: finish("a"))
+        albums.touch("b", lambda: finish("b"))
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        await albums.flush()
+        return finished, time.monotonic() - started, albums.pending
+
+    finished, elapsed, pending = asyncio.run(scenario())
+    assert sorted(finished) == ["a", "b"]
+    assert elapsed < 1
+    assert pending == 0
+
+
+def test_collector_error_in_finish_does_not_leak():
+    async def scenario():
+        albums = MediaGroupCollector(window=0.01)
+
+        async def broken():
+            raise RuntimeError("сбой")
+
+        albums.touch("g", broken)
+        await asyncio.sleep(0.05)
+        return albums.pending
+
+    assert asyncio.run(scenario()) == 0
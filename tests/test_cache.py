@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+import db as db_module
+from db import Database, LRUCache
+
+
+# ================== LRU и TTL ======================
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_size=2, ttl=None)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "a" теперь свежее "b"
+    cache.put("c", 3)
+    assert cache.get("b", "нет") == "нет"
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_ttl_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = LRUCache(max_size=10, ttl=60)
+    cache.put("a", 1)
+    now[0] += 59
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a", "нет") == "нет"
+    assert cache.stats()["size"] == 0  # просроченная запись удалена при чтении
+
+
+def test_stats_count_hits_and_misses():
+    cache = LRUCache(max_size=10, ttl=None)
+    cache.put("none", None)  # отрицательный результат — тоже попадание
+    assert cache.get("none", "нет") is None
+    assert cache.get("missing", "нет") == "нет"
+    cache.invalidate("none")
+    assert cache.get("none", "нет") == "нет"
+    assert cache.stats() == {"size": 0, "max_size": 10, "hits": 1, "misses": 2}
+
+
+# ================== Версии ключей ==================
+def test_versioned_put_skips_key_written_meanwhile():
+    cache = LRUCache(max_size=10, ttl=None)
+    seen = cache.version("a")
+    cache.put("a", "новый")  # запись между чтением версии и put читателя
+    assert cache.put("a", "старый", version=seen) is False
+    assert cache.get("a") == "новый"
+
+    seen = cache.version("a")
+    assert cache.put("a", "из БД", version=seen) is True
+    assert cache.put("b", "из БД", version=cache.version("b")) is True
+
+
+def test_versioned_put_skips_key_invalidated_meanwhile():
+    cache = LRUCache(max_size=10, ttl=None)
+    seen = cache.version("a")
+    cache.invalidate("a")
+    assert cache.put("a", "старый", version=seen) is False
+
+    seen = cache.version("a")
+    cache.invalidate()
+    assert cache.put("a", "старый", version=seen) is False
+
+
+def test_versions_survive_eviction():
+    # версия забытого ключа не возвращается к прежнему значению
+    cache = LRUCache(max_size=2, ttl=None)
+    seen = cache.version("a")
+    cache.put("a", "новый")
+    for key in "bcd":
+        cache.put(key, key)  # вытесняют и значение, и версию "a"
+    assert cache.put("a", "старый", version=seen) is False
+    assert cache.get("a", "нет") == "нет"
+
+
+# ================== Профили пользователей ==========
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"), read_pool_size=1)
+    db.open()
+    yield db
+    db.close()
+
+
+def test_fetch_user_does_not_cache_row_older_than_save(db, monkeypatch):
+    db.save_user(1, "old", "Старое Имя", "каб. 1")
+    db.users.invalidate(1)
+
+    # читатель выбрал старую строку, и тут же save_user записал новый профиль
+    user_from_row = db_module.user_from_row
+
+    def save_between(row):
+        db.save_user(1, "new", "Новое Имя", "каб. 2")
+        return user_from_row(row)
+
+    monkeypatch.setattr(db_module, "user_from_row", save_between)
+    assert db.fetch_user(1)["username"] == "old"
+    monkeypatch.setattr(db_module, "user_from_row", user_from_row)
+
+    assert db.get_user(1)["username"] == "new"
+    assert db.users.stats()["hits"] == 1
+
+
+def test_get_user_caches_profile_and_absence(db):
+    db.save_user(1, "user", "Имя", "каб. 1")
+    db.users.invalidate()
+    assert db.get_user(1)["place"] == "каб. 1"
+    assert db.get_user(1)["place"] == "каб. 1"
+    assert db.get_user(2) is None
+    assert db.get_user(2) is None
+    assert db.users.stats()["hits"] == 2
+    assert db.users.stats()["misses"] == 2
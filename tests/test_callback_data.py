@@ -0,0 +1,74 @@
+import base64
+
+import pytest
+
+from callback_data import _BODY, _SIGNATURE_SIZE, ACTIONS, PREFIX, CallbackCodec, CallbackPayload, InvalidCallbackData
+
+codec = CallbackCodec("secret")
+
+
+def reason(data: str, c: CallbackCodec = codec) -> str:
+    with pytest.raises(InvalidCallbackData) as e:
+        c.decode(data)
+    return e.value.reason
+
+
+def raw(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data[len(PREFIX):] + "==")
+
+
+def pack(raw_bytes: bytes) -> str:
+    return PREFIX + base64.urlsafe_b64encode(raw_bytes).rstrip(b"=").decode()
+
+
+@pytest.mark.parametrize("action", sorted(ACTIONS))
+def test_round_trip(action):
+    data = codec.encode(action, 4_000_000_000, 255)
+    assert len(data.encode()) <= 64  # лимит Telegram на callback_data
+    assert codec.is_encoded(data)
+    assert codec.decode(data) == CallbackPayload(action, 4_000_000_000, 255)
+
+
+def test_legacy_format_is_not_encoded():
+    assert not codec.is_encoded("assign_123")
+
+
+def test_forged_body():
+    data = raw(codec.encode("assign", 123))
+    body = bytearray(data[:_BODY.size])
+    body[-2] ^= 1  # другой id тикета под старой подписью
+    assert reason(pack(bytes(body) + data[_BODY.size:])) == "forged"
+
+
+def test_forged_signature():
+    data = bytearray(raw(codec.encode("close", 7)))
+    data[-1] ^= 0x80
+    assert reason(pack(bytes(data))) == "forged"
+
+
+def test_other_secret_is_forged():
+    assert reason(CallbackCodec("other").encode("close", 7)) == "forged"
+
+
+def test_stale_version():
+    old = CallbackCodec("secret", version=0)
+    assert reason(old.encode("close", 7)) == "stale"
+
+
+@pytest.mark.parametrize("cut", [1, 2, _SIGNATURE_SIZE])
+def test_truncated(cut):
+    data = codec.encode("rate", 12, 5)
+    assert reason(data[:-cut]) == "malformed"
+
+
+def test_padded_and_garbage():
+    data = codec.encode("rate", 12, 5)
+    assert reason(data + "A") == "malformed"
+    assert reason(PREFIX + "!" * (len(data) - 1)) in ("malformed", "forged")
+    assert reason("assign_123") == "malformed"
+
+
+def test_unknown_action_code():
+    c = CallbackCodec("secret")
+    body = _BODY.pack(c.version, 200, 1, 0)
+    assert reason(pack(body + c._sign(body)), c) == "malformed"
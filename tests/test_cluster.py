@@ -0,0 +1,166 @@
+import asyncio
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+import pytest
+
+from cluster import Cluster
+from db import AsyncDatabase, Database
+from persistence import SQLitePersistence
+
+
+class FakeApp:
+    """
+    То, что Cluster трогает в Application: user_data, persistence, отметка для сохранения.
+    """
+
+    def __init__(self, log: list, persistence: SQLitePersistence | None = None):
+        self.log = log
+        self.persistence = persistence
+        self.user_data: dict = defaultdict(dict)
+        self.marked: list = []
+        self.handler = None  # handler(update, user_data) вместо хендлеров PTB
+
+    def mark_data_for_update_persistence(self, user_ids):
+        self.marked.append(user_ids)
+
+    async def process_update(self, update):
+        self.log.append(f"{update.name}+")
+        if self.handler is not None:
+            self.handler(update, self.user_data[update.user_id])
+        await asyncio.sleep(0.02)
+        self.log.append(f"{update.name}-")
+
+
+def user_update(name: str, user_id: int):
+    return SimpleNamespace(name=name, user_id=user_id)
+
+
+def by_user(update):
+    return ("user", update.user_id)
+
+
+# ================== Одна реплика ===================
+def test_timer_work_waits_for_running_update_of_same_user():
+    async def scenario():
+        log = []
+        app = FakeApp(log)
+        cluster = Cluster(None, enabled=False, key=by_user)
+
+        async def timer():
+            await asyncio.sleep(0.005)  # апдейт уже обрабатывается
+            async with cluster.user_session(app, 1):
+                log.append("timer")
+
+        await asyncio.gather(
+            cluster.process_update(app, user_update("u1", 1)),
+            cluster.process_update(app, user_update("other", 2)),
+            timer(),
+        )
+        return log, app.marked
+
+    log, marked = asyncio.run(scenario())
+    assert log.index("timer") > log.index("u1-")
+    assert log.index("other+") < log.index("u1-")  # другой пользователь не ждёт
+    assert marked == [1]  # изменения user_data вне апдейта сохранит persistence PTB
+
+
+def test_disabled_cluster_does_not_touch_db():
+    async def scenario():
+        cluster = Cluster(None, enabled=False)
+        assert await cluster.claim_update(1)
+        assert await cluster.claim_update(1)  # повторы отсекает локальный кеш WebhookIngest
+        assert await cluster.run_once("sweep", 60)
+        async with cluster.lock(None):
+            pass
+        return cluster.stats
+
+    assert asyncio.run(scenario()) == {"locks": 0, "lock_waits": 0, "duplicates": 0}
+
+
+# ================== Несколько реплик ===============
+@pytest.fixture
+def replicas(tmp_path):
+    """
+    Две реплики на одном файле SQLite: у каждой свой Database и свой Cluster.
+    """
+    dbs = [AsyncDatabase(Database(str(tmp_path / "bot.db"))) for _ in range(2)]
+    for db in dbs:
+        db.open()
+    yield [Cluster(db, enabled=True, node_id=name, lock_ttl=0.3, key=by_user) for db, name in zip(dbs, "AB")]
+    for db in dbs:
+        db.close()
+
+
+def test_lock_is_exclusive_across_replicas_and_renewed(replicas):
+    a, b = replicas
+
+    async def scenario():
+        log = []
+
+        async def hold(cluster, key, name):
+            async with cluster.lock(key):
+                log.append(f"{name}+")
+                await asyncio.sleep(0.5)  # дольше lock_ttl: держится продлением
+                log.append(f"{name}-")
+
+        await asyncio.gather(hold(a, ("user", 1), "a"), hold(b, ("user", 1), "b"), hold(b, ("user", 2), "c"))
+        return log
+
+    log = asyncio.run(scenario())
+    first, second = ("a", "b") if log.index("a+") < log.index("b+") else ("b", "a")
+    assert log.index(f"{second}+") > log.index(f"{first}-")
+    assert log.index("c+") < log.index(f"{first}-")  # другой ключ не ждёт
+    assert a.stats["lock_waits"] + b.stats["lock_waits"] >= 1
+
+
+def test_run_once_and_claim_update_are_shared(replicas):
+    a, b = replicas
+
+    async def scenario():
+        jobs = [await a.run_once("sweep", 0.2), await b.run_once("sweep", 0.2)]
+        await asyncio.sleep(0.25)
+        jobs.append(await b.run_once("sweep", 0.2))  # период истёк — очередь другой реплики
+        claims = [await a.claim_update(7), await b.claim_update(7), await b.claim_update(8)]
+        return jobs, claims
+
+    jobs, claims = asyncio.run(scenario())
+    assert jobs == [True, False, True]
+    assert claims == [True, False, True]
+    assert b.stats["duplicates"] == 1
+
+
+def test_dialog_state_follows_user_across_replicas(replicas):
+    a, b = replicas
+
+    def step(update, user_data):
+        user_data.setdefault("seen", []).append(update.name)
+
+    async def scenario():
+        apps = []
+        for cluster in (a, b):
+            app = FakeApp([], SQLitePersistence(cluster.db, shared=True))
+            app.handler = step
+            apps.append(app)
+        # апдейты пользователя попадают на разные реплики по очереди
+        for i, (cluster, app) in enumerate([(a, apps[0]), (b, apps[1]), (a, apps[0])]):
+            await cluster.process_update(app, user_update(f"u{i}", 1))
+        return apps, await a.db.load_user_state(1)
+
+    apps, stored = asyncio.run(scenario())
+    assert apps[0].user_data[1]["seen"] == ["u0", "u1", "u2"]
+    assert '"seen": ["u0", "u1", "u2"]' in stored
+
+
+def test_purge_removes_expired_coordination_rows(replicas):
+    a, _ = replicas
+
+    async def scenario():
+        await a.claim_update(1)
+        await a.run_once("sweep", 0.01)
+        await asyncio.sleep(0.02)
+        await a.purge(keep_updates=0)
+        return await a.db.purge_expired(time.time() + 1)
+
+    assert asyncio.run(scenario()) == (0, 0)
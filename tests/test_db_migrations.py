@@ -0,0 +1,197 @@
+import sqlite3
+
+import pytest
+
+from db import AUTO_CLOSE_ACTOR, MIGRATIONS, STATUS_ACTIVE, STATUS_CLOSED, STATUS_IN_PROGRESS, Database
+
+# Схема и данные исходного bot.py (до Database): три таблицы, без версии
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER UNIQUE,
+    username TEXT,
+    full_name TEXT,
+    place TEXT
+);
+CREATE TABLE tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    description TEXT,
+    photo_id TEXT,
+    status TEXT,
+    channel_msg_id INTEGER,
+    created_at TEXT,
+    assigned_to TEXT
+);
+CREATE TABLE feedback (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticket_id INTEGER,
+    user_id INTEGER,
+    stars INTEGER,
+    comment TEXT,
+    created_at TEXT
+);
+"""
+
+BASELINE_TICKETS = [
+    (1, "Не работает принтер", "AgPhoto", STATUS_ACTIVE, 501, "2026-10-01T09:00:00+00:00", None),
+    (1, "Нет доступа к почте", None, STATUS_IN_PROGRESS, 502, "2026-10-02T09:00:00+00:00", "@alice"),
+    (1, "Принтер снова жуёт бумагу", None, STATUS_CLOSED, 503, "2026-10-03T09:00:00+00:00", "@alice"),
+]
+
+
+def create_baseline(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("INSERT INTO users (user_id, username, full_name, place) VALUES (1, 'ivan', 'Иван Тестов', '3 этаж')")
+    conn.executemany(
+        "INSERT INTO tickets (user_id, description, photo_id, status, channel_msg_id, created_at, assigned_to) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        BASELINE_TICKETS,
+    )
+    conn.execute(
+        "INSERT INTO feedback (ticket_id, user_id, stars, comment, created_at) "
+        "VALUES (3, 1, 5, 'спасибо, всё печатает', '2026-10-03T12:00:00+00:00')"
+    )
+    conn.commit()
+    conn.close()
+
+
+def create_at_version(path, version: int):
+    """
+    База, доведённая до version прямым применением миграций (как её оставил старый код).
+    """
+    conn = sqlite3.connect(path)
+    for stmts in MIGRATIONS[:version]:
+        for stmt in stmts:
+            conn.execute(stmt)
+    conn.execute(f"PRAGMA user_version={version}")
+    conn.commit()
+    return conn
+
+
+@pytest.fixture
+def opened():
+    dbs = []
+
+    def open_db(path) -> Database:
+        db = Database(str(path), read_pool_size=1)
+        db.open()
+        dbs.append(db)
+        return db
+
+    yield open_db
+    for db in dbs:
+        db.close()
+
+
+def user_version(db: Database) -> int:
+    with db.read() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def schema(db: Database) -> dict:
+    with db.read() as conn:
+        tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'ticket_fts_%'")]
+        return {t: [r[1:3] for r in conn.execute(f"PRAGMA table_info({t})")] for t in sorted(tables)}
+
+
+# ================== Исходная схема =================
+def test_baseline_upgrade_keeps_data(tmp_path, opened):
+    create_baseline(tmp_path / "bot.db")
+    db = opened(tmp_path / "bot.db")
+    assert user_version(db) == len(MIGRATIONS)
+
+    assert db.get_user(1)["full_name"] == "Иван Тестов"
+    assert [(t["status"], t["assigned_to"]) for t in map(db.get_ticket, (1, 2, 3))] == [
+        (STATUS_ACTIVE, None), (STATUS_IN_PROGRESS, "@alice"), (STATUS_CLOSED, "@alice"),
+    ]
+    assert db.get_ticket(1)["photo"] == "AgPhoto"
+    rows, has_older, has_newer = db.get_user_tickets(1, limit=2)
+    assert [r[0] for r in rows] == [3, 2] and has_older and not has_newer
+
+
+def test_baseline_upgrade_backfills_search_and_events(tmp_path, opened):
+    create_baseline(tmp_path / "bot.db")
+    db = opened(tmp_path / "bot.db")
+
+    rows, more = db.search_tickets("принтер")
+    assert [r[0] for r in rows] == [3, 1] and not more
+    rows, _ = db.search_tickets("печатает")  # по тексту отзыва
+    assert [r[0] for r in rows] == [3]
+
+    with db.read() as conn:
+        events = conn.execute("SELECT ticket_id, event, actor FROM ticket_events ORDER BY id").fetchall()
+    assert events == [(1, "created", None), (2, "created", None), (3, "created", None), (3, "rated", "@alice")]
+    report = {r["admin"]: r for r in db.sla_report("2026-10-01", "2026-10-31")}
+    assert report[""]["created"] == 3
+    assert (report["@alice"]["ratings"], report["@alice"]["avg_stars"]) == (1, 5)
+
+
+def test_baseline_upgrade_supports_new_writes(tmp_path, opened):
+    create_baseline(tmp_path / "bot.db")
+    db = opened(tmp_path / "bot.db")
+    assert db.assign_ticket(1, "@bob", 7)["status"] == STATUS_IN_PROGRESS
+    ticket_id = db.save_ticket(1, "Сломалась мышь", None)
+    assert ticket_id == 4
+    rows, _ = db.search_tickets("мышь")
+    assert [r[0] for r in rows] == [4]
+
+
+def test_upgraded_schema_matches_fresh(tmp_path, opened):
+    create_baseline(tmp_path / "old.db")
+    upgraded = opened(tmp_path / "old.db")
+    fresh = opened(tmp_path / "new.db")
+    assert schema(upgraded) == schema(fresh)
+
+
+def test_reopen_is_noop(tmp_path, opened):
+    create_baseline(tmp_path / "bot.db")
+    opened(tmp_path / "bot.db").close()
+    db = opened(tmp_path / "bot.db")
+    assert user_version(db) == len(MIGRATIONS)
+    with db.read() as conn:
+        assert conn.execute("SELECT count(*) FROM ticket_events").fetchone()[0] == 4
+
+
+# ================== Промежуточные версии ===========
+def test_auto_closes_leave_admin_close_metrics(tmp_path, opened):
+    # версия 11: закрытия без админа и автозакрытия записаны обычным 'closed'
+    conn = create_at_version(tmp_path / "bot.db", 11)
+    conn.executemany(
+        "INSERT INTO tickets (user_id, description, status, created_at) VALUES (1, ?, ?, '2026-10-01T09:00:00+00:00')",
+        [("админ закрыл", STATUS_ACTIVE), ("новый тикет закрыл старый", STATUS_ACTIVE), ("автозакрытие", STATUS_ACTIVE)],
+    )
+    conn.execute(f"UPDATE tickets SET status='{STATUS_CLOSED}', assigned_to='@alice' WHERE id=1")
+    conn.execute(f"UPDATE tickets SET status='{STATUS_CLOSED}' WHERE id=2")
+    conn.execute(f"UPDATE tickets SET status='{STATUS_CLOSED}', assigned_to=? WHERE id=3", (AUTO_CLOSE_ACTOR,))
+    conn.commit()
+    conn.close()
+
+    db = opened(tmp_path / "bot.db")
+    with db.read() as conn:
+        assert conn.execute("SELECT id, auto_closed FROM tickets ORDER BY id").fetchall() == [(1, 0), (2, 1), (3, 1)]
+    report = {r["admin"]: r for r in db.sla_report("2000-01-01")}
+    assert (report["@alice"]["closed"], report["@alice"]["auto_closed"]) == (1, 0)
+    assert sum(r["closed"] for r in report.values()) == 1
+    assert sum(r["auto_closed"] for r in report.values()) == 2
+
+    # новые автозакрытия — тоже отдельно
+    db.save_ticket(1, "ещё один", None)
+    db.close_previous_active_tickets(1)
+    report = {r["admin"]: r for r in db.sla_report("2000-01-01")}
+    assert sum(r["closed"] for r in report.values()) == 1
+    assert sum(r["auto_closed"] for r in report.values()) == 3
+
+
+def test_export_state_gets_event_cursor(tmp_path, opened):
+    conn = create_at_version(tmp_path / "bot.db", 12)
+    conn.execute("INSERT INTO tickets (user_id, description, status, created_at) VALUES (1, 'a', ?, '2026-10-01T09:00:00+00:00')", (STATUS_ACTIVE,))
+    conn.execute("INSERT INTO export_state (name, last_id, exported_at) VALUES ('tickets', 1, '2999-01-01T00:00:00+00:00')")
+    conn.execute("INSERT INTO export_state (name, last_id, exported_at) VALUES ('never', 0, '2000-01-01T00:00:00+00:00')")
+    conn.commit()
+    conn.close()
+
+    db = opened(tmp_path / "bot.db")
+    assert db.get_export_state("tickets") == db.get_last_event_id() > 0
+    assert db.get_export_state("never") == 0
@@ -0,0 +1,70 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+from db import EXPORT_COLUMNS, STATUS_ACTIVE, STATUS_CLOSED, STATUS_IN_PROGRESS, Database
+from export import export_tickets, write_export
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"), read_pool_size=1)
+    db.open()
+    db.save_user(1, "ivan", "Иван Тестов", "3 этаж")
+    for description in ("принтер", "почта", "мышь"):
+        db.save_ticket(1, description, None)
+    yield db
+    db.close()
+
+
+def read_jsonl(path) -> list[dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def export_ids(db, tmp_path, **kwargs) -> list[int]:
+    result = export_tickets(db, str(tmp_path / "out.jsonl.gz"), "jsonl", **kwargs)
+    return [row["ticket_id"] for row in read_jsonl(result.path)]
+
+
+def test_write_export_csv():
+    rows = [(7,) + ("x",) * (len(EXPORT_COLUMNS) - 1), (9,) + ("y",) * (len(EXPORT_COLUMNS) - 1)]
+    buf = io.BytesIO()
+    assert write_export(iter(rows), buf, "csv") == (2, 7, 9)
+    lines = list(csv.reader(io.StringIO(gzip.decompress(buf.getvalue()).decode())))
+    assert lines[0] == list(EXPORT_COLUMNS)
+    assert [line[0] for line in lines[1:]] == ["7", "9"]
+
+
+def test_full_and_since_id(db, tmp_path):
+    assert export_ids(db, tmp_path) == [1, 2, 3]
+    assert export_ids(db, tmp_path, since_id=1) == [2, 3]
+    assert not (tmp_path / "out.jsonl.gz.part").exists()
+
+
+def test_incremental_follows_event_log(db, tmp_path):
+    assert export_ids(db, tmp_path, incremental="itsm") == [1, 2, 3]
+    assert export_ids(db, tmp_path, incremental="itsm") == []
+
+    # старый тикет сменил статус, появился новый — оба в следующей выгрузке, по одной строке
+    db.assign_ticket(2, "@alice", 10)
+    db.close_ticket(2, "@alice")
+    db.save_ticket(1, "монитор", None)
+    rows = read_jsonl(export_tickets(db, str(tmp_path / "out.jsonl.gz"), "jsonl", incremental="itsm").path)
+    assert [(r["ticket_id"], r["status"]) for r in rows] == [(2, STATUS_CLOSED), (4, STATUS_ACTIVE)]
+    assert rows[0]["assigned_at"] and rows[0]["closed_at"]
+
+    db.save_feedback(2, 1, 5, "спасибо")
+    assert export_ids(db, tmp_path, incremental="itsm") == [2]
+    assert export_ids(db, tmp_path, incremental="itsm") == []
+
+
+def test_incremental_streams_are_independent(db, tmp_path):
+    assert export_ids(db, tmp_path, incremental="a") == [1, 2, 3]
+    db.assign_ticket(1, "@alice", 10)
+    assert export_ids(db, tmp_path, incremental="b") == [1, 2, 3]
+    assert export_ids(db, tmp_path, incremental="a") == [1]
+    assert db.get_ticket(1)["status"] == STATUS_IN_PROGRESS
@@ -0,0 +1,124 @@
+import pytest
+
+from callback_data import PAGE_NEWER, PAGE_OLDER, CallbackPayload, codec
+from db import Database, fts_query
+from render import page_keyboard
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"), read_pool_size=1)
+    db.open()
+    db.save_user(1, "ivan", "Иван Тестов", "3 этаж")
+    db.save_user(2, "petr", "Пётр Тестов", "4 этаж")
+    yield db
+    db.close()
+
+
+def found(db: Database, query: str, **kwargs) -> list[int]:
+    rows, _ = db.search_tickets(query, **kwargs)
+    return [r[0] for r in rows]
+
+
+# ================== Поиск (FTS5) ===================
+def test_fts_query_quotes_words_as_prefixes():
+    assert fts_query("Принтер  жуёт") == '"принтер"* "жуёт"*'
+    assert fts_query('принтер" OR NEAR(') == '"принтер"* "or"* "near"*'  # операторы FTS5 — просто слова
+    assert fts_query(" ?! ") is None
+
+
+def test_search_by_description_prefix_and_all_words(db):
+    printer = db.save_ticket(1, "Не работает принтер", None)
+    mail = db.save_ticket(1, "Нет доступа к почте", None)
+    jam = db.save_ticket(2, "Принтер жуёт бумагу", None)
+
+    assert found(db, "принтер") == [jam, printer]
+    assert found(db, "принтера") == []  # префикс — слово запроса, а не слово текста
+    assert found(db, "принт") == [jam, printer]
+    assert found(db, "принтер бумагу") == [jam]
+    assert found(db, "почт") == [mail]
+    assert found(db, "?!") == []
+
+    rows, _ = db.search_tickets("почте")
+    assert rows[0][3] == "Иван Тестов"
+    assert "«почте»" in rows[0][4]
+
+
+def test_search_index_follows_ticket_changes(db):
+    ticket = db.save_ticket(1, "Не работает принтер", None)
+    with db.write() as cur:
+        cur.execute("UPDATE tickets SET description=? WHERE id=?", ("Не работает сканер", ticket))
+    assert found(db, "принтер") == []
+    assert found(db, "сканер") == [ticket]
+
+    with db.write() as cur:
+        cur.execute("DELETE FROM tickets WHERE id=?", (ticket,))
+    assert found(db, "сканер") == []
+
+
+def test_search_covers_feedback_comments(db):
+    ticket = db.save_ticket(1, "Не работает принтер", None)
+    feedback = db.save_feedback(ticket, 1, 5, "спасибо, всё печатает")
+    db.save_feedback(ticket, 1, 4, "быстро починили")
+    assert found(db, "печатает") == [ticket]
+    assert found(db, "починили") == [ticket]
+
+    with db.write() as cur:
+        cur.execute("UPDATE feedback SET comment=? WHERE id=?", ("снова сломался", feedback))
+    assert found(db, "печатает") == []
+    assert found(db, "сломался") == [ticket]
+
+    with db.write() as cur:
+        cur.execute("DELETE FROM feedback WHERE id=?", (feedback,))
+    assert found(db, "сломался") == []
+    assert found(db, "починили") == [ticket]
+
+
+def test_search_pages_by_ticket_id(db):
+    ids = [db.save_ticket(1 + i % 2, f"Принтер номер {i}", None) for i in range(7)]
+    db.save_ticket(1, "Нет доступа к почте", None)
+
+    rows, more = db.search_tickets("принтер", limit=3)
+    assert [r[0] for r in rows] == ids[:-4:-1] and more
+    rows, more = db.search_tickets("принтер", limit=3, before_id=rows[-1][0])
+    assert [r[0] for r in rows] == ids[-4:-7:-1] and more
+    rows, more = db.search_tickets("принтер", limit=3, before_id=rows[-1][0])
+    assert [r[0] for r in rows] == [ids[0]] and not more
+
+
+# ================== История тикетов ================
+def test_history_pages_older_and_back_newer(db):
+    mine = [db.save_ticket(1, f"Тикет {i}", None) for i in range(5)]
+    db.save_ticket(2, "Чужой тикет", None)
+    ids = lambda rows: [r[0] for r in rows]  # noqa: E731
+
+    rows, has_older, has_newer = db.get_user_tickets(1, limit=2)
+    assert ids(rows) == [mine[4], mine[3]] and has_older and not has_newer
+
+    rows, has_older, has_newer = db.get_user_tickets(1, limit=2, before_id=rows[-1][0])
+    assert ids(rows) == [mine[2], mine[1]] and has_older and has_newer
+
+    last, has_older, has_newer = db.get_user_tickets(1, limit=2, before_id=rows[-1][0])
+    assert ids(last) == [mine[0]] and not has_older and has_newer
+
+    # назад от последней страницы: снова новые сверху
+    rows, has_older, has_newer = db.get_user_tickets(1, limit=2, after_id=last[0][0])
+    assert ids(rows) == [mine[2], mine[1]] and has_older and has_newer
+    rows, has_older, has_newer = db.get_user_tickets(1, limit=2, after_id=rows[0][0])
+    assert ids(rows) == [mine[4], mine[3]] and has_older and not has_newer
+
+    assert db.get_user_tickets(3) == ([], False, False)
+
+
+def test_page_keyboard_cursors():
+    rows = [(9, "Тикет 9", "Активный", ""), (7, "Тикет 7", "Закрыт", "")]
+
+    keyboard = page_keyboard("history", rows, has_older=True, has_newer=True)
+    newer, older = keyboard.inline_keyboard[0]
+    assert newer.text == "⬅️ Новее" and codec.decode(newer.callback_data) == CallbackPayload("history", 9, PAGE_NEWER)
+    assert older.text == "Старее ➡️" and codec.decode(older.callback_data) == CallbackPayload("history", 7, PAGE_OLDER)
+
+    assert [b.text for b in page_keyboard("history", rows, has_older=True).inline_keyboard[0]] == ["Старее ➡️"]
+    assert [b.text for b in page_keyboard("history", rows, has_older=False, has_newer=True).inline_keyboard[0]] == ["⬅️ Новее"]
+    assert page_keyboard("history", rows, has_older=False) is None
+    assert page_keyboard("history", [], has_older=True, has_newer=True) is None
@@ -0,0 +1,234 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from ingest import WebhookIngest
+from ordering import user_key
+
+
+def message(update_id: int, user_id: int, text: str = "привет") -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Иван"},
+            "text": text,
+        },
+    }
+
+
+class Recorder:
+    """
+    process(update) для WebhookIngest: запоминает порядок и число одновременных обработок.
+    gate — пока не установлен, обработка стоит (очередь заполняется).
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.done: list[tuple[int, int]] = []  # (пользователь, update_id)
+        self.running = 0
+        self.max_running = 0
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def __call__(self, update):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await self.gate.wait()
+            await asyncio.sleep(self.delay)
+            self.done.append((update.effective_user.id, update.update_id))
+        finally:
+            self.running -= 1
+
+
+async def started(recorder, **kwargs) -> WebhookIngest:
+    kwargs.setdefault("key", user_key)
+    ingest = WebhookIngest(SimpleNamespace(bot=None), process=recorder, **kwargs)
+    await ingest.start("127.0.0.1", 0)
+    return ingest
+
+
+async def drained(ingest: WebhookIngest):
+    while ingest.backlog:
+        await asyncio.sleep(0.01)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+# ================== Разбор запроса =================
+def test_receive_checks_secret_and_body():
+    async def scenario():
+        recorder = Recorder()
+        ingest = await started(recorder, secret_token="s3cret")
+        try:
+            body = json.dumps(message(1, 10)).encode()
+            assert await ingest.receive(None, body) == 403
+            assert await ingest.receive("wrong", body) == 403
+            assert await ingest.receive("s3cret", b"{not json") == 400
+            assert await ingest.receive("s3cret", b'{"message": {}}') == 400
+            assert await ingest.receive("s3cret", body) == 200
+            await drained(ingest)
+        finally:
+            await ingest.stop()
+        return recorder, ingest.stats
+
+    recorder, stats = run(scenario())
+    assert recorder.done == [(10, 1)]
+    assert (stats["forbidden"], stats["invalid"], stats["accepted"]) == (2, 2, 1)
+
+
+# ================== Повторы ========================
+def test_duplicate_update_id_is_processed_once():
+    async def scenario():
+        recorder = Recorder()
+        ingest = await started(recorder)
+        try:
+            assert await ingest.submit(1, message(1, 10))
+            assert await ingest.submit(1, message(1, 10))
+            await drained(ingest)
+            assert await ingest.submit(1, message(1, 10))  # и после обработки
+            await drained(ingest)
+        finally:
+            await ingest.stop()
+        return recorder, ingest.stats
+
+    recorder, stats = run(scenario())
+    assert recorder.done == [(10, 1)]
+    assert (stats["accepted"], stats["duplicate"]) == (1, 2)
+
+
+def test_rejected_update_is_not_remembered():
+    async def scenario():
+        recorder = Recorder()
+        recorder.gate.clear()
+        ingest = await started(recorder, workers=1, max_backlog=1, put_timeout=0.05)
+        try:
+            assert await ingest.submit(1, message(1, 10))
+            assert not await ingest.submit(2, message(2, 11))  # очередь полна -> 503
+            recorder.gate.set()
+            await drained(ingest)
+            assert await ingest.submit(2, message(2, 11))  # повтор Telegram принимается
+            await drained(ingest)
+        finally:
+            await ingest.stop()
+        return recorder, ingest.stats
+
+    recorder, stats = run(scenario())
+    assert recorder.done == [(10, 1), (11, 2)]
+    assert (stats["accepted"], stats["rejected"], stats["duplicate"]) == (2, 1, 0)
+
+
+def test_retry_while_original_waits_shares_its_rejection():
+    async def scenario():
+        recorder = Recorder()
+        recorder.gate.clear()
+        ingest = await started(recorder, workers=1, max_backlog=1, put_timeout=0.05)
+        try:
+            assert await ingest.submit(1, message(1, 10))
+            # оригинал ждёт места, повтор приходит, пока он ждёт: оба получают 503
+            assert await asyncio.gather(ingest.submit(2, message(2, 11)), ingest.submit(2, message(2, 11))) == [False, False]
+            recorder.gate.set()
+            await drained(ingest)
+        finally:
+            await ingest.stop()
+        return recorder
+
+    assert run(scenario()).done == [(10, 1)]
+
+
+def test_retry_while_original_waits_shares_its_acceptance():
+    async def scenario():
+        recorder = Recorder()
+        recorder.gate.clear()
+        ingest = await started(recorder, workers=1, max_backlog=1, put_timeout=1.0)
+        try:
+            assert await ingest.submit(1, message(1, 10))
+            original = asyncio.create_task(ingest.submit(2, message(2, 11)))
+            retry = asyncio.create_task(ingest.submit(2, message(2, 11)))
+            await asyncio.sleep(0.05)
+            assert not original.done() and not retry.done()  # повтор не подтверждён раньше оригинала
+            recorder.gate.set()
+            assert await asyncio.gather(original, retry) == [True, True]
+            await drained(ingest)
+        finally:
+            await ingest.stop()
+        return recorder, ingest.stats
+
+    recorder, stats = run(scenario())
+    assert recorder.done == [(10, 1), (11, 2)]
+    assert (stats["accepted"], stats["duplicate"]) == (2, 1)
+
+
+def test_claim_rejects_updates_of_other_replicas():
+    claimed = {1}
+
+    async def claim(update_id):
+        if update_id == 3:
+            raise ConnectionError("БД недоступна")
+        if update_id in claimed:
+            return False
+        claimed.add(update_id)
+        return True
+
+    async def scenario():
+        recorder = Recorder()
+        ingest = await started(recorder, claim=claim)
+        try:
+            assert await ingest.submit(1, message(1, 10))  # принят другой репликой: 200 без обработки
+            assert await ingest.submit(2, message(2, 10))
+            assert not await ingest.submit(3, message(3, 10))  # не смогли отметить: 503, Telegram повторит
+            await drained(ingest)
+        finally:
+            await ingest.stop()
+        return recorder, ingest.stats
+
+    recorder, stats = run(scenario())
+    assert recorder.done == [(10, 2)]
+    assert (stats["accepted"], stats["duplicate"], stats["rejected"]) == (1, 1, 1)
+
+
+# ================== Порядок ========================
+def test_same_user_in_order_different_users_in_parallel():
+    async def scenario():
+        recorder = Recorder(delay=0.01)
+        ingest = await started(recorder, workers=8)
+        try:
+            update_id = 0
+            for _ in range(5):
+                for user_id in (10, 11, 12, 13):
+                    update_id += 1
+                    assert await ingest.submit(update_id, message(update_id, user_id))
+            await drained(ingest)
+        finally:
+            await ingest.stop()
+        return recorder
+
+    recorder = run(scenario())
+    assert len(recorder.done) == 20
+    for user_id in (10, 11, 12, 13):
+        ids = [u for uid, u in recorder.done if uid == user_id]
+        assert ids == sorted(ids)
+    assert recorder.max_running > 1
+
+
+def test_one_user_never_runs_concurrently():
+    async def scenario():
+        recorder = Recorder(delay=0.005)
+        ingest = await started(recorder, workers=8)
+        try:
+            for update_id in range(1, 21):
+                assert await ingest.submit(update_id, message(update_id, 10))
+            await drained(ingest)
+        finally:
+            await ingest.stop()
+        return recorder
+
+    recorder = run(scenario())
+    assert [u for _, u in recorder.done] == list(range(1, 21))
+    assert recorder.max_running == 1
+
@@ -0,0 +1,46 @@
+import asyncio
+
+from telegram import Update
+
+from callback_data import codec
+from ordering import KeyedLocks, ordering_key
+
+
+def button(user_id: int, data: str, update_id: int = 1) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id), "chat_instance": "c", "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": "Админ"},
+        },
+    }, None)
+
+
+def test_ordering_key_groups_ticket_buttons_by_ticket():
+    assert ordering_key(button(1, codec.encode("assign", 7))) == ("ticket", 7)
+    assert ordering_key(button(2, codec.encode("close", 7))) == ("ticket", 7)
+    assert ordering_key(button(1, codec.encode("rate", 7, 5))) == ("user", 1)  # меняет user_data оценивающего
+    assert ordering_key(button(1, "assign_7")) == ("user", 1)  # старый формат — по пользователю
+    assert ordering_key(button(1, codec.encode("assign", 7)[:-1])) == ("user", 1)
+
+
+def test_keyed_locks_serialize_one_key_in_arrival_order():
+    async def scenario():
+        locks = KeyedLocks()
+        log = []
+
+        async def hold(key, name):
+            async with locks.lock(key):
+                log.append(f"{name}+")
+                await asyncio.sleep(0.01)
+                log.append(f"{name}-")
+
+        await asyncio.gather(hold("a", "a1"), hold("a", "a2"), hold("b", "b1"), hold("a", "a3"))
+        return log, locks._locks
+
+    log, left = asyncio.run(scenario())
+    a = [e for e in log if e.startswith("a")]
+    assert a == ["a1+", "a1-", "a2+", "a2-", "a3+", "a3-"]
+    assert log.index("b1+") < log.index("a1-")  # другой ключ не ждёт
+    assert left == {}  # блокировки освобождённых ключей не копятся
+
@@ -0,0 +1,195 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import BadRequest, RetryAfter
+
+from outbound import PRIORITY_CHANNEL, EditCoalescer, OutboundScheduler, TokenBucket
+
+
+class Sender:
+    """
+    Отправка для EditCoalescer: send(key, text) возвращает функцию без аргументов, как в bot.py.
+    """
+
+    def __init__(self, error: Exception | None = None):
+        self.sent: list[tuple] = []
+        self.error = error
+
+    def __call__(self, key, text):
+        async def send():
+            if self.error is not None:
+                raise self.error
+            self.sent.append((key, text))
+        return send
+
+
+# ================== Склейка правок =================
+def test_coalescer_sends_only_latest_state():
+    async def scenario():
+        edits, sender = EditCoalescer(delay=0.05), Sender()
+        for text in ("взят", "снят", "закрыт"):
+            edits.schedule(1, text, sender(1, text))
+        edits.schedule(2, "взят", sender(2, "взят"))
+        await asyncio.sleep(0.15)
+        return edits, sender
+
+    edits, sender = asyncio.run(scenario())
+    assert sorted(sender.sent) == [(1, "закрыт"), (2, "взят")]
+    assert edits.stats == {"scheduled": 4, "sent": 2, "skipped": 0}
+    assert edits.pending == 0
+
+
+def test_coalescer_skips_unchanged_state():
+    async def scenario(dedup):
+        edits, sender = EditCoalescer(delay=0.01, dedup=dedup), Sender()
+        edits.remember(1, "опубликовано")
+        edits.schedule(1, "опубликовано", sender(1, "опубликовано"))
+        await asyncio.sleep(0.05)
+        edits.schedule(1, "взят", sender(1, "взят"))
+        await asyncio.sleep(0.05)
+        edits.schedule(1, "взят", sender(1, "взят"))
+        await asyncio.sleep(0.05)
+        return edits, sender
+
+    edits, sender = asyncio.run(scenario(True))
+    assert sender.sent == [(1, "взят")]
+    assert edits.stats["skipped"] == 2
+
+    # несколько реплик: карточку могли поменять другие — отправляем всегда
+    edits, sender = asyncio.run(scenario(False))
+    assert sender.sent == [(1, "опубликовано"), (1, "взят"), (1, "взят")]
+    assert edits.stats["skipped"] == 0
+
+
+def test_coalescer_flush_sends_immediately():
+    async def scenario():
+        edits, sender = EditCoalescer(delay=30), Sender()
+        for key in range(3):
+            edits.schedule(key, "закрыт", sender(key, "закрыт"))
+        started = time.monotonic()
+        await edits.flush()
+        return time.monotonic() - started, edits, sender
+
+    elapsed, edits, sender = asyncio.run(scenario())
+    assert elapsed < 1
+    assert sorted(sender.sent) == [(0, "закрыт"), (1, "закрыт"), (2, "закрыт")]
+    assert edits.pending == 0
+
+
+def test_coalescer_flush_delivers_edit_scheduled_during_send():
+    async def scenario():
+        edits, sent = EditCoalescer(delay=30), []
+
+        def send(text):
+            async def call():
+                await asyncio.sleep(0.01)
+                sent.append(text)
+                if text == "взят":
+                    edits.schedule(1, "закрыт", send("закрыт"))  # пришла новая правка, пока отправляли
+            return call
+
+        edits.schedule(1, "взят", send("взят"))
+        await edits.flush()
+        return sent
+
+    assert asyncio.run(scenario()) == ["взят", "закрыт"]
+
+
+def test_coalescer_not_modified_counts_as_sent_and_errors_do_not_stick():
+    async def scenario():
+        edits = EditCoalescer(delay=0.01)
+        edits.schedule(1, "a", Sender(BadRequest("Message is not modified"))(1, "a"))
+        edits.schedule(2, "a", Sender(BadRequest("Message to edit not found"))(2, "a"))
+        await asyncio.sleep(0.05)
+        ok = Sender()
+        edits.schedule(1, "a", ok(1, "a"))  # уже "отправлено"
+        edits.schedule(2, "a", ok(2, "a"))  # ошибка не запомнилась — пробуем снова
+        await asyncio.sleep(0.05)
+        return edits, ok
+
+    edits, ok = asyncio.run(scenario())
+    assert ok.sent == [(2, "a")]
+    assert edits.pending == 0
+
+
+# ================== Очередь исходящих ==============
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, capacity=2)
+    now = bucket.updated
+    bucket.consume(now)
+    bucket.consume(now)
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == 0
+
+
+def test_scheduler_orders_by_priority_and_keeps_chat_order():
+    async def scenario():
+        scheduler = OutboundScheduler(private_rate=1000, private_burst=1000, group_rate=1000, group_burst=1000)
+        order = []
+
+        async def call(name):
+            order.append(name)
+            await asyncio.sleep(0.01)
+            return name
+
+        scheduler.start()
+        # пока планировщик не получил управление, очередь собирается целиком
+        futures = [
+            scheduler.submit(-100, call, "card", priority=PRIORITY_CHANNEL, key=("card", 1)),
+            scheduler.submit(10, call, "a1"),
+            scheduler.submit(11, call, "b1"),
+            scheduler.submit(10, call, "a2"),
+        ]
+        results = await asyncio.gather(*futures)
+        await scheduler.stop()
+        return order, results
+
+    order, results = asyncio.run(scenario())
+    # ответы людям — раньше карточки; a2 ждёт a1 (один чат), и карточка его не ждёт
+    assert order == ["a1", "b1", "card", "a2"]
+    assert results == ["card", "a1", "b1", "a2"]
+
+
+def test_scheduler_retries_after_429():
+    async def scenario():
+        scheduler = OutboundScheduler()
+        attempts = []
+
+        async def flaky():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(0.1)
+            return "ok"
+
+        result = await scheduler.send(10, flaky)
+        await scheduler.stop()
+        return result, attempts, scheduler.stats
+
+    result, attempts, stats = asyncio.run(scenario())
+    assert result == "ok"
+    assert attempts[1] - attempts[0] >= 0.09
+    assert (stats["sent"], stats["retry_after"]) == (1, 1)
+
+
+def test_scheduler_stop_drains_queue_within_deadline():
+    async def scenario():
+        scheduler = OutboundScheduler(private_rate=1000, private_burst=1000)
+        sent = []
+
+        async def call(i):
+            await asyncio.sleep(0.01)
+            sent.append(i)
+
+        futures = [scheduler.submit(10 + i, call, i) for i in range(5)]
+        await scheduler.stop(timeout=5)
+        drained = list(sent)
+
+        slow = [scheduler.submit(10, asyncio.sleep, 10) for _ in range(2)]
+        await scheduler.stop(timeout=0.05)
+        return drained, futures, slow
+
+    drained, futures, slow = asyncio.run(scenario())
+    assert sorted(drained) == [0, 1, 2, 3, 4]
+    assert all(f.done() and not f.cancelled() for f in futures)
+    assert all(f.cancelled() for f in slow)  # после дедлайна не отправленное отменяется, а не висит
@@ -0,0 +1,124 @@
+import asyncio
+import json
+
+import pytest
+
+from db import AsyncDatabase, Database
+from persistence import SQLitePersistence
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = AsyncDatabase(Database(str(tmp_path / "bot.db")))
+    db.open()
+    yield db
+    db.close()
+
+
+def age_state(db: AsyncDatabase, user_id: int, updated_at: str):
+    with db.sync.write() as cur:
+        cur.execute("UPDATE user_state SET updated_at=? WHERE user_id=?", (updated_at, user_id))
+
+
+async def restore(db: AsyncDatabase, *user_ids: int, **kwargs) -> dict[int, dict]:
+    """Новый процесс: user_data пользователей после первого апдейта каждого из них."""
+    persistence = SQLitePersistence(db, **kwargs)
+    assert await persistence.get_user_data() == {}  # при старте ничего не грузим
+    result = {}
+    for user_id in user_ids:
+        user_data = {}
+        await persistence.refresh_user_data(user_id, user_data)
+        if user_data:
+            result[user_id] = user_data
+    return result
+
+
+def test_changes_are_written_in_one_batch_and_restored(db):
+    async def scenario():
+        persistence = SQLitePersistence(db, write_delay=0.01)
+        await persistence.update_user_data(1, {"step": "waiting_description"})
+        await persistence.update_user_data(2, {"step": "waiting_name"})
+        await persistence.update_user_data(3, {})  # пустое состояние не хранится
+        await persistence.flush()
+        first = await restore(db, 1, 2, 3)
+
+        await persistence.update_user_data(1, {})
+        await persistence.drop_user_data(2)
+        await persistence.flush()
+        return first, await restore(db, 1, 2, 3)
+
+    first, second = asyncio.run(scenario())
+    assert first == {1: {"step": "waiting_description"}, 2: {"step": "waiting_name"}}
+    assert second == {}
+
+
+def test_abandoned_dialogs_are_purged_on_start(db):
+    async def scenario():
+        await db.save_user_states({1: json.dumps({"step": "old"}), 2: json.dumps({"step": "fresh"})})
+        age_state(db, 1, "2000-01-01T00:00:00+00:00")
+        persistence = SQLitePersistence(db, max_age=3600)
+        await persistence.get_user_data()  # старт: чистка брошенных
+        stored = await db.load_user_states()
+        return await restore(db, 1, 2, max_age=3600), stored
+
+    restored, stored = asyncio.run(scenario())
+    assert restored == {2: {"step": "fresh"}}
+    assert list(stored) == [2]  # брошенный диалог удалён из БД, а не просто пропущен
+
+
+def test_purge_stale_without_max_age_keeps_everything(db):
+    async def scenario():
+        await db.save_user_states({1: json.dumps({"step": "old"})})
+        age_state(db, 1, "2000-01-01T00:00:00+00:00")
+        purged = await SQLitePersistence(db, max_age=None).purge_stale()
+        return purged, await db.load_user_states()
+
+    purged, stored = asyncio.run(scenario())
+    assert purged == 0 and list(stored) == [1]
+
+
+def test_corrupted_state_is_skipped(db):
+    async def scenario():
+        await db.save_user_states({1: "{not json", 2: json.dumps({"step": "ok"})})
+        return await restore(db, 1, 2)
+
+    assert asyncio.run(scenario()) == {2: {"step": "ok"}}
+
+
+def test_state_is_read_once_and_never_over_local_changes(db):
+    async def scenario():
+        await db.save_user_states({1: json.dumps({"step": "saved"}), 2: json.dumps({"step": "saved"})})
+        persistence = SQLitePersistence(db, write_delay=0.01)
+        first = {}
+        await persistence.refresh_user_data(1, first)
+
+        # дальше в процессе живёт своё состояние: повторно из БД не читаем
+        await db.save_user_states({1: json.dumps({"step": "other replica"})})
+        first["step"] = "local"
+        await persistence.refresh_user_data(1, first)
+
+        # изменения, ещё не записанные в БД, не затираются прочитанным
+        second = {"step": "changed"}
+        await persistence.update_user_data(2, second)
+        await persistence.refresh_user_data(2, second)
+        await persistence.flush()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == {"step": "local"}
+    assert second == {"step": "changed"}
+
+
+def test_shared_mode_reads_and_writes_per_user(db):
+    async def scenario():
+        persistence = SQLitePersistence(db, shared=True)
+        assert await persistence.get_user_data() == {}  # при старте ничего не грузим
+        await persistence.update_user_data(1, {"step": "x"})  # пакетной записи нет
+        assert await db.load_user_states() == {}
+
+        user_data = {"stale": True}
+        await persistence.store_user_data(1, {"step": "y"})
+        await persistence.load_user_data(1, user_data)
+        return user_data
+
+    assert asyncio.run(scenario()) == {"step": "y"}
@@ -0,0 +1,86 @@
+import asyncio
+from types import SimpleNamespace
+
+from callback_data import CallbackCodec
+from router import CallbackRouter
+
+CHANNEL_ID = -100500
+codec = CallbackCodec("secret")
+
+
+def make_router(calls: list) -> CallbackRouter:
+    router = CallbackRouter(codec)
+
+    @router.on_exact("add_photo")
+    async def add_photo(update, context):
+        calls.append(("add_photo",))
+
+    @router.on_action("assign", int, legacy=lambda update: update.callback_query.message.chat.id == CHANNEL_ID)
+    async def assign(update, context, ticket_id):
+        calls.append(("assign", ticket_id))
+
+    @router.on_action("rate", int, int, invalid_text="Некорректная оценка",
+                      legacy=lambda update: update.callback_query.message.chat.id == update.callback_query.from_user.id)
+    async def rate(update, context, ticket_id, stars):
+        calls.append(("rate", ticket_id, stars))
+
+    @router.on_action("history", int, int)
+    async def history(update, context, cursor, direction):
+        calls.append(("history", cursor, direction))
+
+    return router
+
+
+def callback_update(data: str, *, chat_id: int, user_id: int = 42, edits: list | None = None):
+    async def edit_message_text(text):
+        edits.append(text)
+
+    query = SimpleNamespace(
+        data=data,
+        from_user=SimpleNamespace(id=user_id),
+        message=SimpleNamespace(chat=SimpleNamespace(id=chat_id)),
+        edit_message_text=edit_message_text,
+    )
+    return SimpleNamespace(callback_query=query)
+
+
+def dispatch(data: str, *, chat_id: int, user_id: int = 42) -> tuple[list, list]:
+    calls, edits = [], []
+    router = make_router(calls)
+    asyncio.run(router.dispatch(callback_update(data, chat_id=chat_id, user_id=user_id, edits=edits), None))
+    return calls, edits
+
+
+def test_encoded_routes_anywhere():
+    assert dispatch(codec.encode("assign", 5), chat_id=42) == ([("assign", 5)], [])
+    assert dispatch(codec.encode("rate", 5, 4), chat_id=CHANNEL_ID) == ([("rate", 5, 4)], [])
+    assert dispatch(codec.encode("history", 30, 1), chat_id=42) == ([("history", 30, 1)], [])
+
+
+def test_exact_is_not_legacy():
+    assert dispatch("add_photo", chat_id=42) == ([("add_photo",)], [])
+
+
+def test_legacy_only_where_published():
+    assert dispatch("assign_5", chat_id=CHANNEL_ID) == ([("assign", 5)], [])
+    assert dispatch("assign_5", chat_id=42) == ([], [])  # из лички — подделка
+    assert dispatch("rate_5_4", chat_id=42, user_id=42) == ([("rate", 5, 4)], [])
+    assert dispatch("rate_5_4", chat_id=43, user_id=42) == ([], [])
+
+
+def test_legacy_without_check_is_rejected():
+    # history никогда не выпускался без подписи
+    assert dispatch("history_30_1", chat_id=42) == ([], [])
+
+
+def test_invalid_legacy_args():
+    assert dispatch("rate_5_x", chat_id=42) == ([], ["Некорректная оценка"])
+    assert dispatch("rate_5", chat_id=42) == ([], ["Некорректная оценка"])
+
+
+def test_forged_and_unknown_are_ignored():
+    other = CallbackCodec("other")
+    assert dispatch(other.encode("assign", 5), chat_id=CHANNEL_ID) == ([], [])
+    assert dispatch(codec.encode("assign", 5)[:-1], chat_id=CHANNEL_ID) == ([], [])
+    assert dispatch("unknown_1", chat_id=CHANNEL_ID) == ([], [])
+
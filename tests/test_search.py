@@ -0,0 +1,38 @@
+import json
+
+import bot
+from callback_data import SEARCH_QUERY_IDS, CallbackPayload, codec
+from render import search_page_keyboard
+
+
+def test_page_button_carries_cursor_and_query_id():
+    rows = [(30, "Активный", "2026-10-01T09:00:00+00:00", "Иван", "…«принтер»…"), (12, "Закрыт", "", "Иван", "")]
+    keyboard = search_page_keyboard(rows, has_older=True, query_id=7)
+    data = keyboard.inline_keyboard[0][0].callback_data
+    assert codec.decode(data) == CallbackPayload("search", 12, 7)
+    assert search_page_keyboard(rows, has_older=False, query_id=7) is None
+    assert search_page_keyboard([], has_older=True, query_id=7) is None
+
+
+def test_each_search_gets_own_id():
+    user_data = {"search_query": "прежний формат"}
+    first = bot.remember_search_query(user_data, "принтер")
+    second = bot.remember_search_query(user_data, "почта")
+    assert first != second
+    # кнопка первого поиска листает свой запрос, а не последний
+    assert user_data["search_queries"][str(first)] == "принтер"
+    assert user_data["search_queries"][str(second)] == "почта"
+    assert "search_query" not in user_data
+    # user_data хранится в JSON: после перезапуска номера те же
+    assert json.loads(json.dumps(user_data)) == user_data
+
+
+def test_ids_wrap_and_only_recent_queries_are_kept():
+    user_data = {}
+    ids = [bot.remember_search_query(user_data, f"запрос {i}") for i in range(SEARCH_QUERY_IDS + 5)]
+    assert all(1 <= i <= SEARCH_QUERY_IDS for i in ids)
+    assert ids[SEARCH_QUERY_IDS] == 1  # по кругу
+    queries = user_data["search_queries"]
+    assert len(queries) == bot.SEARCH_QUERIES_KEPT
+    assert queries[str(ids[-1])] == f"запрос {SEARCH_QUERY_IDS + 4}"
+    assert str(ids[-bot.SEARCH_QUERIES_KEPT - 1]) not in queries
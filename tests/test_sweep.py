@@ -0,0 +1,133 @@
+import time
+
+import pytest
+
+import bot
+from db import STATUS_ACTIVE, STATUS_CLOSED, STATUS_IN_PROGRESS, Database
+
+HOUR = 3600
+NOW = 1_800_000_000.0
+
+
+def ticket(ticket_id: int, status: str, hours: float, **fields) -> dict:
+    return {
+        "id": ticket_id, "user_id": 100 + ticket_id, "status": status, "status_at": NOW - hours * HOUR,
+        "reminded_at": None, "assigned_to": None, "assigned_user_id": None, "channel_msg_id": 500 + ticket_id,
+        "auto_closed": 0, "has_feedback": 0,
+    } | fields
+
+
+def classify(*tickets):
+    channel, admins, feedback, close, silent = bot.classify_stale(list(tickets), NOW)
+    ids = lambda ts: [t["id"] for t in ts]  # noqa: E731
+    return ids(channel), {a: ids(ts) for a, ts in admins.items()}, ids(feedback), ids(close), ids(silent)
+
+
+# ================== Разбор кандидатов ==============
+def test_open_tickets():
+    channel, admins, _, close, _ = classify(
+        ticket(1, STATUS_ACTIVE, 3),
+        ticket(2, STATUS_ACTIVE, 1),  # рано
+        ticket(3, STATUS_ACTIVE, 5, reminded_at=NOW - HOUR),  # уже напомнили
+        ticket(4, STATUS_IN_PROGRESS, 30, assigned_to="@alice", assigned_user_id=10),
+        ticket(5, STATUS_IN_PROGRESS, 30, assigned_to="@bob"),  # id админа неизвестен
+        ticket(6, STATUS_IN_PROGRESS, 10, assigned_to="@alice", assigned_user_id=10),
+        ticket(7, STATUS_ACTIVE, 200, reminded_at=NOW - 100 * HOUR),
+        ticket(8, STATUS_IN_PROGRESS, 170, assigned_to="@alice", assigned_user_id=10),
+    )
+    assert channel == [1, 5]
+    assert admins == {10: [4]}
+    assert close == [7, 8]
+
+
+def test_feedback_window():
+    _, _, feedback, _, silent = classify(
+        ticket(1, STATUS_CLOSED, 30, assigned_to="@alice"),
+        ticket(2, STATUS_CLOSED, 10, assigned_to="@alice"),  # ещё рано — ни туда, ни туда
+        ticket(3, STATUS_CLOSED, bot.FEEDBACK_REMIND_WINDOW_HOURS + 1, assigned_to="@alice"),  # поздно
+        ticket(4, STATUS_CLOSED, 30, assigned_to="@alice", has_feedback=1),
+    )
+    assert feedback == [1]
+    assert silent == [3, 4]
+
+
+def test_auto_closed_tickets_get_no_feedback_request():
+    _, _, feedback, _, silent = classify(
+        ticket(1, STATUS_CLOSED, 30, assigned_to="@alice"),  # закрыл админ
+        ticket(2, STATUS_CLOSED, 30, assigned_to="@alice", auto_closed=1),  # взятый, но закрытый автоматически
+        ticket(3, STATUS_CLOSED, 30, assigned_to=bot.AUTO_CLOSE_ACTOR, auto_closed=1),
+        ticket(4, STATUS_CLOSED, 30, auto_closed=1),  # закрыт новым тикетом пользователя
+    )
+    assert feedback == [1]
+    assert silent == [2, 3, 4]
+
+
+def test_feedback_reminders_disabled(monkeypatch):
+    monkeypatch.setattr(bot, "FEEDBACK_REMIND_HOURS", 0)
+    assert classify(ticket(1, STATUS_CLOSED, 30, assigned_to="@alice"))[4] == [1]
+
+
+def test_auto_close_disabled(monkeypatch):
+    monkeypatch.setattr(bot, "AUTO_CLOSE_HOURS", 0)
+    channel, _, _, close, _ = classify(ticket(1, STATUS_ACTIVE, 1000), ticket(2, STATUS_ACTIVE, 1000, reminded_at=NOW))
+    assert (channel, close) == ([1], [])
+
+
+# ================== Запрос кандидатов ==============
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"), read_pool_size=1)
+    db.open()
+    yield db
+    db.close()
+
+
+def add(db: Database, status: str, hours: float, *, reminded: bool = False) -> int:
+    ticket_id = db.save_ticket(1, "тикет", None)
+    with db.write() as cur:
+        # смена статуса сама выставляет status_at (триггер) — время подменяем вторым UPDATE
+        cur.execute(
+            "UPDATE tickets SET status=?, assigned_to=? WHERE id=?",
+            (status, None if status == STATUS_ACTIVE else "@alice", ticket_id),
+        )
+        cur.execute(
+            "UPDATE tickets SET status_at=?, reminded_at=? WHERE id=?",
+            (time.time() - hours * HOUR, time.time() if reminded else None, ticket_id),
+        )
+    return ticket_id
+
+
+def find(db: Database, *, auto_close: float | None = None, limit: int = 5000) -> list[int]:
+    now = time.time()
+    return [t["id"] for t in db.find_stale_tickets(
+        active_before=now - 2 * HOUR,
+        in_progress_before=now - 24 * HOUR,
+        auto_close_before=now - auto_close * HOUR if auto_close else None,
+        closed_before=now - 24 * HOUR,
+        limit=limit,
+    )]
+
+
+def test_reminded_open_tickets_do_not_starve_new_ones(db):
+    old = [add(db, STATUS_ACTIVE, 100 + i, reminded=True) for i in range(10)]
+    fresh = add(db, STATUS_ACTIVE, 3)
+    # без автозакрытия напомненные открытые тикеты не возвращаются вовсе
+    assert find(db, limit=5) == [fresh]
+    # с автозакрытием — только перешедшие его границу, новые по-прежнему видны
+    assert find(db, auto_close=104.5, limit=20) == old[9:4:-1] + [fresh]  # старые первыми
+
+
+def test_each_category_has_own_bound(db):
+    active = add(db, STATUS_ACTIVE, 3)
+    add(db, STATUS_IN_PROGRESS, 10)  # взятый ждёт 24 ч
+    add(db, STATUS_IN_PROGRESS, 30, reminded=True)  # напомнили, до автозакрытия далеко
+    in_progress = add(db, STATUS_IN_PROGRESS, 30)
+    add(db, STATUS_CLOSED, 10)  # об оценке — через 24 ч
+    closed = add(db, STATUS_CLOSED, 30)
+    add(db, STATUS_CLOSED, 30, reminded=True)
+    assert sorted(find(db, auto_close=168)) == sorted([active, in_progress, closed])
+
+
+def test_no_categories(db):
+    add(db, STATUS_ACTIVE, 100)
+    assert db.find_stale_tickets() == []
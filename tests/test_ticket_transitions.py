@@ -0,0 +1,106 @@
+import asyncio
+import threading
+
+import pytest
+
+from db import STATUS_ACTIVE, STATUS_CLOSED, STATUS_IN_PROGRESS, AsyncDatabase, Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"), read_pool_size=2)
+    db.open()
+    db.save_user(1, "ivan", "Иван Тестов", "3 этаж")
+    yield db
+    db.close()
+
+
+def events(db, ticket_id: int) -> list[tuple]:
+    with db.read() as conn:
+        return conn.execute("SELECT event, actor FROM ticket_events WHERE ticket_id=? ORDER BY id", (ticket_id,)).fetchall()
+
+
+def test_assign_unassign_close(db):
+    ticket_id = db.save_ticket(1, "Не работает принтер", None)
+
+    ticket = db.assign_ticket(ticket_id, "@alice", 10)
+    assert (ticket["status"], ticket["assigned_to"]) == (STATUS_IN_PROGRESS, "@alice")
+    assert db.assign_ticket(ticket_id, "@bob", 11) is None  # уже взят
+    assert db.unassign_ticket(ticket_id, "@bob") is None  # взял не он
+    ticket = db.unassign_ticket(ticket_id, "@alice")
+    assert (ticket["status"], ticket["assigned_to"]) == (STATUS_ACTIVE, None)
+
+    ticket = db.close_ticket(ticket_id, "@bob")
+    assert (ticket["status"], ticket["assigned_to"]) == (STATUS_CLOSED, "@bob")  # закрывший без взятия — исполнитель
+    assert db.close_ticket(ticket_id, "@alice") is None
+    assert db.assign_ticket(ticket_id, "@alice", 10) is None
+    assert db.unassign_ticket(ticket_id, "@bob") is None
+
+    assert events(db, ticket_id) == [
+        ("created", None), ("assigned", "@alice"), ("unassigned", "@alice"), ("closed", "@bob"),
+    ]
+
+
+def test_close_keeps_assignee(db):
+    ticket_id = db.save_ticket(1, "Нет доступа к почте", None)
+    db.assign_ticket(ticket_id, "@alice", 10)
+    assert db.close_ticket(ticket_id, "@bob")["assigned_to"] == "@alice"
+
+
+def test_missing_ticket(db):
+    assert db.assign_ticket(404, "@alice", 10) is None
+    assert db.close_ticket(404, "@alice") is None
+
+
+def test_concurrent_assign_has_one_winner(tmp_path):
+    adb = AsyncDatabase(Database(str(tmp_path / "bot.db")))
+    adb.open()
+
+    async def race():
+        ticket_id = await adb.save_ticket(1, "гонка", None)
+        results = await asyncio.gather(*(adb.assign_ticket(ticket_id, f"@admin{i}", i) for i in range(20)))
+        return ticket_id, results
+
+    try:
+        ticket_id, results = asyncio.run(race())
+        winners = [r for r in results if r is not None]
+        assert len(winners) == 1
+        assert adb.sync.get_ticket(ticket_id)["assigned_to"] == winners[0]["assigned_to"]
+    finally:
+        adb.close()
+
+
+def test_close_race_between_processes_on_one_file(db, tmp_path):
+    # как реплики на общем файле SQLite: у каждой своё соединение на запись
+    ticket_id = db.save_ticket(1, "гонка реплик", None)
+    replicas = [Database(str(tmp_path / "bot.db"), read_pool_size=1) for _ in range(4)]
+    for replica in replicas:
+        replica.open()
+    results = [None] * len(replicas)
+    start = threading.Barrier(len(replicas))
+
+    def close(i):
+        start.wait()
+        results[i] = replicas[i].close_ticket(ticket_id, f"@admin{i}")
+
+    threads = [threading.Thread(target=close, args=(i,)) for i in range(len(replicas))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for replica in replicas:
+        replica.close()
+
+    assert len([r for r in results if r is not None]) == 1
+    assert [e for e, _ in events(db, ticket_id)].count("closed") == 1
+
+
+def test_close_previous_active_tickets(db):
+    first = db.save_ticket(1, "первый", None)
+    taken = db.save_ticket(1, "взят админом", None)
+    db.assign_ticket(taken, "@alice", 10)
+    closed = db.close_previous_active_tickets(1)
+    assert [t["id"] for t in closed] == [first]
+    assert closed[0]["status"] == STATUS_CLOSED
+    assert db.get_ticket(taken)["status"] == STATUS_IN_PROGRESS
+    assert db.close_previous_active_tickets(1) == []
@@ -0,0 +1,108 @@
+import asyncio
+
+import httpx
+import pytest
+
+from bot_webhook import TelegramClient, TelegramHTTPError
+
+
+class Script:
+    """
+    Транспорт httpx: отвечает по очереди заготовленными ответами или исключениями
+    и запоминает, какие методы были вызваны.
+    """
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.calls: list[str] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls.append(request.url.path.rsplit("/", 1)[-1])
+        step = self.steps.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        return step
+
+
+def ok(result=True):
+    return httpx.Response(200, json={"ok": True, "result": result})
+
+
+def run_call(monkeypatch, script: Script, method: str, retries: int = 2):
+    """Вызывает client.call поверх script; паузы между повторами не ждём, а запоминаем."""
+    delays: list[float] = []
+
+    async def no_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", no_sleep)
+
+    async def scenario():
+        client = TelegramClient("https://api.test/botX/", timeout=1, connect_timeout=1, retries=retries, max_connections=1)
+        await client.aclose()
+        client._client = httpx.AsyncClient(base_url="https://api.test/botX/", transport=httpx.MockTransport(script))
+        try:
+            return await client.call(method, chat_id=1, text="привет")
+        finally:
+            await client.aclose()
+
+    return asyncio.run(scenario()), delays
+
+
+# ================== Повторы =================
+def test_not_sent_errors_are_retried_for_any_method(monkeypatch):
+    script = Script(httpx.ConnectError("нет соединения"), httpx.PoolTimeout("пул занят"), ok())
+    result, delays = run_call(monkeypatch, script, "sendMessage")
+    assert result == {"ok": True, "result": True}
+    assert script.calls == ["sendMessage"] * 3
+    assert delays == [0.5, 1.0]
+
+
+def test_read_errors_and_5xx_are_not_retried_for_send(monkeypatch):
+    # запрос мог дойти до Telegram: повтор отправил бы пользователю дубль
+    script = Script(httpx.ReadTimeout("нет ответа"))
+    with pytest.raises(httpx.ReadTimeout):
+        run_call(monkeypatch, script, "sendMessage")
+    assert script.calls == ["sendMessage"]
+
+    script = Script(httpx.Response(502, json={"ok": False, "error_code": 502}))
+    result, delays = run_call(monkeypatch, script, "sendMessage")
+    assert result["error_code"] == 502
+    assert script.calls == ["sendMessage"] and delays == []
+
+
+def test_read_errors_and_5xx_are_retried_for_idempotent_methods(monkeypatch):
+    script = Script(httpx.ReadTimeout("нет ответа"), httpx.Response(503, text="<html>"), ok())
+    result, delays = run_call(monkeypatch, script, "setWebhook")
+    assert result["ok"] is True
+    assert script.calls == ["setWebhook"] * 3
+
+
+def test_429_waits_retry_after(monkeypatch):
+    too_many = httpx.Response(429, json={"ok": False, "parameters": {"retry_after": 7}})
+    script = Script(too_many, ok())
+    result, delays = run_call(monkeypatch, script, "sendMessage")
+    assert result["ok"] is True
+    assert delays == [7]
+
+
+# ================== Понятные ошибки =================
+def test_html_error_page_raises_clear_error(monkeypatch):
+    # прокси вернул HTML вместо JSON: не JSONDecodeError, а ошибка с методом и статусом
+    script = Script(httpx.Response(502, text="<html>Bad Gateway</html>"))
+    with pytest.raises(TelegramHTTPError) as err:
+        run_call(monkeypatch, script, "sendMessage")
+    assert err.value.method == "sendMessage"
+    assert err.value.status_code == 502
+
+
+def test_last_attempt_raises_instead_of_parsing(monkeypatch):
+    script = Script(*[httpx.Response(502, text="<html>Bad Gateway</html>")] * 3)
+    with pytest.raises(TelegramHTTPError) as err:
+        run_call(monkeypatch, script, "getMe")
+    assert err.value.status_code == 502
+    assert script.calls == ["getMe"] * 3
+
+    script = Script(httpx.ConnectError("нет соединения"), httpx.ConnectError("нет соединения"))
+    with pytest.raises(httpx.ConnectError):
+        run_call(monkeypatch, script, "sendMessage", retries=1)